@@ -3,6 +3,9 @@ from django.contrib.auth.models import User
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 
+from core import images
+from .tasks import send_welcome_email
+
 
 class Address(models.Model):
     """
@@ -65,6 +68,7 @@ class Profile(models.Model):
     postal_code = models.CharField(max_length=20, blank=True)
     country = models.CharField(max_length=100, blank=True)
     profile_picture = models.ImageField(upload_to='profile_pics/', blank=True, null=True)
+    profile_picture_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
@@ -79,13 +83,22 @@ class Profile(models.Model):
 # Signal to automatically create a profile when a user is created
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
-    """Create a Profile instance when a new User is created"""
+    """Create a Profile instance when a new User is created
+
+    A single insert, kept inline because the signup response already reads
+    user.profile; anything slower belongs in a task (see accounts.tasks).
+    """
     if created:
         Profile.objects.create(user=instance)
 
+@receiver(post_save, sender=Profile)
+def build_profile_picture_derivatives(sender, instance, **kwargs):
+    """Resize a new profile picture in the background"""
+    if images.needs_derivatives(instance, 'profile_picture', 'profile_picture_derivatives'):
+        images.schedule(instance, 'profile_picture', 'profile_picture_derivatives')
+
 @receiver(post_save, sender=User)
 def send_mail_reciever(sender, instance, **kwargs):
-    """Send welcome email when a new user is created"""
+    """Queue the welcome email when a new user is created"""
     if kwargs.get('created', False):
-        # Logic to send email goes here
-        pass
\ No newline at end of file
+        send_welcome_email.enqueue(instance.pk, idempotency_key=f'welcome-email:{instance.pk}')
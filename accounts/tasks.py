@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.mail import send_mail
+
+from core.tasks import task
+
+
+@task(max_attempts=5, backoff=10)
+def send_welcome_email(user_id):
+    """Welcome a newly registered user"""
+    user = User.objects.filter(pk=user_id).first()
+    if user is None or not user.email:
+        return
+    send_mail(
+        'Welcome to Abhirang',
+        f"Hi {user.first_name or user.username},\n\n"
+        "Thanks for creating an account with Abhirang. You can manage your profile "
+        "and addresses from your account page.\n\nHappy shopping!",
+        settings.DEFAULT_FROM_EMAIL,
+        [user.email],
+    )
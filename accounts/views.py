@@ -4,6 +4,7 @@ from django.contrib.auth.views import LoginView, LogoutView
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.views import View
+from cart.session import merge_session_cart
 from .forms import CustomUserCreationForm, CustomAuthenticationForm, ProfileUpdateForm
 from .models import Profile
 
@@ -22,6 +23,7 @@ def signup_view(request):
             user = form.save()
             # Auto-login after signup
             login(request, user)
+            merge_session_cart(request, user)
             messages.success(request, 'Account created successfully! Welcome to Abhirang!')
             return redirect('products:product_list')
         else:
@@ -46,6 +48,7 @@ def login_view(request):
             user = authenticate(username=username, password=password)
             if user is not None:
                 login(request, user)
+                merge_session_cart(request, user)
                 messages.success(request, f'Welcome back, {username}!')
                 return redirect("products:product_list")
         else:
@@ -94,13 +97,9 @@ def profile_view(request):
     from .models import Address
     addresses = Address.objects.filter(user=request.user)
     
-    # Get user's orders (if order model exists)
-    orders = []
-    try:
-        from cart.models import Order
-        orders = Order.objects.filter(user=request.user).order_by('-created_at')[:10]
-    except:
-        pass
+    # Get user's latest orders
+    from cart.models import Order
+    orders = Order.objects.filter(user=request.user).prefetch_related('items__product')[:10]
     
     context = {
         'profile_form': profile_form,
@@ -1,5 +1,66 @@
+from decimal import Decimal
+
 from django.contrib import admin
-from .models import Cart, CartItem
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.paginator import EstimatedCountPaginator
+from .models import Cart, CartItem, Order, OrderItem
+
+
+class RangeListFilter(admin.SimpleListFilter):
+    """Filter a numeric column (or annotation) by the ranges in ``ranges``"""
+    field = None
+    # (value, label, lower bound or None, upper bound or None), bounds as [lower, upper)
+    ranges = []
+    
+    def lookups(self, request, model_admin):
+        return [(value, label) for value, label, _, _ in self.ranges]
+    
+    def queryset(self, request, queryset):
+        for value, _, lower, upper in self.ranges:
+            if self.value() == value:
+                if lower is not None:
+                    queryset = queryset.filter(**{f'{self.field}__gte': lower})
+                if upper is not None:
+                    queryset = queryset.filter(**{f'{self.field}__lt': upper})
+                return queryset
+        return queryset
+
+
+class CartSubtotalFilter(RangeListFilter):
+    title = 'subtotal'
+    parameter_name = 'subtotal'
+    field = 'subtotal_amount'
+    ranges = [
+        ('empty', 'Empty', None, Decimal('0.01')),
+        ('under-1000', 'Under ₹1,000', Decimal('0.01'), 1000),
+        ('1000-4999', '₹1,000 – ₹4,999', 1000, 5000),
+        ('5000-up', '₹5,000 and up', 5000, None),
+    ]
+
+
+class CartItemCountFilter(RangeListFilter):
+    title = 'items'
+    parameter_name = 'items'
+    field = 'item_count'
+    ranges = [
+        ('0', 'None', None, 1),
+        ('1-2', '1 – 2', 1, 3),
+        ('3-5', '3 – 5', 3, 6),
+        ('6-up', '6 or more', 6, None),
+    ]
+
+
+class LineSubtotalFilter(RangeListFilter):
+    title = 'subtotal'
+    parameter_name = 'subtotal'
+    field = 'line_subtotal'
+    ranges = [
+        ('under-500', 'Under ₹500', None, 500),
+        ('500-1999', '₹500 – ₹1,999', 500, 2000),
+        ('2000-up', '₹2,000 and up', 2000, None),
+    ]
 
 
 class CartItemInline(admin.TabularInline):
@@ -8,47 +69,78 @@ class CartItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ['added_at', 'updated_at', 'subtotal', 'price']
     fields = ['product', 'quantity', 'size', 'price', 'subtotal', 'added_at']
+    raw_id_fields = ['product']
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_line_totals().select_related('product')
     
     def subtotal(self, obj):
-        return f"₹{obj.subtotal}"
+        return f"₹{obj.line_subtotal}"
     subtotal.short_description = 'Subtotal'
     
     def price(self, obj):
-        return f"₹{obj.price}"
+        return f"₹{obj.unit_price}"
     price.short_description = 'Price'
 
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    """Admin for Cart model"""
-    list_display = ['user', 'total_items', 'cart_subtotal', 'cart_total', 'created_at', 'updated_at']
-    list_filter = ['created_at', 'updated_at']
+    """Admin for Cart model; totals are the stored columns, so they sort and filter without reading items"""
+    list_display = ['user', 'line_count', 'total_items', 'cart_subtotal', 'cart_total', 'created_at', 'updated_at']
+    list_filter = [CartSubtotalFilter, CartItemCountFilter, 'created_at', 'updated_at']
     search_fields = ['user__username', 'user__email']
     readonly_fields = ['created_at', 'updated_at', 'total_items', 'cart_subtotal', 'cart_total', 'total_discount']
+    list_select_related = ['user']
+    raw_id_fields = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     inlines = [CartItemInline]
     
+    def get_queryset(self, request):
+        # A correlated count only runs for the rows on the page, unless it is the sort key
+        lines = CartItem.objects.filter(cart=OuterRef('pk')).order_by().values('cart').annotate(n=Count('pk'))
+        return super().get_queryset(request).annotate(line_count=Coalesce(Subquery(lines.values('n')), 0))
+    
+    def line_count(self, obj):
+        return obj.line_count
+    line_count.short_description = 'Lines'
+    line_count.admin_order_field = 'line_count'
+    
+    def total_items(self, obj):
+        return obj.item_count
+    total_items.short_description = 'Items'
+    total_items.admin_order_field = 'item_count'
+    
     def cart_subtotal(self, obj):
-        return f"₹{obj.subtotal}"
+        return f"₹{obj.subtotal_amount}"
     cart_subtotal.short_description = 'Subtotal'
-    cart_subtotal.admin_order_field = 'id'
+    cart_subtotal.admin_order_field = 'subtotal_amount'
     
     def cart_total(self, obj):
         return f"₹{obj.total}"
     cart_total.short_description = 'Total'
+    cart_total.admin_order_field = 'subtotal_amount'
     
     def total_discount(self, obj):
-        return f"₹{obj.total_discount}"
+        return f"₹{obj.discount_amount}"
     total_discount.short_description = 'Discount'
+    total_discount.admin_order_field = 'discount_amount'
 
 
 @admin.register(CartItem)
 class CartItemAdmin(admin.ModelAdmin):
-    """Admin for CartItem model"""
+    """Admin for CartItem model; prices are annotated from the joined product, so they sort and filter in SQL"""
     list_display = ['id', 'cart_user', 'product', 'quantity', 'size', 'item_price', 'item_subtotal', 'added_at']
-    list_filter = ['added_at', 'updated_at', 'size']
+    list_filter = [LineSubtotalFilter, 'added_at', 'updated_at', 'size']
     search_fields = ['product__name', 'cart__user__username']
     readonly_fields = ['added_at', 'updated_at', 'price', 'subtotal', 'discount_amount']
     list_select_related = ['cart__user', 'product']
+    raw_id_fields = ['cart', 'product']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_line_totals()
     
     def cart_user(self, obj):
         return obj.cart.user.username
@@ -56,9 +148,32 @@ class CartItemAdmin(admin.ModelAdmin):
     cart_user.admin_order_field = 'cart__user__username'
     
     def item_price(self, obj):
-        return f"₹{obj.price}"
+        return f"₹{obj.unit_price}"
     item_price.short_description = 'Price'
+    item_price.admin_order_field = 'unit_price'
     
     def item_subtotal(self, obj):
-        return f"₹{obj.subtotal}"
+        return f"₹{obj.line_subtotal}"
     item_subtotal.short_description = 'Subtotal'
+    item_subtotal.admin_order_field = 'line_subtotal'
+
+
+class OrderItemInline(admin.TabularInline):
+    """Inline for order items in order admin"""
+    model = OrderItem
+    extra = 0
+    readonly_fields = ['product', 'product_name', 'size', 'quantity', 'unit_price', 'original_unit_price']
+    can_delete = False
+
+
+@admin.register(Order)
+class OrderAdmin(admin.ModelAdmin):
+    """Admin for Order model"""
+    list_display = ['id', 'user', 'status', 'item_count', 'total', 'created_at']
+    list_filter = ['status', 'created_at']
+    search_fields = ['id', 'user__username', 'user__email']
+    readonly_fields = ['user', 'item_count', 'subtotal', 'discount', 'total', 'created_at', 'updated_at']
+    list_select_related = ['user']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    inlines = [OrderItemInline]
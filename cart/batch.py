@@ -0,0 +1,282 @@
+"""
+Batched cart operations for the JSON cart API.
+
+A request carries a list of operations::
+
+    {"operations": [
+        {"op": "add", "product_id": 7, "quantity": 2, "size": "M"},
+        {"op": "set_quantity", "item_id": 12, "quantity": 3},
+        {"op": "change_size", "item_id": 12, "size": "L"},
+        {"op": "remove", "item_id": 9}
+    ]}
+
+They are replayed in memory against the cart's current lines and written
+back in one transaction: one DELETE, one bulk UPDATE and one bulk upsert,
+whatever the number of operations. Quantities are capped by stock. The
+response state (lines, per-line subtotals and cart totals) comes from a
+single query, with the totals computed as window aggregates over the lines.
+"""
+import copy
+
+from django.db import connection, transaction
+from django.db.models import F, Sum, Window
+from django.utils import timezone
+
+from products.models import Product
+from .models import MONEY, Cart, CartItem, _line_totals
+from .mutations import CartUpdate, _apply_totals, _refresh_totals
+
+OPERATIONS = ('add', 'set_quantity', 'remove', 'change_size')
+MAX_OPERATIONS = 50
+SIZE_MAX_LENGTH = CartItem._meta.get_field('size').max_length
+
+
+class CartOperationError(ValueError):
+    """An operation in the batch is malformed; nothing in the batch is applied"""
+
+    def __init__(self, index, message):
+        self.index = index
+        super().__init__(f'operation {index}: {message}')
+
+
+def _integer(operation, index, key, default=None, minimum=0):
+    value = operation.get(key, default)
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        raise CartOperationError(index, f'{key} must be an integer')
+    try:
+        value = int(value)
+    except ValueError:
+        raise CartOperationError(index, f'{key} must be an integer')
+    if value < minimum:
+        raise CartOperationError(index, f'{key} must be at least {minimum}')
+    return value
+
+
+def parse_operations(payload):
+    """Validate a decoded JSON payload into a list of normalised operations"""
+    operations = payload.get('operations') if isinstance(payload, dict) else None
+    if not isinstance(operations, list) or not operations:
+        raise CartOperationError(None, 'operations must be a non-empty list')
+    if len(operations) > MAX_OPERATIONS:
+        raise CartOperationError(None, f'at most {MAX_OPERATIONS} operations per request')
+
+    parsed = []
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict) or operation.get('op') not in OPERATIONS:
+            raise CartOperationError(index, f'op must be one of {", ".join(OPERATIONS)}')
+        op = operation['op']
+        if op == 'add':
+            parsed_op = {
+                'op': op,
+                'product_id': _integer(operation, index, 'product_id', minimum=1),
+                'quantity': _integer(operation, index, 'quantity', default=1, minimum=1),
+            }
+        else:
+            parsed_op = {'op': op, 'item_id': _integer(operation, index, 'item_id', minimum=1)}
+            if op == 'set_quantity':
+                parsed_op['quantity'] = _integer(operation, index, 'quantity')
+        if op in ('add', 'change_size'):
+            size = operation.get('size') or ''
+            if not isinstance(size, str) or len(size) > SIZE_MAX_LENGTH:
+                raise CartOperationError(index, f'size must be a string of at most {SIZE_MAX_LENGTH} characters')
+            parsed_op['size'] = size
+        parsed.append(parsed_op)
+    return parsed
+
+
+class _Line:
+
+    def __init__(self, product_id, size, quantity, item=None):
+        self.product_id = product_id
+        self.size = size
+        self.quantity = quantity
+        self.item = item
+
+
+def _replay(lines, by_item, operations, products, warnings):
+    """Apply the operations to the in-memory lines, keyed by (product_id, size)"""
+    for index, operation in enumerate(operations):
+        op = operation['op']
+        if op == 'add':
+            product = products.get(operation['product_id'])
+            if product is None or not product.in_stock:
+                warnings.append({'operation': index, 'code': 'out_of_stock'})
+                continue
+            key = (product.pk, operation['size'])
+            line = lines.setdefault(key, _Line(product.pk, operation['size'], 0))
+            line.quantity += operation['quantity']
+            continue
+
+        line = by_item.get(operation['item_id'])
+        if line is None or lines.get((line.product_id, line.size)) is not line:
+            raise CartOperationError(index, f'no cart item {operation["item_id"]}')
+        if op == 'remove':
+            line.quantity = 0
+        elif op == 'set_quantity':
+            line.quantity = operation['quantity']
+        elif op == 'change_size' and operation['size'] != line.size:
+            del lines[(line.product_id, line.size)]
+            target = lines.get((line.product_id, operation['size']))
+            if target is not None:
+                # Moving onto an existing size folds the two lines together
+                target.quantity += line.quantity
+                by_item[operation['item_id']] = target
+            else:
+                moved = _Line(line.product_id, operation['size'], line.quantity)
+                lines[(moved.product_id, moved.size)] = moved
+                by_item[operation['item_id']] = moved
+            line.quantity = 0
+
+
+def apply_operations(cart, operations):
+    """Apply parsed operations to a user's cart in one transaction; returns stock warnings"""
+    warnings = []
+    with transaction.atomic():
+        list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk'))
+        items = list(cart.items.order_by())
+        lines, by_item = {}, {}
+        for item in items:
+            line = _Line(item.product_id, item.size, item.quantity, item)
+            lines[(item.product_id, item.size)] = line
+            by_item[item.pk] = line
+
+        product_ids = {item.product_id for item in items}
+        product_ids.update(op['product_id'] for op in operations if op['op'] == 'add')
+        products = Product.objects.only('stock', 'is_available').in_bulk(product_ids)
+
+        _replay(lines, by_item, operations, products, warnings)
+
+        final = {}
+        for key, line in lines.items():
+            product = products.get(line.product_id)
+            quantity = min(line.quantity, product.stock) if product and product.is_available else 0
+            if quantity < line.quantity:
+                warnings.append({'product_id': line.product_id, 'size': line.size, 'code': 'capped', 'stock': quantity})
+            if quantity > 0:
+                final[key] = quantity
+
+        kept = {}
+        for item in items:
+            key = (item.product_id, item.size)
+            if key in final and lines.get(key) is not None and lines[key].item is item:
+                kept[key] = item
+        removed = [item.pk for item in items if (item.product_id, item.size) not in kept]
+
+        now = timezone.now()
+        changed = []
+        for key, item in kept.items():
+            if item.quantity != final[key]:
+                item.quantity, item.updated_at = final[key], now
+                changed.append(item)
+        created = [
+            CartItem(cart=cart, product_id=product_id, size=size, quantity=quantity, added_at=now, updated_at=now)
+            for (product_id, size), quantity in final.items() if (product_id, size) not in kept
+        ]
+
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        if changed:
+            CartItem.objects.bulk_update(changed, ['quantity', 'updated_at'])
+        if created:
+            CartItem.objects.bulk_create(
+                created,
+                update_conflicts=True,
+                unique_fields=['cart', 'product', 'size'],
+                update_fields=['quantity', 'updated_at'],
+            )
+        with connection.cursor() as cursor:
+            _apply_totals(cart, CartUpdate(None, None, None, _refresh_totals(cursor, cart.pk)))
+    return warnings
+
+
+def cart_state(cart):
+    """Lines, line subtotals and cart totals for the API, read in one query"""
+    rows = _line_totals(cart.items.order_by('-added_at', '-id')).annotate(
+        name=F('product__name'),
+        slug=F('product__slug'),
+        price=F('product__price'),
+        discount_price=F('product__discount_price'),
+        cart_items=Window(Sum('quantity')),
+        cart_subtotal=Window(Sum('line_subtotal'), output_field=MONEY),
+        cart_discount=Window(Sum('line_discount'), output_field=MONEY),
+    ).values(
+        'id', 'product_id', 'name', 'slug', 'size', 'quantity', 'price', 'discount_price',
+        'line_subtotal', 'line_discount', 'cart_items', 'cart_subtotal', 'cart_discount',
+    )
+    rows = list(rows)
+    totals = rows[0] if rows else {'cart_items': 0, 'cart_subtotal': 0, 'cart_discount': 0}
+    return {
+        'items': [
+            {
+                'id': row['id'],
+                'product_id': row['product_id'],
+                'name': row['name'],
+                'slug': row['slug'],
+                'size': row['size'],
+                'quantity': row['quantity'],
+                'unit_price': float(row['discount_price'] or row['price']),
+                'subtotal': float(row['line_subtotal']),
+                'discount': float(row['line_discount']),
+            }
+            for row in rows
+        ],
+        'total_items': totals['cart_items'],
+        'subtotal': float(totals['cart_subtotal']),
+        'discount': float(totals['cart_discount']),
+        'total': float(totals['cart_subtotal']),
+    }
+
+
+def apply_session_operations(session_cart, operations):
+    """Apply parsed operations to an anonymous session cart; returns stock warnings"""
+    snapshot = copy.deepcopy((session_cart.lines, session_cart.next_id))
+    warnings = []
+    products = Product.objects.in_bulk({op['product_id'] for op in operations if op['op'] == 'add'})
+    try:
+        for index, operation in enumerate(operations):
+            op = operation['op']
+            if op == 'add':
+                product = products.get(operation['product_id'])
+                update = session_cart.add(product, operation['quantity'], operation['size']) if product else None
+                if update is None:
+                    warnings.append({'operation': index, 'code': 'out_of_stock'})
+                continue
+            if str(operation['item_id']) not in session_cart.lines:
+                raise CartOperationError(index, f'no cart item {operation["item_id"]}')
+            if op == 'remove':
+                session_cart.remove(operation['item_id'])
+            elif op == 'set_quantity':
+                session_cart.set_quantity(operation['item_id'], operation['quantity'])
+            else:
+                session_cart.change_size(operation['item_id'], operation['size'])
+    except CartOperationError:
+        # Same all-or-nothing contract as the database cart
+        session_cart.lines, session_cart.next_id = snapshot
+        session_cart.save()
+        raise
+    return warnings
+
+
+def session_cart_state(session_cart):
+    """The same state shape for an anonymous session cart"""
+    items = session_cart.items()
+    return {
+        'items': [
+            {
+                'id': item.id,
+                'product_id': item.product.pk,
+                'name': item.product.name,
+                'slug': item.product.slug,
+                'size': item.size,
+                'quantity': item.quantity,
+                'unit_price': float(item.price),
+                'subtotal': float(item.subtotal),
+                'discount': float(item.discount_amount),
+            }
+            for item in items
+        ],
+        'total_items': session_cart.total_items,
+        'subtotal': float(session_cart.subtotal),
+        'discount': float(session_cart.total_discount),
+        'total': float(session_cart.total),
+    }
@@ -0,0 +1,106 @@
+"""
+Turning a cart into an order.
+
+``place_order()`` runs in one transaction:
+
+1. lock the cart row, so the same cart cannot be checked out twice;
+2. reserve stock with one conditional ``UPDATE ... SET stock = stock - n
+   WHERE id = ... AND stock >= n`` per product, never reading stock into
+   Python first, visiting products in ascending id order so concurrent
+   checkouts take their row locks in the same order and cannot deadlock.
+   The same statement touches ``updated_at``, since product pages, cards
+   and their validators show the stock;
+3. write the order with prices snapshotted from the cart items, and
+   empty the cart.
+
+If any product is short the transaction rolls back and every
+reservation made so far is released with it.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from products import homepage
+from products.cache import FACETS, PRODUCT, RELATED, catalog_cache
+from products.models import Product
+from .models import Cart, Order, OrderItem
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class EmptyCartError(CheckoutError):
+    pass
+
+
+class OutOfStockError(CheckoutError):
+
+    def __init__(self, product, requested):
+        self.product = product
+        self.requested = requested
+        super().__init__(f'Not enough stock for {product.name} (requested {requested})')
+
+
+def reserve_stock(quantities):
+    """Decrement stock for {product_id: quantity}; raise OutOfStockError if any is short"""
+    for product_id in sorted(quantities):
+        quantity = quantities[product_id]
+        reserved = Product.objects.filter(
+            pk=product_id, is_available=True, stock__gte=quantity
+        ).update(stock=F('stock') - quantity, updated_at=timezone.now())
+        if not reserved:
+            raise OutOfStockError(Product.objects.get(pk=product_id), quantity)
+
+
+def place_order(user, shipping_address=''):
+    """Check out the user's cart and return the new Order"""
+    with transaction.atomic():
+        try:
+            cart = Cart.objects.select_for_update().get(user=user)
+        except Cart.DoesNotExist:
+            raise EmptyCartError('Your cart is empty')
+
+        items = list(cart.items.select_related('product').order_by('product_id', 'pk'))
+        if not items:
+            raise EmptyCartError('Your cart is empty')
+
+        quantities = defaultdict(int)
+        for item in items:
+            quantities[item.product_id] += item.quantity
+        reserve_stock(quantities)
+
+        order = Order.objects.create(
+            user=user,
+            shipping_address=shipping_address,
+            item_count=sum(item.quantity for item in items),
+            subtotal=sum((item.original_subtotal for item in items), Decimal('0.00')),
+            discount=sum((item.discount_amount for item in items), Decimal('0.00')),
+            total=sum((item.subtotal for item in items), Decimal('0.00')),
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(
+                order=order,
+                product=item.product,
+                product_name=item.product.name,
+                size=item.size,
+                quantity=item.quantity,
+                unit_price=item.price,
+                original_unit_price=item.original_price,
+            )
+            for item in items
+        ])
+
+        cart.items.all().delete()
+        cart.update_totals()
+
+        # Cached product pages show the stock count
+        transaction.on_commit(lambda: catalog_cache.bump(PRODUCT))
+        # Stock facets, related products and the homepage only change once something sells out
+        if Product.objects.filter(pk__in=list(quantities), stock=0).exists():
+            transaction.on_commit(lambda: catalog_cache.bump(FACETS, RELATED))
+            transaction.on_commit(homepage.invalidate)
+    return order
@@ -0,0 +1,16 @@
+from .models import Cart
+from .session import SessionCart
+
+
+def cart(request):
+    """Navbar badge count; anonymous carts are read straight from the session
+
+    A signed-in user's count is the cart's stored item_count, one indexed
+    lookup that always reflects changes made from other sessions.
+    """
+    def cart_count():
+        if request.user.is_authenticated:
+            return Cart.objects.filter(user=request.user).values_list('item_count', flat=True).first() or 0
+        return SessionCart(request.session).total_items
+
+    return {'cart_count': cart_count}
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F, Q
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Check the stored cart totals against the cart items and rebuild any that drifted'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report carts whose stored totals drifted; exit with an error if any did',
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Rebuild every cart instead of only the drifted ones',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Number of carts rebuilt per UPDATE (default: 1000)',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be a positive integer')
+
+        carts = Cart.objects.order_by('pk')
+        if not options['all']:
+            carts = carts.with_computed_totals().filter(
+                ~Q(item_count=F('computed_item_count')) |
+                ~Q(subtotal_amount=F('computed_subtotal_amount')) |
+                ~Q(discount_amount=F('computed_discount_amount'))
+            )
+        cart_ids = list(carts.values_list('pk', flat=True))
+
+        if options['check']:
+            if cart_ids:
+                raise CommandError(
+                    f'{len(cart_ids)} cart(s) have drifted totals: '
+                    + ', '.join(str(pk) for pk in cart_ids[:20])
+                    + (' ...' if len(cart_ids) > 20 else '')
+                )
+            self.stdout.write(self.style.SUCCESS('All cart totals are consistent'))
+            return
+
+        rebuilt = 0
+        for start in range(0, len(cart_ids), batch_size):
+            with transaction.atomic():
+                rebuilt += Cart.objects.filter(
+                    pk__in=cart_ids[start:start + batch_size]
+                ).recalculate_totals()
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt totals for {rebuilt} cart(s)'))
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:39
+
+from decimal import Decimal
+from django.db import migrations, models
+
+
+def backfill_cart_totals(apps, schema_editor):
+    Cart = apps.get_model('cart', 'Cart')
+    CartItem = apps.get_model('cart', 'CartItem')
+    for cart in Cart.objects.all().iterator():
+        item_count = 0
+        subtotal = Decimal('0.00')
+        discount = Decimal('0.00')
+        for item in CartItem.objects.filter(cart=cart).select_related('product'):
+            product = item.product
+            price = product.discount_price if product.discount_price else product.price
+            item_count += item.quantity
+            subtotal += price * item.quantity
+            if product.discount_price:
+                discount += (product.price - price) * item.quantity
+        Cart.objects.filter(pk=cart.pk).update(
+            item_count=item_count, subtotal_amount=subtotal, discount_amount=discount
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='discount_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='cart',
+            name='subtotal_amount',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12),
+        ),
+        migrations.RunPython(backfill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:52
+
+from django.db import migrations, models
+from django.db.models import Q
+
+
+def merge_blank_sizes(apps, schema_editor):
+    # NULL sizes never conflict in a unique index, so one product could sit on
+    # several lines; fold them into a single '' line before making size NOT NULL
+    CartItem = apps.get_model('cart', 'CartItem')
+    lines = {}
+    blank = CartItem.objects.filter(Q(size__isnull=True) | Q(size='')).order_by('added_at', 'id')
+    for item in blank.iterator():
+        key = (item.cart_id, item.product_id)
+        if key in lines:
+            kept = lines[key]
+            kept.quantity += item.quantity
+            item.delete()
+        else:
+            lines[key] = item
+    for item in lines.values():
+        item.size = ''
+        item.save(update_fields=['size', 'quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0003_order'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_blank_sizes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cartitem',
+            name='size',
+            field=models.CharField(blank=True, default='', max_length=10),
+        ),
+    ]
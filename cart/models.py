@@ -1,15 +1,78 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, DecimalField, ExpressionWrapper, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from django.contrib.auth.models import User
 from products.models import Product
 from decimal import Decimal
 
 
+MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def _line_totals(items):
+    """Annotate cart items with their discounted unit price, line total and line discount"""
+    unit_price = Case(
+        When(product__discount_price__gt=0, then=F('product__discount_price')),
+        default=F('product__price'),
+        output_field=MONEY,
+    )
+    unit_discount = Case(
+        When(product__discount_price__gt=0, then=F('product__price') - F('product__discount_price')),
+        default=Value(Decimal('0.00')),
+        output_field=MONEY,
+    )
+    return items.annotate(
+        unit_price=unit_price,
+        line_subtotal=ExpressionWrapper(unit_price * F('quantity'), output_field=MONEY),
+        line_discount=ExpressionWrapper(unit_discount * F('quantity'), output_field=MONEY),
+    )
+
+
+def _computed_totals():
+    """Correlated subqueries computing a cart's totals from its items"""
+    items = _line_totals(CartItem.objects.filter(cart=OuterRef('pk'))).order_by().values('cart')
+    zero = Value(Decimal('0.00'))
+    return {
+        'item_count': Coalesce(Subquery(items.annotate(s=Sum('quantity')).values('s')), 0),
+        'subtotal_amount': Coalesce(
+            Subquery(items.annotate(s=Sum('line_subtotal')).values('s')), zero, output_field=MONEY
+        ),
+        'discount_amount': Coalesce(
+            Subquery(items.annotate(s=Sum('line_discount')).values('s')), zero, output_field=MONEY
+        ),
+    }
+
+
+class CartQuerySet(models.QuerySet):
+
+    def with_computed_totals(self):
+        """Annotate carts with computed_<field> totals derived from their items"""
+        return self.annotate(**{
+            f'computed_{name}': expression for name, expression in _computed_totals().items()
+        })
+
+    def recalculate_totals(self):
+        """Rebuild the stored totals of every cart in the queryset with one UPDATE"""
+        return self.update(**_computed_totals())
+
+
 class Cart(models.Model):
     """Shopping cart for each user"""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='cart')
+    
+    # Running totals, kept in step with CartItem writes
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    discount_amount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Shopping Cart'
         verbose_name_plural = 'Shopping Carts'
@@ -20,27 +83,54 @@ class Cart(models.Model):
     
     @property
     def subtotal(self):
-        """Calculate cart subtotal (sum of all item subtotals)"""
-        return sum(item.subtotal for item in self.items.all())
+        """Cart subtotal (sum of all item subtotals)"""
+        return self.subtotal_amount
     
     @property
     def total_items(self):
         """Total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
     
     @property
     def total_discount(self):
         """Total discount amount"""
-        return sum(item.discount_amount for item in self.items.all())
+        return self.discount_amount
     
     @property
     def total(self):
         """Final total after discounts"""
         return self.subtotal
     
+    def update_totals(self):
+        """Recompute the stored totals from the cart items with one aggregate query"""
+        totals = _line_totals(self.items.order_by()).aggregate(
+            item_count=Sum('quantity'),
+            subtotal_amount=Sum('line_subtotal'),
+            discount_amount=Sum('line_discount'),
+        )
+        self.item_count = totals['item_count'] or 0
+        self.subtotal_amount = totals['subtotal_amount'] or Decimal('0.00')
+        self.discount_amount = totals['discount_amount'] or Decimal('0.00')
+        self.updated_at = timezone.now()
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=self.item_count,
+            subtotal_amount=self.subtotal_amount,
+            discount_amount=self.discount_amount,
+            updated_at=self.updated_at,
+        )
+    
     def clear(self):
         """Remove all items from cart"""
-        self.items.all().delete()
+        with transaction.atomic():
+            self.items.all().delete()
+            self.update_totals()
+
+
+class CartItemQuerySet(models.QuerySet):
+
+    def with_line_totals(self):
+        """Annotate items with unit_price, line_subtotal and line_discount from their product's prices"""
+        return _line_totals(self)
 
 
 class CartItem(models.Model):
@@ -48,10 +138,12 @@ class CartItem(models.Model):
     cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(default=1)
-    size = models.CharField(max_length=10, blank=True, null=True)
+    size = models.CharField(max_length=10, blank=True, default='')
     added_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = CartItemQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Cart Item'
         verbose_name_plural = 'Cart Items'
@@ -62,6 +154,18 @@ class CartItem(models.Model):
         size_info = f" ({self.size})" if self.size else ""
         return f"{self.quantity}x {self.product.name}{size_info} in {self.cart.user.username}'s cart"
     
+    def save(self, *args, **kwargs):
+        # Keep the cart's stored totals in the same transaction as the item write
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.cart.update_totals()
+    
+    def delete(self, *args, **kwargs):
+        with transaction.atomic():
+            result = super().delete(*args, **kwargs)
+            self.cart.update_totals()
+        return result
+    
     @property
     def price(self):
         """Get the current price of the product"""
@@ -95,14 +199,102 @@ class CartItem(models.Model):
         return self.product.discount_price is not None
     
     def increase_quantity(self, amount=1):
-        """Increase item quantity"""
-        self.quantity += amount
-        self.save()
+        """Increase item quantity, capped by the product's stock"""
+        from .mutations import change_quantity
+        self._apply_update(change_quantity(self.cart, self.pk, amount))
     
     def decrease_quantity(self, amount=1):
-        """Decrease item quantity"""
-        if self.quantity > amount:
-            self.quantity -= amount
-            self.save()
+        """Decrease item quantity, removing the item once it reaches zero"""
+        from .mutations import change_quantity
+        self._apply_update(change_quantity(self.cart, self.pk, -amount))
+    
+    def _apply_update(self, update):
+        if update is None or update.deleted:
+            self.pk = None
+            self.quantity = 0
         else:
-            self.delete()
+            self.quantity = update.quantity
+
+
+class Order(models.Model):
+    """Order placed from a user's cart, with prices snapshotted at checkout"""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('processing', 'Processing'),
+        ('shipped', 'Shipped'),
+        ('delivered', 'Delivered'),
+        ('cancelled', 'Cancelled'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    shipping_address = models.TextField(blank=True)
+    
+    # Totals at the time of checkout
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    discount = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = 'Order'
+        verbose_name_plural = 'Orders'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at']),
+        ]
+    
+    def __str__(self):
+        return f"Order #{self.pk} by {self.user.username}"
+
+
+class OrderItem(models.Model):
+    """Line of an order; keeps the product name and prices even if the product changes"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, related_name='order_items')
+    product_name = models.CharField(max_length=300)
+    size = models.CharField(max_length=10, blank=True, null=True)
+    quantity = models.PositiveIntegerField()
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    original_unit_price = models.DecimalField(max_digits=10, decimal_places=2)
+    
+    class Meta:
+        verbose_name = 'Order Item'
+        verbose_name_plural = 'Order Items'
+        ordering = ['pk']
+    
+    def __str__(self):
+        size_info = f" ({self.size})" if self.size else ""
+        return f"{self.quantity}x {self.product_name}{size_info}"
+    
+    @property
+    def subtotal(self):
+        """Line total at the snapshotted price"""
+        return self.unit_price * self.quantity
+
+
+# Product price changes and deletions reprice every cart holding the product
+@receiver(post_save, sender=Product)
+def reprice_carts_on_product_save(sender, instance, created, **kwargs):
+    """Recalculate stored totals of carts that contain the saved product"""
+    if not created:
+        Cart.objects.filter(items__product=instance).recalculate_totals()
+
+
+@receiver(pre_delete, sender=Product)
+def remember_carts_on_product_delete(sender, instance, **kwargs):
+    """Remember which carts hold the product before its items are cascaded away"""
+    instance._affected_cart_ids = list(
+        Cart.objects.filter(items__product=instance).values_list('pk', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Product)
+def reprice_carts_on_product_delete(sender, instance, **kwargs):
+    """Recalculate stored totals of carts that held the deleted product"""
+    cart_ids = getattr(instance, '_affected_cart_ids', None)
+    if cart_ids:
+        Cart.objects.filter(pk__in=cart_ids).recalculate_totals()
@@ -0,0 +1,228 @@
+"""
+Single-statement cart writes.
+
+Adding to the cart is one ``INSERT ... ON CONFLICT (cart, product, size)
+DO UPDATE SET quantity = quantity + n`` and quantity changes are one
+conditional ``UPDATE``, so double clicks and parallel tabs can neither
+lose an update nor trip the unique constraint. The product's stock caps
+the quantity inside the same statement. Each write is followed by one
+``UPDATE cart_cart ... RETURNING`` that refreshes the stored totals and
+hands them back, all in a single transaction.
+
+PostgreSQL and SQLite (3.35+) both support the ``ON CONFLICT`` and
+``RETURNING`` syntax used here; they only differ in the name of the
+scalar minimum function.
+"""
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from products.models import Product
+from .models import Cart, CartItem
+
+CENTS = Decimal('0.01')
+
+
+class CartUpdate:
+    """Outcome of a cart write: the line's new quantity (0 once removed) and the cart totals"""
+
+    def __init__(self, item_id, quantity, stock, totals):
+        self.item_id = item_id
+        self.quantity = quantity
+        self.stock = stock
+        self.item_count, self.subtotal, self.discount = totals
+
+    @property
+    def total(self):
+        return self.subtotal
+
+    @property
+    def deleted(self):
+        return self.quantity == 0
+
+    @property
+    def at_stock_limit(self):
+        """True when the line holds all the remaining stock, so stock may have capped it"""
+        return not self.deleted and self.stock is not None and self.quantity >= self.stock
+
+
+def _least():
+    return 'LEAST' if connection.vendor == 'postgresql' else 'MIN'
+
+
+def _tables():
+    quote = connection.ops.quote_name
+    return {
+        'cart': quote(Cart._meta.db_table),
+        'item': quote(CartItem._meta.db_table),
+        'product': quote(Product._meta.db_table),
+    }
+
+
+def _money(value):
+    return Decimal(str(value or 0)).quantize(CENTS)
+
+
+def _refresh_totals(cursor, cart_id):
+    """Recompute the stored cart totals and return them, in one statement"""
+    tables = _tables()
+    unit_price = 'CASE WHEN p.discount_price > 0 THEN p.discount_price ELSE p.price END'
+    unit_discount = 'CASE WHEN p.discount_price > 0 THEN p.price - p.discount_price ELSE 0 END'
+    lines = (
+        f'FROM {tables["item"]} i JOIN {tables["product"]} p ON p.id = i.product_id '
+        f'WHERE i.cart_id = {tables["cart"]}.id'
+    )
+    cursor.execute(
+        f'UPDATE {tables["cart"]} SET '
+        f'item_count = COALESCE((SELECT SUM(i.quantity) {lines}), 0), '
+        f'subtotal_amount = COALESCE((SELECT SUM({unit_price} * i.quantity) {lines}), 0), '
+        f'discount_amount = COALESCE((SELECT SUM({unit_discount} * i.quantity) {lines}), 0), '
+        f'updated_at = %s '
+        f'WHERE id = %s '
+        f'RETURNING item_count, subtotal_amount, discount_amount',
+        [timezone.now(), cart_id],
+    )
+    item_count, subtotal, discount = cursor.fetchone()
+    return int(item_count), _money(subtotal), _money(discount)
+
+
+def _apply_totals(cart, update):
+    if cart is not None:
+        cart.item_count = update.item_count
+        cart.subtotal_amount = update.subtotal
+        cart.discount_amount = update.discount
+    return update
+
+
+def _line_stock(tables):
+    """Correlated subquery for the stock of the product on the written cart line"""
+    return f'(SELECT s.stock FROM {tables["product"]} s WHERE s.id = {tables["item"]}.product_id)'
+
+
+def _line_update(cursor, cart, item_id, quantity, stock):
+    if quantity == 0:
+        # The product sold out underneath the line, so it goes entirely
+        cursor.execute(f'DELETE FROM {_tables()["item"]} WHERE id = %s', [item_id])
+    return CartUpdate(item_id, quantity, stock, _refresh_totals(cursor, cart.pk))
+
+
+def add_item(cart, product_id, quantity=1, size=''):
+    """Add quantity of a product to the cart; returns a CartUpdate, or None if it is unavailable"""
+    tables = _tables()
+    stock = _line_stock(tables)
+    quantity = max(int(quantity), 1)
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tables["item"]} (cart_id, product_id, size, quantity, added_at, updated_at) '
+            f'SELECT %s, p.id, %s, {_least()}(%s, p.stock), %s, %s '
+            f'FROM {tables["product"]} p '
+            f'WHERE p.id = %s AND p.is_available AND p.stock > 0 '
+            f'ON CONFLICT (cart_id, product_id, size) DO UPDATE SET '
+            f'quantity = {_least()}('
+            f'{tables["item"]}.quantity + excluded.quantity, '
+            f'{stock}'
+            f'), '
+            f'updated_at = excluded.updated_at '
+            f'RETURNING id, quantity, {stock}',
+            [cart.pk, size or '', quantity, now, now, product_id],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        item_id, new_quantity, stock = row
+        update = CartUpdate(item_id, new_quantity, stock, _refresh_totals(cursor, cart.pk))
+    return _apply_totals(cart, update)
+
+
+def change_quantity(cart, item_id, delta):
+    """Increase (or with a negative delta decrease) a line; it is removed once it reaches zero
+
+    The UPDATE never takes a line to zero or below. If a concurrent decrement
+    leaves too little for it, the DELETE is tried once more instead.
+    """
+    tables = _tables()
+    stock = _line_stock(tables)
+    with transaction.atomic(), connection.cursor() as cursor:
+        for _ in range(2):
+            if delta < 0:
+                cursor.execute(
+                    f'DELETE FROM {tables["item"]} WHERE id = %s AND cart_id = %s AND quantity <= %s RETURNING id',
+                    [item_id, cart.pk, -delta],
+                )
+                if cursor.fetchone() is not None:
+                    return _apply_totals(cart, CartUpdate(item_id, 0, None, _refresh_totals(cursor, cart.pk)))
+            cursor.execute(
+                f'UPDATE {tables["item"]} SET '
+                f'quantity = {_least()}(quantity + %s, {stock}), '
+                f'updated_at = %s '
+                f'WHERE id = %s AND cart_id = %s AND quantity + %s > 0 '
+                f'RETURNING quantity, {stock}',
+                [delta, timezone.now(), item_id, cart.pk, delta],
+            )
+            row = cursor.fetchone()
+            if row is not None or delta >= 0:
+                break
+            # A concurrent decrement landed after our DELETE; the line may now be small enough for it
+        if row is None:
+            return None
+        update = _line_update(cursor, cart, item_id, *row)
+    return _apply_totals(cart, update)
+
+
+def set_quantity(cart, item_id, quantity):
+    """Set a line to quantity (capped by stock); zero or less removes it"""
+    tables = _tables()
+    stock = _line_stock(tables)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if quantity <= 0:
+            cursor.execute(
+                f'DELETE FROM {tables["item"]} WHERE id = %s AND cart_id = %s RETURNING id',
+                [item_id, cart.pk],
+            )
+            if cursor.fetchone() is None:
+                return None
+            return _apply_totals(cart, CartUpdate(item_id, 0, None, _refresh_totals(cursor, cart.pk)))
+        cursor.execute(
+            f'UPDATE {tables["item"]} SET '
+            f'quantity = {_least()}(%s, {stock}), '
+            f'updated_at = %s '
+            f'WHERE id = %s AND cart_id = %s '
+            f'RETURNING quantity, {stock}',
+            [quantity, timezone.now(), item_id, cart.pk],
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        update = _line_update(cursor, cart, item_id, *row)
+    return _apply_totals(cart, update)
+
+
+def merge_items(cart, lines):
+    """Upsert many (product_id, size, quantity) lines into the cart in one statement"""
+    merged = {}
+    for product_id, size, quantity in lines:
+        key = (int(product_id), size or '')
+        merged[key] = merged.get(key, 0) + max(int(quantity), 1)
+    if not merged:
+        return cart
+    tables = _tables()
+    stock = _line_stock(tables)
+    # UNION ALL of SELECTs is the row source both vendors accept (SQLite cannot alias VALUES columns)
+    rows = ' UNION ALL '.join(['SELECT %s AS product_id, %s AS size, %s AS quantity'] * len(merged))
+    params = [value for (product_id, size), quantity in merged.items() for value in (product_id, size, quantity)]
+    now = timezone.now()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {tables["item"]} (cart_id, product_id, size, quantity, added_at, updated_at) '
+            f'SELECT %s, p.id, v.size, {_least()}(v.quantity, p.stock), %s, %s '
+            f'FROM ({rows}) v JOIN {tables["product"]} p ON p.id = v.product_id '
+            f'WHERE p.is_available AND p.stock > 0 '
+            f'ON CONFLICT (cart_id, product_id, size) DO UPDATE SET '
+            f'quantity = {_least()}({tables["item"]}.quantity + excluded.quantity, {stock}), '
+            f'updated_at = excluded.updated_at',
+            [cart.pk, now, now, *params],
+        )
+        _apply_totals(cart, CartUpdate(None, None, None, _refresh_totals(cursor, cart.pk)))
+    return cart
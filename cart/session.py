@@ -0,0 +1,209 @@
+"""
+Anonymous visitors' carts, kept in the session.
+
+Lines are stored as ``{line_id: {product, size, quantity, name, price,
+original_price}}``, so the navbar badge and the cart totals read nothing
+but the session. Prices are a snapshot taken when
+a line is written; rendering the cart re-prices the lines against the
+catalog. On login the lines are merged into the user's ``Cart`` with one
+bulk upsert (``mutations.merge_items``).
+"""
+from decimal import Decimal
+
+from products.models import Product
+from .models import Cart
+from .mutations import CartUpdate, merge_items
+
+SESSION_KEY = 'cart'
+
+
+class SessionCartItem:
+    """A session cart line with the CartItem attributes the cart template uses"""
+
+    def __init__(self, line_id, product, line):
+        self.id = self.pk = line_id
+        self.product = product
+        self.size = line['size']
+        self.quantity = line['quantity']
+
+    @property
+    def price(self):
+        return self.product.final_price
+
+    @property
+    def original_price(self):
+        return self.product.price
+
+    @property
+    def subtotal(self):
+        return self.price * self.quantity
+
+    @property
+    def original_subtotal(self):
+        return self.original_price * self.quantity
+
+    @property
+    def discount_amount(self):
+        if self.product.discount_price:
+            return (self.original_price - self.price) * self.quantity
+        return Decimal('0.00')
+
+    @property
+    def has_discount(self):
+        return bool(self.product.discount_price and self.product.discount_price < self.product.price)
+
+
+class SessionCart:
+    """Cart for anonymous visitors, with the same totals API as Cart"""
+
+    def __init__(self, session):
+        self.session = session
+        data = session.get(SESSION_KEY) or {}
+        self.lines = data.get('lines', {})
+        self.next_id = data.get('next_id', 1)
+
+    @property
+    def total_items(self):
+        return sum(line['quantity'] for line in self.lines.values())
+
+    @property
+    def subtotal(self):
+        return sum((Decimal(line['price']) * line['quantity'] for line in self.lines.values()), Decimal('0.00'))
+
+    @property
+    def total_discount(self):
+        return sum(
+            ((Decimal(line['original_price']) - Decimal(line['price'])) * line['quantity'] for line in self.lines.values()),
+            Decimal('0.00'),
+        )
+
+    @property
+    def total(self):
+        return self.subtotal
+
+    def __len__(self):
+        return len(self.lines)
+
+    def save(self):
+        if self.lines:
+            self.session[SESSION_KEY] = {'lines': self.lines, 'next_id': self.next_id}
+        else:
+            self.session.pop(SESSION_KEY, None)
+        self.session.modified = True
+
+    def _update(self, line_id, quantity, stock):
+        return CartUpdate(line_id, quantity, stock, (self.total_items, self.subtotal, self.total_discount))
+
+    def _write(self, line_id, product, quantity):
+        line = self.lines[line_id]
+        line['quantity'] = quantity
+        line['name'] = product.name
+        line['price'] = str(product.final_price)
+        line['original_price'] = str(product.price)
+        if quantity <= 0:
+            del self.lines[line_id]
+        self.save()
+        return self._update(int(line_id), max(quantity, 0), product.stock)
+
+    def add(self, product, quantity=1, size=''):
+        """Add quantity of a product, capped by stock; returns a CartUpdate, or None if it is sold out"""
+        if not product.is_available or product.stock <= 0:
+            return None
+        size = size or ''
+        line_id = next(
+            (key for key, line in self.lines.items() if line['product'] == product.pk and line['size'] == size),
+            None,
+        )
+        if line_id is None:
+            line_id = str(self.next_id)
+            self.next_id += 1
+            self.lines[line_id] = {'product': product.pk, 'size': size, 'quantity': 0}
+        quantity = self.lines[line_id]['quantity'] + max(int(quantity), 1)
+        return self._write(line_id, product, min(quantity, product.stock))
+
+    def change_quantity(self, line_id, delta):
+        """Increase (or with a negative delta decrease) a line; it is removed once it reaches zero"""
+        line = self.lines.get(str(line_id))
+        if line is None:
+            return None
+        return self.set_quantity(line_id, line['quantity'] + delta)
+
+    def set_quantity(self, line_id, quantity):
+        """Set a line to quantity (capped by stock); zero or less removes it"""
+        line_id = str(line_id)
+        if line_id not in self.lines:
+            return None
+        if quantity <= 0:
+            return self.remove(line_id)
+        product = Product.objects.filter(pk=self.lines[line_id]['product']).first()
+        if product is None:
+            return self.remove(line_id)
+        return self._write(line_id, product, min(quantity, product.stock))
+
+    def change_size(self, line_id, size):
+        """Move a line to another size, folding it into an existing line of that size"""
+        line = self.lines.get(str(line_id))
+        if line is None:
+            return None
+        size = size or ''
+        target_id = next(
+            (key for key, other in self.lines.items()
+             if other['product'] == line['product'] and other['size'] == size and other is not line),
+            None,
+        )
+        if target_id is None:
+            line['size'] = size
+            self.save()
+            return self._update(int(line_id), line['quantity'], None)
+        del self.lines[str(line_id)]
+        return self.set_quantity(target_id, self.lines[target_id]['quantity'] + line['quantity'])
+
+    def remove(self, line_id):
+        line = self.lines.pop(str(line_id), None)
+        if line is None:
+            return None
+        self.save()
+        return self._update(int(line_id), 0, None)
+
+    def clear(self):
+        self.lines = {}
+        self.save()
+
+    def items(self):
+        """Lines with their products, re-priced and re-capped against the catalog in one query"""
+        products = Product.objects.filter(
+            pk__in=[line['product'] for line in self.lines.values()], is_available=True
+        ).prefetch_related('images').in_bulk()
+        items = []
+        changed = False
+        for line_id, line in list(self.lines.items()):
+            product = products.get(line['product'])
+            quantity = min(line['quantity'], product.stock) if product else 0
+            if quantity <= 0:
+                del self.lines[line_id]
+                changed = True
+                continue
+            snapshot = {
+                'quantity': quantity,
+                'name': product.name,
+                'price': str(product.final_price),
+                'original_price': str(product.price),
+            }
+            if any(line.get(key) != value for key, value in snapshot.items()):
+                line.update(snapshot)
+                changed = True
+            items.append(SessionCartItem(int(line_id), product, line))
+        if changed:
+            self.save()
+        return items
+
+
+def merge_session_cart(request, user):
+    """Fold the anonymous session cart into the user's cart with one bulk upsert"""
+    session_cart = SessionCart(request.session)
+    if not session_cart.lines:
+        return None
+    cart, created = Cart.objects.get_or_create(user=user)
+    merge_items(cart, [(line['product'], line['size'], line['quantity']) for line in session_cart.lines.values()])
+    session_cart.clear()
+    return cart
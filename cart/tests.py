@@ -1,3 +1,360 @@
-from django.test import TestCase
+import threading
+from decimal import Decimal
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser, User
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from products.models import Category, Product
+from .context_processors import cart as cart_context
+from .checkout import EmptyCartError, OutOfStockError, place_order
+from .models import Cart, CartItem, Order
+from .mutations import add_item, change_quantity, set_quantity
+from .session import SessionCart
+
+
+def make_product(name, stock, price='999.00', discount_price=None):
+    category, _ = Category.objects.get_or_create(name='Tees')
+    return Product.objects.create(
+        category=category, name=name, description=name, stock=stock,
+        price=Decimal(price), discount_price=Decimal(discount_price) if discount_price else None,
+    )
+
+
+def make_cart(username, *lines):
+    cart = Cart.objects.create(user=User.objects.create_user(username))
+    for product, quantity in lines:
+        CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+    return cart
+
+
+class CheckoutTests(TestCase):
+
+    def test_place_order_snapshots_prices_and_reserves_stock(self):
+        tee = make_product('Sale Tee', stock=5, price='1000.00', discount_price='800.00')
+        cart = make_cart('buyer', (tee, 2))
+
+        order = place_order(cart.user)
+
+        tee.refresh_from_db()
+        cart.refresh_from_db()
+        self.assertEqual(tee.stock, 3)
+        self.assertEqual(cart.total_items, 0)
+        self.assertEqual((order.subtotal, order.discount, order.total), (Decimal('2000.00'), Decimal('400.00'), Decimal('1600.00')))
+
+        tee.discount_price = None
+        tee.save()
+        item = order.items.get()
+        self.assertEqual((item.product_name, item.quantity, item.unit_price), ('Sale Tee', 2, Decimal('800.00')))
+
+    def test_short_stock_rolls_back_every_reservation(self):
+        plenty = make_product('Plenty Tee', stock=10)
+        scarce = make_product('Scarce Tee', stock=1)
+        cart = make_cart('buyer', (plenty, 2), (scarce, 2))
+
+        with self.assertRaises(OutOfStockError):
+            place_order(cart.user)
+
+        plenty.refresh_from_db()
+        self.assertEqual(plenty.stock, 10)
+        self.assertEqual(cart.items.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_cart(self):
+        with self.assertRaises(EmptyCartError):
+            place_order(User.objects.create_user('browser'))
+
+
+class CartMutationTests(TestCase):
+
+    def test_add_item_upserts_and_caps_at_stock(self):
+        tee = make_product('Sale Tee', stock=4, price='1000.00', discount_price='800.00')
+        cart = make_cart('shopper')
+
+        first = add_item(cart, tee.pk, 3, size='M')
+        second = add_item(cart, tee.pk, 3, size='M')
+
+        self.assertEqual(first.item_id, second.item_id)
+        self.assertEqual((second.quantity, second.at_stock_limit), (4, True))
+        self.assertEqual((cart.total_items, cart.subtotal, cart.total_discount), (4, Decimal('3200.00'), Decimal('800.00')))
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_items, 4)
+        self.assertEqual(CartItem.objects.get().quantity, 4)
+
+    def test_add_item_refuses_sold_out_products(self):
+        cart = make_cart('shopper')
+        self.assertIsNone(add_item(cart, make_product('Gone Tee', stock=0).pk))
+        self.assertFalse(cart.items.exists())
+
+    def test_quantity_changes_remove_the_line_at_zero(self):
+        tee = make_product('Tee', stock=10)
+        cart = make_cart('shopper', (tee, 2))
+        item = cart.items.get()
+
+        self.assertEqual(change_quantity(cart, item.pk, 1).quantity, 3)
+        self.assertEqual(set_quantity(cart, item.pk, 50).quantity, 10)
+        self.assertTrue(change_quantity(cart, item.pk, -10).deleted)
+        self.assertFalse(cart.items.exists())
+        self.assertEqual((cart.total_items, cart.subtotal), (0, Decimal('0.00')))
+
+
+class SessionCartTests(TestCase):
+
+    def add(self, product, quantity=1, size=''):
+        return self.client.post('/cart/add/', {'product_id': product.pk, 'quantity': quantity, 'size': size})
+
+    def test_anonymous_visitors_keep_a_session_cart(self):
+        tee = make_product('Tee', stock=3, price='500.00')
+        self.add(tee, 2, 'M')
+        self.add(tee, 2, 'M')
+
+        session_cart = SessionCart(self.client.session)
+        self.assertEqual((session_cart.total_items, session_cart.subtotal), (3, Decimal('1500.00')))
+        self.assertFalse(Cart.objects.exists())
+
+        request = RequestFactory().get('/')
+        request.user, request.session = AnonymousUser(), self.client.session
+        request.session.keys()  # the session row is read once per request anyway
+        with self.assertNumQueries(0):
+            self.assertEqual(cart_context(request)['cart_count'](), 3)
+
+        response = self.client.get('/cart/')
+        self.assertContains(response, 'Size: M')
+
+    def test_login_merges_the_session_cart_in_one_upsert(self):
+        tee = make_product('Tee', stock=5)
+        hoodie = make_product('Hoodie', stock=5)
+        cart = make_cart('shopper', (tee, 2))
+        cart.user.set_password('pass')
+        cart.user.save()
+        cart.items.update(size='S')
+        self.add(tee, 2, 'S')
+        self.add(hoodie, 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/accounts/login/', {'username': 'shopper', 'password': 'pass'})
+
+        self.assertEqual(sum('INSERT INTO "cart_cartitem"' in query['sql'] for query in queries), 1)
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_items, 5)
+        self.assertEqual(cart.items.get(product=tee).quantity, 4)
+        self.assertNotIn('cart', self.client.session)
+
+    def test_signed_in_badge_count_reads_the_stored_cart_total(self):
+        tee = make_product('Tee', stock=5)
+        hoodie = make_product('Hoodie', stock=5)
+        cart = make_cart('shopper', (tee, 1))
+        self.client.force_login(cart.user)
+        self.add(tee, 2)
+        self.add(hoodie, 1)
+
+        request = RequestFactory().get('/')
+        request.user, request.session = cart.user, self.client.session
+        with self.assertNumQueries(1):
+            self.assertEqual(cart_context(request)['cart_count'](), 4)
+
+        # Changes made from another session, or by deleting a product, show up straight away
+        change_quantity(cart, cart.items.get(product=tee).pk, -1)
+        hoodie.delete()
+        self.assertEqual(cart_context(request)['cart_count'](), 2)
+
+
+class CartAPITests(TestCase):
+
+    def setUp(self):
+        self.tee = make_product('Tee', stock=10, price='500.00', discount_price='400.00')
+        self.hoodie = make_product('Hoodie', stock=3, price='1500.00')
+        self.cart = make_cart('shopper', (self.tee, 1))
+        self.cart.items.update(size='M')
+        self.item = self.cart.items.get()
+        self.client.force_login(self.cart.user)
+
+    def post(self, *operations):
+        return self.client.post('/cart/api/', {'operations': list(operations)}, content_type='application/json')
+
+    def test_batch_applies_every_operation_and_returns_state(self):
+        response = self.post(
+            {'op': 'set_quantity', 'item_id': self.item.pk, 'quantity': 4},
+            {'op': 'add', 'product_id': self.hoodie.pk, 'quantity': 5},
+            {'op': 'add', 'product_id': self.tee.pk, 'quantity': 2, 'size': 'L'},
+            {'op': 'change_size', 'item_id': self.item.pk, 'size': 'L'},
+        )
+
+        state = response.json()['cart']
+        lines = {(line['name'], line['size']): line['quantity'] for line in state['items']}
+        self.assertEqual(lines, {('Tee', 'L'): 6, ('Hoodie', ''): 3})
+        self.assertEqual(response.json()['warnings'][0]['code'], 'capped')
+        self.assertEqual((state['total_items'], state['subtotal'], state['discount']), (9, 6900.0, 600.0))
+        self.cart.refresh_from_db()
+        self.assertEqual((self.cart.total_items, self.cart.subtotal), (9, Decimal('6900.00')))
+
+    def test_query_count_does_not_grow_with_the_batch(self):
+        def burst(clicks):
+            with CaptureQueriesContext(connection) as queries:
+                self.post(*[{'op': 'set_quantity', 'item_id': self.item.pk, 'quantity': n} for n in range(1, clicks + 1)])
+            return len(queries)
+
+        self.assertEqual(burst(2), burst(10))
+
+    def test_invalid_operation_rejects_the_whole_batch(self):
+        response = self.post(
+            {'op': 'set_quantity', 'item_id': self.item.pk, 'quantity': 4},
+            {'op': 'remove', 'item_id': 999999},
+        )
+
+        self.assertEqual((response.status_code, response.json()['operation']), (400, 1))
+        self.assertEqual(self.cart.items.get().quantity, 1)
+        self.assertEqual(self.post({'op': 'explode'}).status_code, 400)
+
+    def test_anonymous_batch_uses_the_session_cart(self):
+        self.client.logout()
+        response = self.post(
+            {'op': 'add', 'product_id': self.tee.pk, 'quantity': 2},
+            {'op': 'add', 'product_id': self.hoodie.pk},
+        )
+        hoodie_line = next(line for line in response.json()['cart']['items'] if line['name'] == 'Hoodie')
+        response = self.post({'op': 'remove', 'item_id': hoodie_line['id']})
+
+        self.assertEqual(response.json()['cart']['total_items'], 2)
+        self.assertEqual(self.cart.items.get().quantity, 1)
+
+
+class CartAdminTests(TestCase):
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'secret-pass-123'))
+        self.tee = make_product('Tee', stock=50, price='500.00', discount_price='400.00')
+        self.hoodie = make_product('Hoodie', stock=50, price='1500.00')
+
+    def changelist(self, model, **params):
+        return self.client.get(f'/admin/cart/{model}/', params)
+
+    def test_changelists_run_a_fixed_number_of_queries(self):
+        make_cart('first', (self.tee, 1), (self.hoodie, 1))
+        for model in ('cart', 'cartitem'):
+            with CaptureQueriesContext(connection) as queries:
+                self.changelist(model)
+            expected = len(queries)
+            for n in range(5):
+                make_cart(f'{model}-{n}', (self.tee, n + 1), (self.hoodie, 1))
+            with self.assertNumQueries(expected):
+                self.changelist(model)
+
+    def test_carts_sort_and_filter_by_totals(self):
+        small = make_cart('small', (self.tee, 1))
+        large = make_cart('large', (self.hoodie, 4), (self.tee, 1))
+        Cart.objects.create(user=User.objects.create_user('empty'))
+
+        # Column 4 is the subtotal
+        carts = self.changelist('cart', o='-4').context['cl'].result_list
+        self.assertEqual([cart.user.username for cart in carts], ['large', 'small', 'empty'])
+        self.assertEqual([cart.line_count for cart in carts], [2, 1, 0])
+        carts = self.changelist('cart', subtotal='5000-up').context['cl'].result_list
+        self.assertEqual(list(carts), [large])
+        carts = self.changelist('cart', items='1-2').context['cl'].result_list
+        self.assertEqual(list(carts), [small])
+
+    def test_items_sort_and_filter_by_line_subtotal(self):
+        make_cart('shopper', (self.tee, 2), (self.hoodie, 2))
+
+        # Column 7 is the line subtotal
+        items = self.changelist('cartitem', o='7').context['cl'].result_list
+        self.assertEqual([item.line_subtotal for item in items], [Decimal('800.00'), Decimal('3000.00')])
+        items = self.changelist('cartitem', subtotal='2000-up').context['cl'].result_list
+        self.assertEqual([item.product for item in items], [self.hoodie])
+
+
+class ConcurrentAddToCartTests(TransactionTestCase):
+    """Parallel cart clicks neither lose quantity, trip the unique constraint nor leave an empty line"""
+
+    clicks = 16
+
+    def race(self, action):
+        barrier = threading.Barrier(self.clicks)
+        errors = []
+
+        def click():
+            try:
+                # Connect first, so the clicks reach the database together
+                connection.ensure_connection()
+                barrier.wait()
+                action()
+            except Exception as error:
+                errors.append(repr(error))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=click) for _ in range(self.clicks)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(errors, [])
+
+    def hammer(self, product, quantity):
+        cart = make_cart('clicker')
+        self.race(lambda: add_item(cart, product.pk, quantity, size='L'))
+        cart.refresh_from_db()
+        return cart
+
+    def test_no_lost_updates(self):
+        cart = self.hammer(make_product('Everyday Tee', stock=1000), 2)
+        self.assertEqual(cart.items.get().quantity, self.clicks * 2)
+        self.assertEqual(cart.total_items, self.clicks * 2)
+
+    def test_stock_caps_concurrent_adds(self):
+        cart = self.hammer(make_product('Drop Tee', stock=5), 1)
+        self.assertEqual(cart.items.get().quantity, 5)
+        self.assertEqual(cart.total_items, 5)
+
+    def test_concurrent_decrements_remove_the_line(self):
+        cart = make_cart('clicker', (make_product('Everyday Tee', stock=1000), 3))
+        item = cart.items.get()
+        # Each decrement alone leaves one, but a second one after it would go below zero
+        self.race(lambda: change_quantity(cart, item.pk, -2))
+        self.assertFalse(cart.items.exists())
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_items, 0)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    """Many buyers racing for one hot SKU never oversell it"""
+
+    buyers = 20
+    stock = 5
+
+    def test_parallel_checkouts_do_not_oversell(self):
+        hot = make_product('Drop Tee', stock=self.stock)
+        everyday = make_product('Everyday Tee', stock=1000)
+        users = [make_cart(f'buyer{n}', (everyday, 1), (hot, 1)).user for n in range(self.buyers)]
+
+        barrier = threading.Barrier(self.buyers)
+        outcomes = []
+
+        def checkout(user):
+            try:
+                barrier.wait()
+                place_order(user)
+                outcomes.append('ordered')
+            except OutOfStockError:
+                outcomes.append('sold out')
+            except Exception as error:
+                outcomes.append(repr(error))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        hot.refresh_from_db()
+        everyday.refresh_from_db()
+        self.assertEqual(sorted(set(outcomes)), ['ordered', 'sold out'])
+        self.assertEqual(outcomes.count('ordered'), self.stock)
+        self.assertEqual(hot.stock, 0)
+        self.assertEqual(everyday.stock, 1000 - self.stock)
+        self.assertEqual(Order.objects.count(), self.stock)
@@ -9,4 +9,6 @@ urlpatterns = [
     path('remove/<int:item_id>/', views.RemoveFromCartView.as_view(), name='remove_from_cart'),
     path('update/<int:item_id>/', views.UpdateCartItemView.as_view(), name='update_cart_item'),
     path('clear/', views.ClearCartView.as_view(), name='clear_cart'),
+    path('api/', views.CartAPIView.as_view(), name='cart_api'),
+    path('checkout/', views.CheckoutView.as_view(), name='checkout'),
 ]
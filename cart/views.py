@@ -1,20 +1,53 @@
+import json
+from decimal import Decimal
+from functools import partial
+
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.views import View
 from django.utils.decorators import method_decorator
 from products.models import Product
+from .batch import (
+    CartOperationError, apply_operations, apply_session_operations, cart_state, parse_operations,
+    session_cart_state,
+)
+from .checkout import EmptyCartError, OutOfStockError, place_order
 from .models import Cart, CartItem
+from .mutations import add_item, change_quantity, set_quantity
+from .session import SessionCart
+
+
+def get_line(request, item_id):
+    """The cart holding item_id plus the line's product name, unit price and quantity"""
+    if request.user.is_authenticated:
+        cart_item = get_object_or_404(
+            CartItem.objects.select_related('cart', 'product'),
+            id=item_id, 
+            cart__user=request.user
+        )
+        product = cart_item.product
+        return cart_item.cart, product.name, product.final_price, cart_item.quantity
+    
+    cart = SessionCart(request.session)
+    line = cart.lines.get(str(item_id))
+    if line is None:
+        raise Http404('No such cart item')
+    return cart, line['name'], Decimal(line['price']), line['quantity']
 
 
-@method_decorator(login_required, name='dispatch')
 class CartView(View):
-    """Display user's shopping cart"""
+    """Display the shopping cart; anonymous visitors get their session cart"""
     
     def get(self, request, *args, **kwargs):
-        cart, created = Cart.objects.get_or_create(user=request.user)
-        cart_items = cart.items.select_related('product').prefetch_related('product__images')
+        if request.user.is_authenticated:
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            cart_items = cart.items.select_related('product').prefetch_related('product__images')
+        else:
+            cart = SessionCart(request.session)
+            cart_items = cart.items()
         
         context = {
             'cart': cart,
@@ -25,7 +58,6 @@ class CartView(View):
         return render(request, 'cart/cart.html', context)
 
 
-@method_decorator(login_required, name='dispatch')
 class AddToCartView(View):
     """Add a product to cart"""
     
@@ -36,55 +68,56 @@ class AddToCartView(View):
         
         product = get_object_or_404(Product, id=product_id, is_available=True)
         
-        # Get or create cart
-        cart, created = Cart.objects.get_or_create(user=request.user)
+        if request.user.is_authenticated:
+            # One upsert adds the line or bumps its quantity, capped by stock
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            update = add_item(cart, product.pk, quantity, size)
+        else:
+            update = SessionCart(request.session).add(product, quantity, size)
+        is_ajax = request.headers.get('X-Requested-With') == 'XMLHttpRequest'
         
-        # Check if item already exists in cart
-        cart_item, item_created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            size=size if size else None,
-            defaults={'quantity': quantity}
-        )
+        if update is None:
+            message = f'Sorry, {product.name} is out of stock'
+            if is_ajax:
+                return JsonResponse({'success': False, 'message': message}, status=409)
+            messages.error(request, message)
+            return redirect('cart:view_cart')
         
-        if not item_created:
-            # Item exists, increase quantity
-            cart_item.quantity += quantity
-            cart_item.save()
-            messages.success(request, f'Updated {product.name} quantity in cart')
+        message = f'Added {product.name} to cart'
+        if update.at_stock_limit:
+            message = f'Your cart now holds all {update.stock} {product.name} in stock'
+            messages.warning(request, message)
         else:
-            messages.success(request, f'Added {product.name} to cart')
+            messages.success(request, message)
         
         # Return JSON for AJAX requests
-        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+        if is_ajax:
             return JsonResponse({
                 'success': True,
-                'message': f'Added {product.name} to cart',
-                'cart_total_items': cart.total_items
+                'message': message,
+                'quantity': update.quantity,
+                'cart_total_items': update.item_count
             })
         
         return redirect('cart:view_cart')
 
 
-@method_decorator(login_required, name='dispatch')
 class RemoveFromCartView(View):
     """Remove an item from cart"""
     
     def post(self, request, item_id, *args, **kwargs):
-        cart_item = get_object_or_404(
-            CartItem, 
-            id=item_id, 
-            cart__user=request.user
-        )
+        cart, product_name, price, quantity = get_line(request, item_id)
         
-        product_name = cart_item.product.name
-        cart_item.delete()
+        if isinstance(cart, SessionCart):
+            cart.remove(item_id)
+        else:
+            set_quantity(cart, item_id, 0)
         
         messages.success(request, f'Removed {product_name} from cart')
         
         # Return JSON for AJAX requests
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cart = Cart.objects.get(user=request.user)
+            # Totals came back from the write and were set on the cart
             return JsonResponse({
                 'success': True,
                 'message': f'Removed {product_name} from cart',
@@ -96,48 +129,46 @@ class RemoveFromCartView(View):
         return redirect('cart:view_cart')
 
 
-@method_decorator(login_required, name='dispatch')
 class UpdateCartItemView(View):
     """Update cart item quantity"""
     
     def post(self, request, item_id, *args, **kwargs):
-        cart_item = get_object_or_404(
-            CartItem, 
-            id=item_id, 
-            cart__user=request.user
-        )
+        cart, product_name, price, current_quantity = get_line(request, item_id)
+        
+        if isinstance(cart, SessionCart):
+            change, set_to = partial(cart.change_quantity, item_id), partial(cart.set_quantity, item_id)
+        else:
+            change, set_to = partial(change_quantity, cart, item_id), partial(set_quantity, cart, item_id)
         
         action = request.POST.get('action')
         quantity = request.POST.get('quantity')
         
+        update = None
         if action == 'increase':
-            cart_item.increase_quantity()
-            messages.success(request, f'Increased quantity of {cart_item.product.name}')
+            update = change(1)
+            messages.success(request, f'Increased quantity of {product_name}')
         elif action == 'decrease':
-            cart_item.decrease_quantity()
-            messages.success(request, f'Decreased quantity of {cart_item.product.name}')
+            update = change(-1)
+            messages.success(request, f'Decreased quantity of {product_name}')
         elif quantity:
-            new_quantity = int(quantity)
-            if new_quantity > 0:
-                cart_item.quantity = new_quantity
-                cart_item.save()
-                messages.success(request, f'Updated quantity of {cart_item.product.name}')
+            update = set_to(int(quantity))
+            if update is not None and update.deleted:
+                messages.success(request, f'Removed {product_name} from cart')
             else:
-                cart_item.delete()
-                messages.success(request, f'Removed {cart_item.product.name} from cart')
+                messages.success(request, f'Updated quantity of {product_name}')
         
         # Return JSON for AJAX requests
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            cart = Cart.objects.get(user=request.user)
-            try:
-                # Item might have been deleted
-                cart_item.refresh_from_db()
+            # Totals came back from the write and were set on the cart
+            if update is not None and update.deleted:
+                item_data = {'deleted': True}
+            else:
+                new_quantity = update.quantity if update else current_quantity
                 item_data = {
-                    'quantity': cart_item.quantity,
-                    'subtotal': float(cart_item.subtotal)
+                    'quantity': new_quantity,
+                    'subtotal': float(price * new_quantity),
+                    'at_stock_limit': bool(update and update.at_stock_limit)
                 }
-            except CartItem.DoesNotExist:
-                item_data = {'deleted': True}
             
             return JsonResponse({
                 'success': True,
@@ -150,11 +181,15 @@ class UpdateCartItemView(View):
         return redirect('cart:view_cart')
 
 
-@method_decorator(login_required, name='dispatch')
 class ClearCartView(View):
     """Clear all items from cart"""
     
     def post(self, request, *args, **kwargs):
+        if not request.user.is_authenticated:
+            SessionCart(request.session).clear()
+            messages.success(request, 'Cart cleared successfully')
+            return redirect('cart:view_cart')
+        
         try:
             cart = Cart.objects.get(user=request.user)
             cart.clear()
@@ -163,3 +198,69 @@ class ClearCartView(View):
             messages.info(request, 'Your cart is already empty')
         
         return redirect('cart:view_cart')
+
+
+class CartAPIView(View):
+    """JSON cart state; POST applies a batch of operations in one transaction"""
+    
+    def get_cart(self, request):
+        if request.user.is_authenticated:
+            cart, created = Cart.objects.get_or_create(user=request.user)
+            return cart
+        return SessionCart(request.session)
+    
+    def state(self, cart):
+        if isinstance(cart, SessionCart):
+            return session_cart_state(cart)
+        return cart_state(cart)
+    
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({'success': True, 'cart': self.state(self.get_cart(request))})
+    
+    def post(self, request, *args, **kwargs):
+        try:
+            operations = parse_operations(json.loads(request.body or b'{}'))
+        except ValueError as error:
+            # Covers both malformed JSON and a CartOperationError
+            return JsonResponse({'success': False, 'error': str(error)}, status=400)
+        
+        cart = self.get_cart(request)
+        try:
+            if isinstance(cart, SessionCart):
+                warnings = apply_session_operations(cart, operations)
+            else:
+                warnings = apply_operations(cart, operations)
+        except CartOperationError as error:
+            return JsonResponse({'success': False, 'error': str(error), 'operation': error.index}, status=400)
+        
+        return JsonResponse({'success': True, 'warnings': warnings, 'cart': self.state(cart)})
+
+
+@method_decorator(login_required, name='dispatch')
+class CheckoutView(View):
+    """Place an order for everything in the cart"""
+    
+    def post(self, request, *args, **kwargs):
+        address = request.user.addresses.filter(is_default=True).first() or request.user.addresses.first()
+        shipping_address = ''
+        if address:
+            shipping_address = '\n'.join(line for line in [
+                address.full_name,
+                address.phone,
+                address.address_line1,
+                address.address_line2,
+                f'{address.city}, {address.state} {address.postal_code}',
+                address.country,
+            ] if line)
+        
+        try:
+            order = place_order(request.user, shipping_address=shipping_address)
+        except OutOfStockError as error:
+            messages.error(request, f'Sorry, only {error.product.stock} of {error.product.name} left in stock')
+            return redirect('cart:view_cart')
+        except EmptyCartError:
+            messages.info(request, 'Your cart is empty')
+            return redirect('cart:view_cart')
+        
+        messages.success(request, f'Order #{order.pk} placed successfully')
+        return redirect(reverse('accounts:profile') + '?tab=orders')
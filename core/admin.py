@@ -1,3 +1,22 @@
 from django.contrib import admin
+from django.utils import timezone
+from .models import Task
+from .paginator import EstimatedCountPaginator
 
-# Register your models here.
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ['name', 'queue', 'status', 'attempts', 'max_attempts', 'run_at', 'duration_ms', 'created_at']
+    list_filter = ['status', 'queue', 'name']
+    search_fields = ['name', 'idempotency_key']
+    readonly_fields = ['locked_by', 'locked_until', 'started_at', 'finished_at', 'duration_ms', 'created_at']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['requeue']
+    
+    @admin.action(description='Queue selected tasks again')
+    def requeue(self, request, queryset):
+        updated = queryset.exclude(status=Task.RUNNING).update(
+            status=Task.QUEUED, attempts=0, run_at=timezone.now(), last_error='',
+        )
+        self.message_user(request, f'{updated} task(s) queued again.')
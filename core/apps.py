@@ -4,3 +4,14 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+    
+    def ready(self):
+        from django.db.backends.signals import connection_created
+        from django.utils.module_loading import autodiscover_modules
+        from core import performance, query_budget
+        performance.instrument_templates()
+        # Query counting hooks, on every connection whichever thread opens it
+        connection_created.connect(performance.instrument_connection, dispatch_uid='performance_queries')
+        connection_created.connect(query_budget.instrument_connection, dispatch_uid='query_budget_queries')
+        # Register every app's background tasks, so workers can run them by name
+        autodiscover_modules('tasks')
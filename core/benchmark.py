@@ -0,0 +1,149 @@
+"""
+Endpoint benchmarks.
+
+Drives the catalog and cart endpoints in-process through the Django test
+client against the configured database (fill it with ``generate_catalog``
+first). Each endpoint is timed over many requests, with SQL counted through
+``query_budget.counting``. A shorter second pass runs under
+``tracemalloc`` to measure allocations, so tracing overhead never skews the
+latency figures. Results are plain dicts, saved as JSON baselines and
+compared run over run by the ``benchmark`` management command.
+"""
+import math
+import statistics
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.test import Client
+from django.urls import reverse
+
+from .query_budget import counting
+
+
+class Endpoint:
+    """A request to benchmark, optionally made as a logged-in user"""
+
+    def __init__(self, name, path, method='get', data=None, user=None, content_type=None):
+        self.name = name
+        self.path = path
+        self.method = method
+        self.data = data
+        self.user = user
+        self.content_type = content_type
+
+    def request(self, client):
+        kwargs = {'content_type': self.content_type} if self.content_type else {}
+        return getattr(client, self.method)(self.path, self.data, **kwargs)
+
+
+def discover_endpoints():
+    """Pick representative catalog rows and build the endpoints to benchmark"""
+    from cart.models import Cart
+    from products.models import Category, Product
+
+    endpoints = [
+        Endpoint('product_list', reverse('products:product_list')),
+        Endpoint('category_list', reverse('products:category_list')),
+    ]
+    category = Category.objects.filter(is_active=True, products__is_available=True).order_by('pk').first()
+    if category:
+        endpoints.append(Endpoint('category_products', reverse('products:category_products', args=[category.slug])))
+    product = Product.objects.filter(is_available=True).order_by('-pk').first()
+    if product:
+        endpoints.append(Endpoint('product_detail', reverse('products:product_detail', args=[product.slug])))
+        endpoints.append(Endpoint('search', reverse('products:search'), data={'q': product.name.split()[-2]}))
+    cart = Cart.objects.filter(item_count__gt=0).select_related('user').order_by('pk').first()
+    if cart:
+        item = cart.items.order_by('pk').first()
+        endpoints += [
+            Endpoint('cart', reverse('cart:view_cart'), user=cart.user),
+            Endpoint('cart_api', reverse('cart:cart_api'), user=cart.user),
+            Endpoint(
+                'cart_api_batch', reverse('cart:cart_api'), method='post', user=cart.user,
+                content_type='application/json',
+                data={'operations': [{'op': 'set_quantity', 'item_id': item.pk, 'quantity': item.quantity}] * 5},
+            ),
+        ]
+    return endpoints
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of an unsorted list"""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def _client(user):
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    client = Client(HTTP_HOST=host)
+    if user is not None:
+        client.force_login(user)
+    return client
+
+
+def measure(endpoint, iterations=50, warmup=5, allocation_iterations=5):
+    """Time an endpoint and return its latency percentiles, queries and allocations per request"""
+    client = _client(endpoint.user)
+    for _ in range(warmup):
+        endpoint.request(client)
+
+    latencies, query_counts, statuses = [], [], set()
+    for _ in range(iterations):
+        with counting() as counter:
+            started = time.perf_counter()
+            response = endpoint.request(client)
+            latencies.append((time.perf_counter() - started) * 1000)
+        query_counts.append(len(counter))
+        statuses.add(response.status_code)
+
+    allocated, peaks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(allocation_iterations):
+            tracemalloc.reset_peak()
+            before, _peak = tracemalloc.get_traced_memory()
+            endpoint.request(client)
+            after, peak = tracemalloc.get_traced_memory()
+            allocated.append(after - before)
+            peaks.append(peak - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'path': endpoint.path,
+        'method': endpoint.method.upper(),
+        'status': sorted(statuses),
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p90_ms': round(percentile(latencies, 90), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.fmean(latencies), 3),
+        'max_ms': round(max(latencies), 3),
+        'queries': max(query_counts),
+        'alloc_peak_kib': round(statistics.median(peaks) / 1024, 1) if peaks else None,
+        'alloc_retained_kib': round(statistics.median(allocated) / 1024, 1) if allocated else None,
+    }
+
+
+def run(endpoints, **options):
+    return {endpoint.name: measure(endpoint, **options) for endpoint in endpoints}
+
+
+def compare(current, baseline, threshold=0.2, min_delta_ms=1.0):
+    """Regressions of current against baseline: p90 latency beyond threshold, or any extra query
+
+    Slowdowns smaller than min_delta_ms are treated as timer noise on fast endpoints.
+    """
+    regressions = []
+    for name, result in current.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if result['queries'] > previous['queries']:
+            regressions.append(f'{name}: queries {previous["queries"]} -> {result["queries"]}')
+        slower = result['p90_ms'] - previous['p90_ms']
+        if slower > min_delta_ms and result['p90_ms'] > previous['p90_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p90 {previous["p90_ms"]:.1f}ms -> {result["p90_ms"]:.1f}ms')
+    return regressions
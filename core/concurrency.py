@@ -0,0 +1,43 @@
+"""
+Running independent blocking work concurrently from async views.
+
+Django's async ORM methods (``aget``, ``acount``, ``async for``) hand every
+query to the same thread-sensitive executor, so awaiting several of them with
+``asyncio.gather`` still runs them one after another. ``gather`` instead runs
+each callable on its own executor thread and so on its own database
+connection, which lets the sidebar, product and related product queries of
+a page overlap.
+
+Each call's connection is released with ``close_old_connections`` when the
+call returns. It is closed with the default ``CONN_MAX_AGE=0`` and kept for
+reuse by that thread when persistent connections are configured. A page
+doing N calls can hold up to N connections for the duration.
+
+Threads opened this way do not see writes the request has not committed.
+Set ``ASYNC_CONCURRENT_QUERIES = False`` to run the calls one after
+another on the request's own connection instead. The test suite does this,
+because its data lives in an uncommitted transaction.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections
+
+
+def _releasing_connections(func):
+    def call():
+        try:
+            return func()
+        finally:
+            close_old_connections()
+    return call
+
+
+async def gather(*funcs):
+    """Call each blocking function concurrently and return their results in order"""
+    if not getattr(settings, 'ASYNC_CONCURRENT_QUERIES', True):
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(
+        sync_to_async(_releasing_connections(func), thread_sensitive=False)() for func in funcs
+    ))
@@ -0,0 +1,104 @@
+"""
+CSS bundles.
+
+Page styles are written inline in the templates, inside
+``{% stylesheet 'name' %}...{% endstylesheet %}`` (core.templatetags.stylesheets).
+``build_css``, which ``collectstatic`` runs first, finds those blocks,
+minifies them and writes one ``bundles/<name>.css`` per name into
+``CSS_BUNDLE_ROOT`` (a ``STATICFILES_DIRS`` directory). ``collectstatic`` then
+copies the bundles into ``STATIC_ROOT`` like any other static file; with
+``STATIC_MANIFEST`` on, the storage renames them after a hash of their
+content and writes gzip and brotli variants next to them, which WhiteNoise
+(core.staticfiles) serves with far-future cache headers.
+
+With ``CSS_BUNDLES`` on the tag renders a ``<link>`` to the bundle, so the
+CSS is downloaded once and cached instead of re-sent with every page;
+otherwise it renders the block inline, as it is written, and edits show up
+without a build.
+"""
+import gzip
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.template.autoreload import get_template_directories
+from django.template.base import TextNode
+from django.template.loader import get_template
+
+BUNDLE_PREFIX = 'bundles'
+
+# Quoted strings (kept verbatim) and comments (dropped)
+_TOKENS = re.compile(r'''("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|/\*.*?\*/)''', re.S)
+_WHITESPACE = re.compile(r'\s+')
+# Spaces around these never matter; spaces before ':' do (a :hover is not a:hover),
+# as do spaces around + and - (calc(1px + 2px))
+_PUNCTUATION = re.compile(r' ?([{};,>]) ?')
+
+
+def bundle_path(name):
+    """Static path of a bundle, e.g. bundles/core/base.css"""
+    return f'{BUNDLE_PREFIX}/{name}.css'
+
+
+def _squeeze(text):
+    text = _PUNCTUATION.sub(r'\1', _WHITESPACE.sub(' ', text))
+    return text.replace(': ', ':').replace(';}', '}')
+
+
+def minify(css):
+    """css without comments and needless whitespace, leaving strings alone"""
+    parts, text = [], []
+    for index, piece in enumerate(_TOKENS.split(css)):
+        if index % 2 == 0:
+            text.append(piece)
+        elif piece.startswith('/*'):
+            text.append(' ')
+        else:
+            parts += [_squeeze(''.join(text)), piece]
+            text = []
+    parts.append(_squeeze(''.join(text)))
+    return ''.join(parts).strip()
+
+
+def gzip_size(content):
+    return len(gzip.compress(content.encode(), compresslevel=9))
+
+
+class BundleError(Exception):
+    pass
+
+
+def find_bundles():
+    """{bundle name: css} of every stylesheet block in the project's templates"""
+    from core.templatetags.stylesheets import StylesheetNode
+
+    bundles = {}
+    names = {
+        path.relative_to(directory).as_posix()
+        for directory in get_template_directories()
+        for path in Path(directory).rglob('*.html')
+        if '{% stylesheet' in path.read_text(encoding='utf-8')
+    }
+    for template_name in sorted(names):
+        template = get_template(template_name).template
+        for node in template.nodelist.get_nodes_by_type(StylesheetNode):
+            if any(not isinstance(child, TextNode) for child in node.nodelist):
+                raise BundleError(f'{template_name}: stylesheet {node.name!r} must not contain template tags')
+            css = ''.join(child.s for child in node.nodelist)
+            if bundles.setdefault(node.name, css) != css:
+                raise BundleError(f'{template_name}: stylesheet {node.name!r} is defined twice with different CSS')
+    return bundles
+
+
+def build(root=None):
+    """Write the minified bundles under root (CSS_BUNDLE_ROOT), replacing old ones; {name: (css, minified)}"""
+    root = Path(root or settings.CSS_BUNDLE_ROOT)
+    built = {name: (css, minify(css)) for name, css in find_bundles().items()}
+    if root.exists():
+        for stale in root.rglob('*.css'):
+            stale.unlink()
+    for name, (_, minified) in built.items():
+        path = root / f'{name}.css'
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(minified + '\n', encoding='utf-8')
+    return built
@@ -0,0 +1,128 @@
+"""
+Primary/replica routing with read-your-writes.
+
+``PrimaryReplicaRouter`` sends reads of the ``REPLICA_APPS`` models (the
+catalog) to a random alias in ``DATABASE_REPLICAS``. Carts, accounts, orders,
+sessions and every write stay on the primary (``default``). Settings turn the
+router on when ``DB_REPLICA_HOSTS`` lists at least one replica.
+
+A replica lags the primary a little, so after writing, a client reads from
+the primary for a while:
+
+- within a request (or a background task, or a management command), every
+  read after the first write goes to the primary, as does every read
+  inside a transaction;
+- across requests, ``ReadYourWritesMiddleware`` gives a client that wrote a
+  short-lived cookie. Its reads stay on the primary for
+  ``DB_REPLICA_PIN_SECONDS``.
+
+Cached catalog entries can be rebuilt from a lagging replica right after an
+invalidation; the pin covers the client that made the change, and for
+others the lag window is as short as the replica lag.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_COOKIE = 'db_primary_until'
+
+
+class Pin:
+    """Whether reads are held on the primary, for one request (or for the process outside requests)"""
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+_process_pin = Pin()
+_request_pin = ContextVar('db_request_pin', default=None)
+
+
+def current_pin():
+    return _request_pin.get() or _process_pin
+
+
+def pin_to_primary():
+    pin = current_pin()
+    pin.pinned = pin.wrote = True
+
+
+@contextmanager
+def unit_of_work(pinned=False):
+    """Track writes separately for the block, e.g. one background task"""
+    pin = Pin(pinned)
+    token = _request_pin.set(pin)
+    try:
+        yield pin
+    finally:
+        _request_pin.reset(token)
+
+
+class PrimaryReplicaRouter:
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in getattr(settings, 'REPLICA_APPS', ()):
+            return DEFAULT_DB_ALIAS
+        replicas = getattr(settings, 'DATABASE_REPLICAS', ())
+        if not replicas or current_pin().pinned or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_to_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *getattr(settings, 'DATABASE_REPLICAS', ())}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema by replication
+        return db == DEFAULT_DB_ALIAS
+
+
+class ReadYourWritesMiddleware:
+    """Track writes per request and keep a client that wrote on the primary for a while"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with unit_of_work(self.pinned(request)) as pin:
+            response = self.get_response(request)
+        return self.finish(response, pin)
+
+    async def __acall__(self, request):
+        with unit_of_work(self.pinned(request)) as pin:
+            response = await self.get_response(request)
+        return self.finish(response, pin)
+
+    def pinned(self, request):
+        try:
+            return float(request.COOKIES.get(PIN_COOKIE, 0)) > time.time()
+        except ValueError:
+            return False
+
+    def finish(self, response, pin):
+        if pin.wrote and getattr(settings, 'DATABASE_REPLICAS', ()):
+            seconds = getattr(settings, 'DB_REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(
+                PIN_COOKIE, f'{time.time() + seconds:.3f}', max_age=seconds,
+                httponly=True, samesite='Lax', secure=settings.SESSION_COOKIE_SECURE,
+            )
+        return response
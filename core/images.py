@@ -0,0 +1,150 @@
+"""
+Image derivatives.
+
+Uploaded and locally mirrored images are resized into fixed width buckets
+(``SIZES``) and encoded as WebP and JPEG. Each file is named after a hash of
+its content, so a URL never changes meaning and can be cached forever.
+What was built is recorded on the model as a JSON dict::
+
+    {'source': 'profile_pics/me.png', 'width': 1200, 'height': 1600,
+     'sizes': {'thumb': {'width': 160, 'height': 213, 'webp': '<name>', 'jpeg': '<name>'}, ...}}
+
+Saving an image only queues a ``build_derivatives`` task (see core.tasks);
+the ``run_tasks`` worker resizes, encodes and stores the files and then
+saves the dict. The ``build_image_derivatives`` command backfills existing
+images in a process pool of ``IMAGE_WORKERS`` processes.
+``responsive_images`` renders the result as ``srcset``/``sizes`` markup.
+"""
+import hashlib
+import io
+import os
+
+from django.apps import apps
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .tasks import task
+
+# Width buckets, smallest first
+SIZES = {
+    'thumb': 160,
+    'card': 480,
+    'detail': 960,
+    'zoom': 1600,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+EXTENSIONS = {'webp': 'webp', 'jpeg': 'jpg'}
+DERIVATIVES_DIR = 'derivatives'
+
+
+def render(data):
+    """Resize and encode image bytes into every bucket (runs in a pool process)
+
+    Images are never upscaled: the first bucket at least as wide as the
+    source gets the source width, and the wider ones are skipped.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'L'):
+            # JPEG has no alpha channel; flatten transparent images onto white
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image.convert('RGBA'), mask=image.convert('RGBA').getchannel('A'))
+            image = background
+        image = image.convert('RGB')
+        width, height = image.size
+
+        outputs = []
+        for size, bucket_width in SIZES.items():
+            target = min(bucket_width, width)
+            resized = image if target == width else image.resize(
+                (target, max(1, round(height * target / width))), Image.LANCZOS,
+            )
+            for fmt, options in FORMATS.items():
+                buffer = io.BytesIO()
+                resized.save(buffer, **options)
+                outputs.append({
+                    'size': size,
+                    'format': fmt,
+                    'width': resized.width,
+                    'height': resized.height,
+                    'content': buffer.getvalue(),
+                })
+            if target == width:
+                break
+    return {'width': width, 'height': height, 'outputs': outputs}
+
+
+def store(source_name, rendered):
+    """Save rendered derivatives under content-hashed names and describe them"""
+    stem = os.path.splitext(os.path.basename(source_name))[0][:40] or 'image'
+    sizes = {}
+    for output in rendered['outputs']:
+        digest = hashlib.sha256(output['content']).hexdigest()[:16]
+        name = f'{DERIVATIVES_DIR}/{digest[:2]}/{stem}-{output["size"]}.{digest}.{EXTENSIONS[output["format"]]}'
+        if not default_storage.exists(name):
+            default_storage.save(name, ContentFile(output['content']))
+        entry = sizes.setdefault(output['size'], {'width': output['width'], 'height': output['height']})
+        entry[output['format']] = name
+    return {'source': source_name, 'width': rendered['width'], 'height': rendered['height'], 'sizes': sizes}
+
+
+def needs_derivatives(instance, source_field, derivatives_field):
+    source = getattr(instance, source_field)
+    return bool(source) and getattr(instance, derivatives_field).get('source') != source.name
+
+
+@task(max_attempts=5)
+def build_derivatives(label, pk, source_field, derivatives_field, source_name):
+    """Build and record derivatives for one saved image"""
+    model = apps.get_model(label)
+    instance = model._default_manager.filter(pk=pk).first()
+    # Skip if the row is gone or its image was replaced before the task ran
+    if instance is None or getattr(instance, source_field).name != source_name:
+        return
+    with default_storage.open(source_name, 'rb') as file:
+        derivatives = store(source_name, render(file.read()))
+    setattr(instance, derivatives_field, derivatives)
+    instance.save(update_fields=[derivatives_field])
+
+
+def schedule(instance, source_field, derivatives_field):
+    """Queue a derivatives build for instance's image"""
+    model, pk = type(instance), instance.pk
+    source_name = getattr(instance, source_field).name
+    if getattr(instance, derivatives_field):
+        # Stop serving the previous image's derivatives straight away
+        setattr(instance, derivatives_field, {})
+        model._default_manager.filter(pk=pk).update(**{derivatives_field: {}})
+    build_derivatives.enqueue(
+        model._meta.label, pk, source_field, derivatives_field, source_name,
+        idempotency_key=f'derivatives:{model._meta.label_lower}:{pk}:{hashlib.md5(source_name.encode()).hexdigest()}',
+    )
+
+
+def bucket(derivatives, size):
+    """The built bucket for size, or the largest smaller one when the source was too small"""
+    built = (derivatives or {}).get('sizes') or {}
+    names = list(SIZES)
+    for candidate in reversed(names[:names.index(size) + 1]):
+        if candidate in built:
+            return built[candidate]
+    return None
+
+
+def image_url(derivatives, size, fmt='jpeg'):
+    """URL of size's bucket in fmt, or None if nothing was built"""
+    entry = bucket(derivatives, size)
+    return default_storage.url(entry[fmt]) if entry else None
+
+
+def srcset(derivatives, fmt):
+    """'url 160w, url 480w, ...' over every built bucket"""
+    built = (derivatives or {}).get('sizes') or {}
+    return ', '.join(
+        f'{default_storage.url(built[size][fmt])} {built[size]["width"]}w' for size in SIZES if size in built
+    )
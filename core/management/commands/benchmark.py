@@ -0,0 +1,84 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the catalog and cart endpoints and compare against the previous run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Timed requests per endpoint (default: 50)')
+        parser.add_argument('--warmup', type=int, default=5, help='Untimed requests per endpoint first (default: 5)')
+        parser.add_argument(
+            '--only', action='append', default=[],
+            help='Benchmark only this endpoint (repeatable), e.g. --only product_list',
+        )
+        parser.add_argument(
+            '--output-dir', default=str(Path(settings.BASE_DIR) / 'benchmarks'),
+            help='Where run results and latest.json are written (default: BASE_DIR/benchmarks)',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed p90 slowdown against the last run before flagging it (default: 0.2 = 20%%)',
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error if any endpoint regressed against the last run',
+        )
+        parser.add_argument('--no-save', action='store_true', help='Do not write this run as the new baseline')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1 or options['warmup'] < 0:
+            raise CommandError('--iterations must be positive and --warmup non-negative')
+
+        endpoints = benchmark.discover_endpoints()
+        if options['only']:
+            endpoints = [endpoint for endpoint in endpoints if endpoint.name in options['only']]
+        if not endpoints:
+            raise CommandError('No endpoints to benchmark; run generate_catalog first')
+
+        results = {}
+        for endpoint in endpoints:
+            results[endpoint.name] = result = benchmark.measure(
+                endpoint, iterations=options['iterations'], warmup=options['warmup']
+            )
+            self.stdout.write(
+                f'{endpoint.name:<20} p50 {result["p50_ms"]:8.2f}ms  p90 {result["p90_ms"]:8.2f}ms  '
+                f'p99 {result["p99_ms"]:8.2f}ms  queries {result["queries"]:3}  '
+                f'alloc {result["alloc_peak_kib"]:8.1f}KiB  status {",".join(map(str, result["status"]))}'
+            )
+
+        output_dir = Path(options['output_dir'])
+        latest = output_dir / 'latest.json'
+        regressions = []
+        if latest.exists():
+            previous = json.loads(latest.read_text())
+            regressions = benchmark.compare(results, previous['endpoints'], options['threshold'])
+            self.stdout.write(f'Compared with the run of {previous["created_at"]}')
+            for regression in regressions:
+                self.stdout.write(self.style.WARNING(f'  regression: {regression}'))
+            if not regressions:
+                self.stdout.write(self.style.SUCCESS('  no regressions'))
+
+        failed = bool(regressions) and options['fail_on_regression']
+        if not options['no_save'] and not failed:
+            run = {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'iterations': options['iterations'],
+                'endpoints': results,
+            }
+            output_dir.mkdir(parents=True, exist_ok=True)
+            stamped = output_dir / f'run-{timezone.now():%Y%m%d-%H%M%S}.json'
+            for path in (stamped, latest):
+                path.write_text(json.dumps(run, indent=2, sort_keys=True))
+            self.stdout.write(f'Saved {stamped}')
+
+        if failed:
+            raise CommandError(f'{len(regressions)} regression(s) against the last run')
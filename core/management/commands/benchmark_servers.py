@@ -0,0 +1,71 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from core import benchmark, server_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Compare catalog throughput of Gunicorn sync workers (WSGI) and Uvicorn workers (ASGI) on the same data'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode', action='append', default=[], choices=list(server_benchmark.MODES),
+            help='Benchmark only this server mode (repeatable; default: wsgi and asgi)',
+        )
+        parser.add_argument('--duration', type=float, default=15, help='Seconds of load per mode (default: 15)')
+        parser.add_argument('--warmup', type=float, default=3, help='Untimed seconds of load first (default: 3)')
+        parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client connections (default: 32)')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Server processes for every mode (default: sized from the CPU count by gunicorn.conf.py)',
+        )
+        parser.add_argument(
+            '--output-dir', default=str(Path(settings.BASE_DIR) / 'benchmarks'),
+            help='Where servers-<timestamp>.json is written (default: BASE_DIR/benchmarks)',
+        )
+        parser.add_argument('--no-save', action='store_true', help='Only print the results')
+
+    def handle(self, *args, **options):
+        if options['duration'] <= 0 or options['warmup'] < 0 or options['concurrency'] < 1:
+            raise CommandError('--duration and --concurrency must be positive and --warmup non-negative')
+        paths = server_benchmark.catalog_paths(benchmark.discover_endpoints())
+        if not paths:
+            raise CommandError('No catalog pages to request; run generate_catalog first')
+
+        results = {}
+        for mode in options['mode'] or list(server_benchmark.MODES):
+            self.stdout.write(f'{mode}: {options["concurrency"]} connections for {options["duration"]:g}s ...')
+            try:
+                results[mode] = result = server_benchmark.run(
+                    mode, paths, options['concurrency'], options['duration'], options['warmup'], options['workers'],
+                )
+            except (OSError, RuntimeError) as error:
+                raise CommandError(f'Could not benchmark {mode}: {error}')
+            self.stdout.write(
+                f'{mode:<5} {result["requests_per_second"]:8.1f} req/s  p50 {result["p50_ms"]:8.2f}ms  '
+                f'p95 {result["p95_ms"]:8.2f}ms  p99 {result["p99_ms"]:8.2f}ms  errors {result["errors"]}'
+            )
+        if {'wsgi', 'asgi'} <= results.keys() and results['wsgi']['requests_per_second']:
+            ratio = results['asgi']['requests_per_second'] / results['wsgi']['requests_per_second']
+            self.stdout.write(self.style.SUCCESS(f'ASGI throughput is {ratio:.2f}x WSGI'))
+
+        if not options['no_save']:
+            run = {
+                'created_at': timezone.now().isoformat(),
+                'database': connection.vendor,
+                'paths': paths,
+                'concurrency': options['concurrency'],
+                'duration': options['duration'],
+                'workers': options['workers'],
+                'modes': results,
+            }
+            output_dir = Path(options['output_dir'])
+            output_dir.mkdir(parents=True, exist_ok=True)
+            path = output_dir / f'servers-{timezone.now():%Y%m%d-%H%M%S}.json'
+            path.write_text(json.dumps(run, indent=2, sort_keys=True))
+            self.stdout.write(f'Saved {path}')
@@ -0,0 +1,116 @@
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from core import benchmark
+from products.models import Product
+
+WRITE = re.compile(r'^\s*(INSERT|UPDATE|DELETE)\b', re.I)
+SESSION_TABLE = 'django_session'
+
+CONFIGS = {
+    'before': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.fallback.FallbackStorage',
+        'session_middleware': 'django.contrib.sessions.middleware.SessionMiddleware',
+    },
+    'after': {
+        'SESSION_ENGINE': 'django.contrib.sessions.backends.cached_db',
+        'MESSAGE_STORAGE': 'django.contrib.messages.storage.cookie.CookieStorage',
+        'session_middleware': 'core.sessions.SessionMiddleware',
+    },
+}
+
+
+class Command(BaseCommand):
+    help = 'Count session and database writes per request for a browse-and-buy flow, before and after core.sessions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=10, help='Catalog pages read per phase (default: 10)')
+
+    def handle(self, *args, **options):
+        if options['pages'] < 1:
+            raise CommandError('--pages must be positive')
+        products = list(Product.objects.filter(is_available=True, stock__gt=10).order_by('pk')[:options['pages']])
+        if not products:
+            raise CommandError('No products in stock; run generate_catalog first')
+
+        # Warm the catalog caches, so both configurations read the same pages
+        self.measure(benchmark._client(None), [('get', page, None) for page in self.pages(products)])
+        results = {}
+        for name, config in CONFIGS.items():
+            middleware = [
+                config['session_middleware'] if path.endswith('SessionMiddleware') else path
+                for path in settings.MIDDLEWARE
+            ]
+            with override_settings(
+                SESSION_ENGINE=config['SESSION_ENGINE'], MESSAGE_STORAGE=config['MESSAGE_STORAGE'], MIDDLEWARE=middleware,
+            ), transaction.atomic():
+                results[name] = self.run_flow(products)
+                # Leave the database as it was for the next configuration
+                transaction.set_rollback(True)
+
+        self.stdout.write(
+            f'{"phase":<22} {"":<7} {"requests":>8} {"queries/req":>12} '
+            f'{"session reads/req":>18} {"session writes/req":>19} {"db writes/req":>14}'
+        )
+        for phase in results['before']:
+            for name in CONFIGS:
+                counts = results[name][phase]
+                requests = counts['requests']
+                self.stdout.write(
+                    f'{phase:<22} {name:<7} {requests:>8} {counts["queries"] / requests:>12.2f} '
+                    f'{counts["session_reads"] / requests:>18.2f} {counts["session_writes"] / requests:>19.2f} '
+                    f'{counts["writes"] / requests:>14.2f}'
+                )
+
+    def pages(self, products):
+        return [reverse('products:product_list')] + [
+            reverse('products:product_detail', args=[product.slug]) for product in products
+        ]
+
+    def run_flow(self, products):
+        pages = self.pages(products)
+        add = reverse('cart:add_to_cart')
+        phases = {}
+
+        anonymous = benchmark._client(None)
+        phases['anonymous browsing'] = self.measure(anonymous, [('get', page, None) for page in pages])
+        phases['anonymous cart'] = self.measure(anonymous, [
+            step for product in products[:3]
+            for step in (('post', add, {'product_id': product.pk}), ('get', reverse('cart:view_cart'), None))
+        ])
+        phases['anonymous after cart'] = self.measure(anonymous, [('get', page, None) for page in pages])
+
+        user = User.objects.create_user(f'session-benchmark-{User.objects.count()}')
+        signed_in = benchmark._client(user)
+        phases['signed-in browsing'] = self.measure(signed_in, [('get', page, None) for page in pages])
+        phases['signed-in cart'] = self.measure(signed_in, [
+            step for product in products[:3]
+            for step in (('post', add, {'product_id': product.pk}), ('get', reverse('cart:view_cart'), None))
+        ])
+        return phases
+
+    def measure(self, client, steps):
+        counts = Counter()
+        for method, path, data in steps:
+            with CaptureQueriesContext(connection) as queries:
+                response = getattr(client, method)(path, data)
+            if response.status_code >= 400:
+                raise CommandError(f'{method.upper()} {path} returned {response.status_code}')
+            counts['requests'] += 1
+            for query in queries.captured_queries:
+                sql = query['sql']
+                write = bool(WRITE.match(sql))
+                counts['queries'] += 1
+                counts['writes'] += write
+                if SESSION_TABLE in sql:
+                    counts['session_writes' if write else 'session_reads'] += 1
+        return counts
@@ -0,0 +1,67 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+from django.utils import timezone
+
+from core import benchmark, startup
+
+
+class Command(BaseCommand):
+    help = 'Time django.setup(), manage.py check, imports and the first request of a cold process, against a baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per figure; medians are kept (default: 5)')
+        parser.add_argument(
+            '--path', default=reverse('products:product_list'),
+            help='Page requested by the cold process (default: the product list)',
+        )
+        parser.add_argument(
+            '--baseline', default=str(Path(settings.BASE_DIR) / 'benchmarks' / 'startup.json'),
+            help='Baseline to compare with and update (default: BASE_DIR/benchmarks/startup.json)',
+        )
+        parser.add_argument(
+            '--threshold', type=float, default=0.2,
+            help='Allowed slowdown against the baseline before flagging it (default: 0.2 = 20%%)',
+        )
+        parser.add_argument(
+            '--fail-on-regression', action='store_true',
+            help='Exit with an error if startup regressed against the baseline',
+        )
+        parser.add_argument('--no-save', action='store_true', help='Do not write this run as the new baseline')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be positive')
+        host = benchmark._client(None).defaults['HTTP_HOST']
+        try:
+            result = startup.run(options['path'], host, options['runs'])
+        except RuntimeError as error:
+            raise CommandError(error)
+
+        for metric in startup.METRICS + ['warm_request_ms']:
+            self.stdout.write(f'{metric:<20} {result[metric]:9.1f}ms')
+        self.stdout.write('Slowest imports (cumulative):')
+        for entry in result['slowest_imports']:
+            self.stdout.write(f'  {entry["module"]:<48} {entry["cumulative_ms"]:8.1f}ms')
+
+        baseline = Path(options['baseline'])
+        previous = json.loads(baseline.read_text()) if baseline.exists() else None
+        regressions = startup.compare(result, previous['startup'] if previous else {}, options['threshold'])
+        if previous:
+            self.stdout.write(f'Compared with the run of {previous["created_at"]}')
+        for regression in regressions:
+            self.stdout.write(self.style.WARNING(f'  regression: {regression}'))
+        if previous and not regressions:
+            self.stdout.write(self.style.SUCCESS('  no regressions'))
+
+        failed = bool(regressions) and options['fail_on_regression']
+        if not options['no_save'] and not failed:
+            baseline.parent.mkdir(parents=True, exist_ok=True)
+            baseline.write_text(json.dumps({'created_at': timezone.now().isoformat(), 'startup': result}, indent=2, sort_keys=True))
+            self.stdout.write(f'Saved {baseline}')
+
+        if failed:
+            raise CommandError(f'{len(regressions)} startup regression(s) against the baseline')
@@ -0,0 +1,56 @@
+import brotli
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from django.urls import reverse
+
+from core import benchmark, css, server_benchmark
+
+
+class Command(BaseCommand):
+    help = 'Extract the templates\' stylesheet blocks into minified CSS bundles (run by collectstatic)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--report', action='store_true',
+            help='Also compare the HTML size of the catalog pages with inline CSS and with bundles',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            built = css.build()
+        except css.BundleError as error:
+            raise CommandError(error)
+        if options['verbosity'] > 0:
+            self.stdout.write(f'{len(built)} bundle(s) in {settings.CSS_BUNDLE_ROOT}')
+            self.stdout.write(f'{"bundle":<32} {"css":>8} {"minified":>9} {"gzip":>7} {"brotli":>7}')
+            for name, (source, minified) in sorted(built.items()):
+                self.stdout.write(
+                    f'{name:<32} {len(source.encode()):>8} {len(minified.encode()):>9} '
+                    f'{css.gzip_size(minified):>7} {len(brotli.compress(minified.encode())):>7}'
+                )
+        if options['report']:
+            self.report()
+
+    def report(self):
+        paths = [reverse('core:home')] + server_benchmark.catalog_paths(benchmark.discover_endpoints())
+        # Plain storage: the report must not depend on a collected manifest
+        storages = {**settings.STORAGES, 'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'}}
+        sizes = {}
+        for bundles in (False, True):
+            with override_settings(CSS_BUNDLES=bundles, STORAGES=storages):
+                client = benchmark._client(None)
+                for path in paths:
+                    response = client.get(path)
+                    if response.status_code != 200:
+                        raise CommandError(f'GET {path} returned {response.status_code}')
+                    sizes.setdefault(path, []).append((len(response.content), css.gzip_size(response.content.decode())))
+
+        self.stdout.write(f'\n{"page":<48} {"inline html":>12} {"bundled html":>13} {"gzip before":>12} {"gzip after":>11}')
+        for path, ((before, gzip_before), (after, gzip_after)) in sizes.items():
+            self.stdout.write(f'{path[:48]:<48} {before:>12} {after:>13} {gzip_before:>12} {gzip_after:>11}')
+        before = sum(page[0][0] for page in sizes.values())
+        after = sum(page[1][0] for page in sizes.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'HTML is {before - after} bytes ({(before - after) / before:.0%}) smaller per visit to these {len(sizes)} pages'
+        ))
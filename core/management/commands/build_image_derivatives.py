@@ -0,0 +1,116 @@
+import hashlib
+import multiprocessing
+import os
+import time
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from core import images
+
+# target: (model, source field, derivatives field)
+TARGETS = {
+    'products': ('products.ProductImage', 'image', 'derivatives'),
+    'profiles': ('accounts.Profile', 'profile_picture', 'profile_picture_derivatives'),
+}
+MIRROR_EXTENSIONS = {'image/jpeg': 'jpg', 'image/png': 'png', 'image/webp': 'webp', 'image/gif': 'gif'}
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/JPEG derivatives for product images and profile pictures'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--only', action='append', default=[], choices=list(TARGETS),
+            help='Process only these images (repeatable; default: all)',
+        )
+        parser.add_argument(
+            '--mirror', action='store_true',
+            help='First download product images that only have a remote image_url',
+        )
+        parser.add_argument('--force', action='store_true', help='Rebuild derivatives that already exist')
+        parser.add_argument(
+            '--workers', type=int, default=settings.IMAGE_WORKERS or os.cpu_count(),
+            help='Resizing processes (default: IMAGE_WORKERS)',
+        )
+        parser.add_argument('--batch-size', type=int, default=100, help='Images handed to the pool at a time')
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--workers and --batch-size must be positive integers')
+        targets = options['only'] or list(TARGETS)
+        if options['mirror'] and 'products' in targets:
+            self.mirror()
+
+        started = time.perf_counter()
+        with ProcessPoolExecutor(options['workers'], mp_context=multiprocessing.get_context('spawn')) as pool:
+            for target in targets:
+                self.build(pool, *TARGETS[target], force=options['force'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Done in {time.perf_counter() - started:.1f}s'))
+
+    def mirror(self):
+        """Download remote-only product images into their image field"""
+        ProductImage = apps.get_model('products.ProductImage')
+        pending = list(ProductImage.objects.filter(Q(image='') | Q(image__isnull=True)).exclude(image_url=''))
+
+        def fetch(product_image):
+            try:
+                with urllib.request.urlopen(product_image.image_url, timeout=20) as response:
+                    extension = MIRROR_EXTENSIONS.get(response.headers.get_content_type())
+                    if extension is None:
+                        return product_image, None, f'not an image ({response.headers.get_content_type()})'
+                    return product_image, (response.read(), extension), None
+            except OSError as error:
+                return product_image, None, error
+
+        mirrored = []
+        with ThreadPoolExecutor(8) as threads:
+            for product_image, download, error in threads.map(fetch, pending):
+                if error:
+                    self.stderr.write(self.style.WARNING(f'Could not mirror {product_image.image_url}: {error}'))
+                    continue
+                data, extension = download
+                name = f'{hashlib.sha256(data).hexdigest()[:16]}.{extension}'
+                product_image.image.save(name, ContentFile(data), save=False)
+                mirrored.append(product_image)
+        ProductImage.objects.bulk_update(mirrored, ['image'], batch_size=500)
+        self.stdout.write(f'Mirrored {len(mirrored)} of {len(pending)} product images')
+
+    def build(self, pool, label, source_field, derivatives_field, force, batch_size):
+        model = apps.get_model(label)
+        candidates = model.objects.exclude(**{source_field: ''}).exclude(**{f'{source_field}__isnull': True})
+        pending = [
+            instance for instance in candidates.order_by('pk').iterator(chunk_size=2000)
+            if force or images.needs_derivatives(instance, source_field, derivatives_field)
+        ]
+        done = 0
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            sources = []
+            for instance in batch:
+                with default_storage.open(getattr(instance, source_field).name, 'rb') as file:
+                    sources.append(file.read())
+            for instance, rendered in zip(batch, pool.map(images.render, sources)):
+                setattr(instance, derivatives_field, images.store(getattr(instance, source_field).name, rendered))
+            model.objects.bulk_update(batch, [derivatives_field])
+            done += len(batch)
+            self.after_update(label, batch)
+        self.stdout.write(f'{label}: built derivatives for {done} image(s)')
+
+    def after_update(self, label, batch):
+        # bulk_update skips signals; do what the product image receivers would
+        if label == 'products.ProductImage':
+            from products import homepage
+            from products.cache import PRODUCT, RELATED, catalog_cache
+            from products.models import Product
+
+            Product.objects.filter(pk__in={image.product_id for image in batch}).update(updated_at=timezone.now())
+            catalog_cache.bump(PRODUCT, RELATED)
+            homepage.invalidate()
@@ -0,0 +1,10 @@
+from django.contrib.staticfiles.management.commands import collectstatic
+from django.core.management import call_command
+
+
+class Command(collectstatic.Command):
+    help = collectstatic.Command.help + ' Builds the CSS bundles first (build_css).'
+
+    def handle(self, **options):
+        call_command('build_css', verbosity=options['verbosity'], stdout=self.stdout, stderr=self.stderr)
+        return super().handle(**options)
@@ -0,0 +1,53 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from core.performance import merged_stats
+
+
+class Command(BaseCommand):
+    help = 'Show per-URL-name request latency histograms published by the running server processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--json', action='store_true', help='Print the raw merged stats as JSON')
+        parser.add_argument(
+            '--slow', type=int, default=5,
+            help='Number of slowest captured requests to show with their SQL (default: 5)',
+        )
+
+    def handle(self, *args, **options):
+        stats = merged_stats(include_self=False)
+        if options['json']:
+            self.stdout.write(json.dumps(stats, indent=2))
+            return
+        if not stats['histograms']:
+            self.stdout.write(self.style.WARNING(
+                'No stats published yet. Serve some traffic, and make sure the server and this '
+                'command share a cache backend (CACHE_BACKEND), since locmem is per process.'
+            ))
+            return
+
+        self.stdout.write(f'{len(stats["processes"])} process(es) reporting')
+        self.stdout.write(f'{"url name":<36} {"count":>7} {"mean":>9} {"p50":>7} {"p95":>7} {"p99":>7} {"max":>9} {"q/req":>6}')
+        rows = sorted(stats['histograms'].items(), key=lambda item: item[1]['total_ms'], reverse=True)
+        for name, data in rows:
+            self.stdout.write(
+                f'{name:<36} {data["count"]:>7} {data["mean_ms"]:>8.1f}ms '
+                f'{self._bound(data["p50_ms"]):>7} {self._bound(data["p95_ms"]):>7} {self._bound(data["p99_ms"]):>7} '
+                f'{data["max_ms"]:>7.1f}ms {data["queries"] / data["count"]:>6.1f}'
+            )
+
+        for record in stats['slow_requests'][:options['slow']]:
+            self.stdout.write('')
+            self.stdout.write(self.style.WARNING(
+                f'{record["method"]} {record["path"]} {record["total_ms"]:.0f}ms '
+                f'({record["db_queries"]} queries, {record["db_ms"]:.0f}ms in SQL)'
+            ))
+            for query in sorted(record['queries'], key=lambda query: query['ms'], reverse=True)[:5]:
+                self.stdout.write(f'  {query["ms"]:8.2f}ms  {query["sql"][:160]}')
+                if query['stack']:
+                    self.stdout.write(f'              at {query["stack"][-1]}')
+
+    def _bound(self, bound):
+        # Histogram percentiles are bucket upper bounds
+        return f'<{bound}ms' if bound is not None else '>5s'
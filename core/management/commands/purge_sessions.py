@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.sessions import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired database sessions in chunks (schedule it, e.g. nightly)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Sessions deleted per statement (default: 1000)')
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between chunks, to leave room for live traffic (default: 0)',
+        )
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1 or options['pause'] < 0:
+            raise CommandError('--chunk-size must be positive and --pause non-negative')
+        started = time.perf_counter()
+        deleted = purge_expired(options['chunk_size'], options['pause'])
+        self.stdout.write(f'Deleted {deleted} expired session(s) in {time.perf_counter() - started:.1f}s')
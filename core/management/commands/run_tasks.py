@@ -0,0 +1,104 @@
+import json
+import multiprocessing
+import signal
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core import tasks
+
+
+class Command(BaseCommand):
+    help = 'Run queued background tasks (core.tasks) on a thread or process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--queue', action='append', default=[],
+            help='Queue to take tasks from (repeatable; default: default and cache)',
+        )
+        parser.add_argument('--concurrency', type=int, default=4, help='Tasks run at once (default: 4)')
+        parser.add_argument(
+            '--pool', choices=['thread', 'process'], default='thread',
+            help='thread suits I/O bound tasks like email; process suits CPU bound ones like image resizing',
+        )
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between polls when idle')
+        parser.add_argument('--once', action='store_true', help='Run the tasks due now, then exit')
+        parser.add_argument('--stats', action='store_true', help='Print task counts and durations, then exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(tasks.stats(), indent=2, default=str))
+            return
+        if options['concurrency'] < 1 or options['poll_interval'] <= 0:
+            raise CommandError('--concurrency and --poll-interval must be positive')
+
+        queues = options['queue'] or ['default', 'cache']
+        if options['pool'] == 'process':
+            # spawn: forking a process that holds DB connections and threads is unsafe
+            pool = ProcessPoolExecutor(
+                options['concurrency'], mp_context=multiprocessing.get_context('spawn'),
+                initializer=tasks.setup_process,
+            )
+        else:
+            pool = ThreadPoolExecutor(options['concurrency'], thread_name_prefix='task')
+
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        self.stdout.write(
+            f'Worker {tasks.worker_id()} running {", ".join(queues)} with '
+            f'{options["concurrency"]} {options["pool"]}(s) on {type(tasks.get_backend()).__name__}'
+        )
+        with pool:
+            try:
+                processed = self.work(pool, queues, options)
+            except KeyboardInterrupt:
+                processed = None
+        if processed is not None:
+            self.stdout.write(self.style.SUCCESS(f'Processed {processed} task(s)'))
+
+    def stop(self, signum, frame):
+        # Finish the tasks in flight, claim no more
+        self.stopping = True
+
+    def work(self, pool, queues, options):
+        backend = tasks.get_backend()
+        worker = tasks.worker_id()
+        lease = getattr(settings, 'TASK_LEASE_SECONDS', 300)
+        retention = timedelta(days=getattr(settings, 'TASK_RETENTION_DAYS', 7))
+        in_flight = {}
+        processed = 0
+        next_prune = 0
+
+        while True:
+            if time.monotonic() >= next_prune:
+                backend.prune(timezone.now() - retention)
+                next_prune = time.monotonic() + 60 * 60
+
+            claimed = []
+            if not self.stopping:
+                claimed = backend.claim(queues, worker, options['concurrency'] - len(in_flight), lease)
+                for job in claimed:
+                    in_flight[pool.submit(tasks.execute, job.name, job.args, job.kwargs)] = job
+
+            if not in_flight:
+                if self.stopping or options['once']:
+                    return processed
+                time.sleep(options['poll_interval'])
+                continue
+
+            # A full pool waits for a free slot; otherwise poll again after the interval at most
+            timeout = None if len(in_flight) >= options['concurrency'] else options['poll_interval']
+            done, _ = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                job = in_flight.pop(future)
+                try:
+                    error, duration_ms = future.result()
+                except Exception as exc:
+                    # The pool itself failed, e.g. a worker process died or args would not pickle
+                    error, duration_ms = repr(exc), 0.0
+                tasks.finish(backend, job, error, duration_ms)
+                processed += 1
@@ -0,0 +1,342 @@
+"""
+Per-request performance instrumentation.
+
+``PerformanceMiddleware`` measures every request:
+
+- SQL query count and time, through an ``execute_wrapper`` that
+  ``CoreConfig.ready`` installs on every connection. It reports to the
+  request in the current context, so queries an async view runs on other
+  threads are counted too
+- template render time, through a wrapper around ``Template.render``
+  installed by ``CoreConfig.ready`` (nested ``{% include %}`` renders are
+  only counted once, at the outermost template)
+- catalog cache hits and misses, reported by ``products.cache``
+- total time spent below the middleware
+
+The figures go out as a ``Server-Timing`` header (visible in the browser's
+network panel) and as one structured log line on the ``core.performance``
+logger. Requests over ``PERFORMANCE_SLOW_REQUEST_MS`` are kept with their
+SQL and the application stack of each query. Recording stacks is not free,
+so only a ``PERFORMANCE_SAMPLE_RATE`` fraction of requests record them.
+
+Durations also feed per-URL-name histograms. They are held in memory per
+process and published to the default cache every
+``PERFORMANCE_PUBLISH_SECONDS``, so the staff endpoint and the
+``performance_stats`` command can merge every worker's numbers. That needs a
+cache shared between processes, such as Redis or memcached.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+PUBLISH_INDEX_KEY = 'performance:processes'
+MAX_CAPTURED_QUERIES = 200
+MAX_SLOW_REQUESTS = 50
+
+_current = ContextVar('request_metrics', default=None)
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def _app_stack():
+    """The project's own frames of the current stack, innermost last"""
+    root = str(settings.BASE_DIR)
+    return [
+        f'{frame.filename[len(root) + 1:]}:{frame.lineno} in {frame.name}'
+        for frame in traceback.extract_stack()[:-2]
+        if frame.filename.startswith(root) and '/site-packages/' not in frame.filename
+    ]
+
+
+class RequestMetrics:
+    """Counters for one request; doubles as the execute_wrapper hook"""
+
+    def __init__(self, sampled=False):
+        self.sampled = sampled
+        # Async views may run queries on several threads at once
+        self.lock = threading.Lock()
+        self.db_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.template_depth = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            stack = _app_stack() if self.sampled and len(self.queries) < MAX_CAPTURED_QUERIES else None
+            with self.lock:
+                self.db_count += 1
+                self.db_ms += duration
+                if stack is not None:
+                    self.queries.append({'sql': sql, 'ms': round(duration, 3), 'stack': stack})
+
+
+def measure_query(execute, sql, params, many, context):
+    """execute_wrapper on every connection, reporting to the request being measured in this context"""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver installing measure_query (once per connection object)"""
+    if measure_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(measure_query)
+
+
+def record_cache(hit, count=1):
+    """Count cache hits or misses against the current request, if one is being measured"""
+    metrics = _current.get()
+    if metrics is not None:
+        with metrics.lock:
+            if hit:
+                metrics.cache_hits += count
+            else:
+                metrics.cache_misses += count
+
+
+def instrument_templates():
+    """Wrap Template.render so the time spent rendering is added to the current request"""
+    from django.template.base import Template
+
+    if getattr(Template.render, 'instrumented', False):
+        return
+    render = Template.render
+
+    def instrumented_render(self, context):
+        metrics = _current.get()
+        if metrics is None or metrics.template_depth:
+            return render(self, context)
+        metrics.template_depth += 1
+        started = time.perf_counter()
+        try:
+            return render(self, context)
+        finally:
+            metrics.template_ms += (time.perf_counter() - started) * 1000
+            metrics.template_depth -= 1
+
+    instrumented_render.instrumented = True
+    Template.render = instrumented_render
+
+
+class Histogram:
+    """Fixed-bucket latency histogram with running totals"""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+
+    def observe(self, duration_ms, queries):
+        self.buckets[bisect_left(BUCKETS_MS, duration_ms)] += 1
+        self.count += 1
+        self.total_ms += duration_ms
+        self.max_ms = max(self.max_ms, duration_ms)
+        self.queries += queries
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'max_ms': round(self.max_ms, 3),
+            'queries': self.queries,
+            'buckets': self.buckets,
+        }
+
+
+class Registry:
+    """Per-process histograms by URL name plus the most recent slow request captures"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.process_key = f'performance:{socket.gethostname()}:{os.getpid()}'
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.slow_requests = deque(maxlen=MAX_SLOW_REQUESTS)
+            self.published_at = 0.0
+
+    def observe(self, name, duration_ms, metrics):
+        with self.lock:
+            self.histograms.setdefault(name, Histogram()).observe(duration_ms, metrics.db_count)
+
+    def capture(self, record):
+        with self.lock:
+            self.slow_requests.append(record)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'process': self.process_key,
+                'histograms': {name: histogram.as_dict() for name, histogram in self.histograms.items()},
+                'slow_requests': list(self.slow_requests),
+            }
+
+    def maybe_publish(self, now):
+        interval = _setting('PERFORMANCE_PUBLISH_SECONDS', 10)
+        with self.lock:
+            if now - self.published_at < interval:
+                return
+            self.published_at = now
+        self.publish()
+
+    def publish(self):
+        """Share this process's snapshot through the default cache"""
+        timeout = _setting('PERFORMANCE_PUBLISH_TTL', 60 * 60)
+        try:
+            cache.set(self.process_key, self.snapshot(), timeout)
+            processes = cache.get(PUBLISH_INDEX_KEY) or []
+            if self.process_key not in processes:
+                cache.set(PUBLISH_INDEX_KEY, processes + [self.process_key], timeout)
+        except Exception:
+            logger.exception('Could not publish performance stats')
+
+
+registry = Registry()
+
+
+def merged_stats(include_self=True):
+    """Histograms and slow requests of every process that published (this one first, if asked)"""
+    if include_self:
+        registry.publish()
+    snapshots = cache.get_many(cache.get(PUBLISH_INDEX_KEY) or [])
+    histograms = {}
+    slow_requests = []
+    for snapshot in snapshots.values():
+        for name, data in snapshot['histograms'].items():
+            merged = histograms.setdefault(name, {
+                'count': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'queries': 0, 'buckets': [0] * (len(BUCKETS_MS) + 1),
+            })
+            merged['count'] += data['count']
+            merged['total_ms'] += data['total_ms']
+            merged['max_ms'] = max(merged['max_ms'], data['max_ms'])
+            merged['queries'] += data['queries']
+            merged['buckets'] = [a + b for a, b in zip(merged['buckets'], data['buckets'])]
+        slow_requests.extend(snapshot['slow_requests'])
+
+    for data in histograms.values():
+        data['mean_ms'] = round(data['total_ms'] / data['count'], 3) if data['count'] else 0.0
+        data['p50_ms'] = _bucket_percentile(data['buckets'], data['count'], 50)
+        data['p95_ms'] = _bucket_percentile(data['buckets'], data['count'], 95)
+        data['p99_ms'] = _bucket_percentile(data['buckets'], data['count'], 99)
+    slow_requests.sort(key=lambda record: record['total_ms'], reverse=True)
+    return {
+        'processes': sorted(snapshots),
+        'bucket_bounds_ms': list(BUCKETS_MS),
+        'histograms': histograms,
+        'slow_requests': slow_requests[:MAX_SLOW_REQUESTS],
+    }
+
+
+def _bucket_percentile(buckets, count, pct):
+    """Upper bound of the bucket holding the percentile (None past the last bound)"""
+    if not count:
+        return None
+    rank = count * pct / 100
+    seen = 0
+    for bound, bucket_count in zip(list(BUCKETS_MS) + [None], buckets):
+        seen += bucket_count
+        if seen >= rank:
+            return bound
+    return None
+
+
+def _server_timing(metrics, total_ms):
+    return ', '.join([
+        f'db;dur={metrics.db_ms:.1f};desc="{metrics.db_count} queries"',
+        f'tpl;dur={metrics.template_ms:.1f}',
+        f'cache;desc="{metrics.cache_hits} hits {metrics.cache_misses} misses"',
+        f'app;dur={max(total_ms - metrics.db_ms - metrics.template_ms, 0):.1f}',
+        f'total;dur={total_ms:.1f}',
+    ])
+
+
+class PerformanceMiddleware:
+    """Measure each request; see the module docstring"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        metrics, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            total_ms = (time.perf_counter() - started) * 1000
+            _current.reset(token)
+        return self.finish(request, response, metrics, total_ms)
+
+    async def __acall__(self, request):
+        metrics, token = self.start()
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total_ms = (time.perf_counter() - started) * 1000
+            _current.reset(token)
+        return self.finish(request, response, metrics, total_ms)
+
+    def start(self):
+        metrics = RequestMetrics(sampled=random.random() < _setting('PERFORMANCE_SAMPLE_RATE', 0.1))
+        return metrics, _current.set(metrics)
+
+    def finish(self, request, response, metrics, total_ms):
+        match = getattr(request, 'resolver_match', None)
+        name = match.view_name if match else '<unresolved>'
+        record = {
+            'method': request.method,
+            'path': request.path,
+            'url_name': name,
+            'status': response.status_code,
+            'total_ms': round(total_ms, 3),
+            'db_queries': metrics.db_count,
+            'db_ms': round(metrics.db_ms, 3),
+            'template_ms': round(metrics.template_ms, 3),
+            'cache_hits': metrics.cache_hits,
+            'cache_misses': metrics.cache_misses,
+        }
+        if _setting('PERFORMANCE_SERVER_TIMING', True):
+            response['Server-Timing'] = _server_timing(metrics, total_ms)
+        logger.info(json.dumps(record), extra={'performance': record})
+
+        registry.observe(name, total_ms, metrics)
+        if metrics.sampled and total_ms >= _setting('PERFORMANCE_SLOW_REQUEST_MS', 500):
+            registry.capture({**record, 'captured_at': time.time(), 'queries': metrics.queries})
+            logger.warning('Slow request %s %s took %.0fms', request.method, request.path, total_ms)
+        registry.maybe_publish(time.monotonic())
+        return response
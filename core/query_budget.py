@@ -0,0 +1,99 @@
+"""
+Query budgets for views.
+
+Decorate a view with ``query_budget(n)`` to declare how many database
+queries it may issue, template rendering included. Going over the budget
+logs a warning, or raises ``QueryBudgetExceeded`` when the
+``QUERY_BUDGET_RAISE`` setting is on (``core.test_runner`` turns it on
+for the whole test suite), so N+1
+regressions surface as failures instead of slow pages.
+
+Queries are counted by an ``execute_wrapper`` that ``CoreConfig.ready``
+installs on every connection, against the budgets active in the current
+context. Async views are supported, including queries they run on other
+threads through ``sync_to_async``.
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_active = ContextVar('query_budget_counters', default=())
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryCounter:
+    """SQL statements run while a budget was active"""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.queries)
+
+
+def count_query(execute, sql, params, many, context):
+    """execute_wrapper on every connection, feeding the budgets active in this context"""
+    for counter in _active.get():
+        with counter.lock:
+            counter.queries.append(sql)
+    return execute(sql, params, many, context)
+
+
+def instrument_connection(sender, connection, **kwargs):
+    """connection_created receiver installing count_query (once per connection object)"""
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+@contextmanager
+def counting():
+    """Count the queries run in this context (and threads it hands work to) while the block runs"""
+    counter = QueryCounter()
+    token = _active.set(_active.get() + (counter,))
+    try:
+        yield counter
+    finally:
+        _active.reset(token)
+
+
+def _check(request, counter, max_queries):
+    if len(counter) > max_queries:
+        message = (
+            f'{request.method} {request.path} ran {len(counter)} queries, '
+            f'over its budget of {max_queries}'
+        )
+        if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+            raise QueryBudgetExceeded(message + ':\n' + '\n'.join(counter.queries))
+        logger.warning(message, extra={'queries': counter.queries})
+
+
+def query_budget(max_queries):
+    """Decorator limiting a view to ``max_queries`` database queries per request"""
+    def decorator(view_func):
+        if iscoroutinefunction(view_func):
+            @wraps(view_func)
+            async def _wrapped_view(request, *args, **kwargs):
+                with counting() as counter:
+                    response = await view_func(request, *args, **kwargs)
+                _check(request, counter, max_queries)
+                return response
+        else:
+            @wraps(view_func)
+            def _wrapped_view(request, *args, **kwargs):
+                with counting() as counter:
+                    response = view_func(request, *args, **kwargs)
+                _check(request, counter, max_queries)
+                return response
+        return _wrapped_view
+    return decorator
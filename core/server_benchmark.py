@@ -0,0 +1,171 @@
+"""
+Sync WSGI versus async ASGI server benchmarks.
+
+Starts Gunicorn twice against the configured database, with the settings
+in gunicorn.conf.py:
+
+- ``wsgi``: sync workers serving mystore.wsgi, i.e. the sync views
+- ``asgi``: Uvicorn workers serving mystore.asgi, i.e. the async views
+
+Both servers get the same closed-loop load: ``concurrency`` client threads
+hold keep-alive connections and request the anonymous catalog pages round
+robin for ``duration`` seconds. The client runs on the same machine as the
+server and shares its CPUs, so compare the two modes with each other rather
+than reading the figures as absolute capacity.
+"""
+import http.client
+import os
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlencode
+
+from django.conf import settings
+
+from .benchmark import percentile
+
+MODES = {
+    'wsgi': ('mystore.wsgi:application', 'sync'),
+    'asgi': ('mystore.asgi:application', 'uvicorn_worker.UvicornWorker'),
+}
+
+
+def catalog_paths(endpoints):
+    """Request paths of the anonymous GET endpoints"""
+    return [
+        endpoint.path + (f'?{urlencode(endpoint.data)}' if endpoint.data else '')
+        for endpoint in endpoints if endpoint.method == 'get' and endpoint.user is None
+    ]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode, port, workers=None):
+    app, worker_class = MODES[mode]
+    env = dict(
+        os.environ,
+        GUNICORN_WORKER_CLASS=worker_class,
+        GUNICORN_BIND=f'127.0.0.1:{port}',
+        GUNICORN_ACCESS_LOG='',
+        DEBUG='False',
+        # Unless asked for, don't depend on a collectstatic run
+        STATIC_MANIFEST=os.environ.get('STATIC_MANIFEST', 'False'),
+    )
+    if workers:
+        env['WEB_CONCURRENCY'] = str(workers)
+    # A file rather than a pipe, which would block the server once full
+    log = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', str(Path(settings.BASE_DIR) / 'gunicorn.conf.py'), app],
+        cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=log,
+    )
+    process.log = log
+    return process
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+    process.log.close()
+
+
+def server_log(process):
+    process.log.seek(0)
+    return process.log.read().decode(errors='replace')[-2000:]
+
+
+def wait_until_ready(process, port, path, host, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'Server exited with {process.returncode}:\n{server_log(process)}')
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=5)
+            connection.request('GET', path, headers={'Host': host})
+            connection.getresponse().read()
+            connection.close()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'Server on port {port} did not answer within {timeout}s')
+
+
+def load(port, paths, concurrency, duration, host):
+    """Closed-loop load: every client sends its next request as soon as the last one answers"""
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(offset):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        mine, failed = [], 0
+        index = offset
+        while time.monotonic() < deadline:
+            path = paths[index % len(paths)]
+            index += 1
+            started = time.perf_counter()
+            try:
+                connection.request('GET', path, headers={'Host': host})
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+                    continue
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            mine.append((time.perf_counter() - started) * 1000)
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    started = time.monotonic()
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'seconds': round(elapsed, 3),
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50), 3) if latencies else None,
+        'p95_ms': round(percentile(latencies, 95), 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99), 3) if latencies else None,
+        'mean_ms': round(statistics.fmean(latencies), 3) if latencies else None,
+    }
+
+
+def run(mode, paths, concurrency, duration, warmup, workers=None):
+    """Start a server in mode, warm it up, load it and stop it"""
+    port = free_port()
+    host = next((host for host in settings.ALLOWED_HOSTS if host != '*' and not host.startswith('.')), 'localhost')
+    process = start_server(mode, port, workers)
+    try:
+        wait_until_ready(process, port, paths[0], host)
+        if warmup:
+            load(port, paths, concurrency, warmup, host)
+        return load(port, paths, concurrency, duration, host)
+    finally:
+        stop_server(process)
@@ -0,0 +1,62 @@
+"""
+Session handling.
+
+- ``SESSION_ENGINE`` is ``cached_db`` when the cache is shared between
+  processes: sessions are read from the cache and only written through to
+  the database. With the per-process locmem cache a worker could read a
+  stale copy, so the plain database backend stays the default there.
+- ``MESSAGE_STORAGE`` keeps flash messages in a signed cookie, so
+  ``messages.success(...)`` never touches the session.
+- ``SessionMiddleware`` never starts a session on an anonymous GET or HEAD
+  of the ``SESSION_READ_ONLY_NAMESPACES`` pages (the catalog). A write there
+  is dropped and logged, so browsing stays sessionless and, with no session
+  cookie, publicly cacheable (see products.conditional).
+- ``purge_expired`` deletes expired database sessions in small chunks, so
+  the nightly ``purge_sessions`` run never holds long locks on the table.
+"""
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.sessions import middleware
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+
+class SessionMiddleware(middleware.SessionMiddleware):
+    """SessionMiddleware that never creates a session on an anonymous catalog read"""
+
+    def process_response(self, request, response):
+        if self.read_only(request) and request.session.modified:
+            logger.warning('Dropped a session write on anonymous %s %s', request.method, request.path)
+            request.session.modified = False
+        return super().process_response(request, response)
+
+    def read_only(self, request):
+        match = request.resolver_match
+        return (
+            request.method in ('GET', 'HEAD')
+            and settings.SESSION_COOKIE_NAME not in request.COOKIES
+            and match is not None
+            and match.namespace in getattr(settings, 'SESSION_READ_ONLY_NAMESPACES', ())
+        )
+
+
+def purge_expired(chunk_size=1000, pause=0):
+    """Delete expired database sessions chunk_size rows at a time; returns how many were deleted"""
+    now = timezone.now()
+    deleted = 0
+    while True:
+        # Walks the expire_date index; each DELETE is its own short transaction
+        keys = list(
+            Session.objects.filter(expire_date__lt=now).order_by('expire_date')
+            .values_list('session_key', flat=True)[:chunk_size]
+        )
+        if keys:
+            deleted += Session.objects.filter(session_key__in=keys).delete()[0]
+        if len(keys) < chunk_size:
+            return deleted
+        if pause:
+            time.sleep(pause)
@@ -0,0 +1,152 @@
+"""
+Startup benchmarks.
+
+Every measurement runs in a fresh interpreter, as a worker boot or a
+``manage.py`` command would:
+
+- ``setup_ms``: ``django.setup()``, i.e. settings plus every app's models,
+  signals and ``ready()``. Setup must not touch the database; opening a
+  connection there is reported as a regression whatever the timings;
+- ``check_ms``: the whole ``manage.py check`` process, interpreter included;
+- ``import_ms``: the import time ``python -X importtime`` reports for setup,
+  with the modules that cost most (``slowest_imports``);
+- ``first_request_ms``: the first catalog request of a fresh process, which
+  loads the middleware, URLconf and templates, next to ``warm_request_ms``
+  for the same request again.
+
+Each figure is the median of several runs. Results are plain dicts, saved
+as JSON baselines and compared by the ``benchmark_startup`` command.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+
+SETUP_SCRIPT = '''
+import json, time
+started = time.perf_counter()
+import django
+django.setup()
+setup_ms = (time.perf_counter() - started) * 1000
+from django.db import connections
+print(json.dumps({
+    'setup_ms': setup_ms,
+    'connected': [alias for alias in connections if connections[alias].connection is not None],
+}))
+'''
+
+REQUEST_SCRIPT = '''
+import json, sys, time
+import django
+django.setup()
+from django.test import Client
+client = Client(HTTP_HOST=sys.argv[2])
+timings = []
+for _ in range(2):
+    started = time.perf_counter()
+    response = client.get(sys.argv[1])
+    timings.append((time.perf_counter() - started) * 1000)
+print(json.dumps({'status': response.status_code, 'first_request_ms': timings[0], 'warm_request_ms': timings[1]}))
+'''
+
+# import time: self [us] | cumulative | imported package
+_IMPORT_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|( *)(\S+)')
+
+METRICS = ['setup_ms', 'check_ms', 'import_ms', 'first_request_ms']
+
+
+def _python(*args, script=None, argv=()):
+    """Run a fresh interpreter in BASE_DIR with the current settings; (stdout, stderr, wall ms)"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'mystore.settings'))
+    command = [sys.executable, *args] + (['-c', script, *argv] if script else [])
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    if result.returncode:
+        raise RuntimeError(f'{" ".join(args) or "script"} failed:\n{result.stderr[-2000:]}')
+    return result.stdout, result.stderr, elapsed
+
+
+def _script(script, *argv):
+    """The JSON a script prints last"""
+    stdout, _, _ = _python(script=script, argv=argv)
+    return json.loads(stdout.strip().splitlines()[-1])
+
+
+def parse_importtime(stderr):
+    """[(module, self us, cumulative us, depth)] from python -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        match = _IMPORT_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def measure_imports():
+    _, stderr, _ = _python('-X', 'importtime', script='import django; django.setup()')
+    imports = parse_importtime(stderr)
+    return sum(self_us for _, self_us, _, _ in imports) / 1000, imports
+
+
+def slowest_imports(imports, count=15):
+    """Top-level imports (and this project's modules) that cost most, cumulative ms"""
+    apps = {config.name.split('.')[0] for config in _project_apps()} | {settings.ROOT_URLCONF.split('.')[0]}
+    picked = [
+        (module, cumulative_us) for module, _, cumulative_us, depth in imports
+        if depth == 0 or module.split('.')[0] in apps
+    ]
+    slowest = sorted(picked, key=lambda item: item[1], reverse=True)[:count]
+    return [{'module': module, 'cumulative_ms': round(cumulative_us / 1000, 1)} for module, cumulative_us in slowest]
+
+
+def _project_apps():
+    from django.apps import apps
+
+    base = str(settings.BASE_DIR)
+    return [config for config in apps.get_app_configs() if config.path.startswith(base)]
+
+
+def run(path, host='localhost', runs=5):
+    """Median startup figures over runs fresh interpreters"""
+    samples = {metric: [] for metric in METRICS + ['warm_request_ms']}
+    connected, imports = set(), []
+    for _ in range(runs):
+        setup = _script(SETUP_SCRIPT)
+        samples['setup_ms'].append(setup['setup_ms'])
+        connected.update(setup['connected'])
+        samples['check_ms'].append(_python('manage.py', 'check')[2])
+        import_ms, imports = measure_imports()
+        samples['import_ms'].append(import_ms)
+        request = _script(REQUEST_SCRIPT, path, host)
+        if request['status'] >= 400:
+            raise RuntimeError(f'GET {path} returned {request["status"]}')
+        samples['first_request_ms'].append(request['first_request_ms'])
+        samples['warm_request_ms'].append(request['warm_request_ms'])
+    result = {metric: round(statistics.median(values), 1) for metric, values in samples.items()}
+    result.update(path=path, runs=runs, setup_connections=sorted(connected), slowest_imports=slowest_imports(imports))
+    return result
+
+
+def compare(current, baseline, threshold=0.2, min_delta_ms=20.0):
+    """Regressions of current against baseline: a metric slower beyond threshold, or setup querying
+
+    Slowdowns smaller than min_delta_ms are treated as noise.
+    """
+    regressions = []
+    if current['setup_connections']:
+        regressions.append(f'django.setup() opened database connections: {", ".join(current["setup_connections"])}')
+    for metric in METRICS:
+        previous = baseline.get(metric)
+        if previous is None:
+            continue
+        slower = current[metric] - previous
+        if slower > min_delta_ms and current[metric] > previous * (1 + threshold):
+            regressions.append(f'{metric}: {previous:.1f}ms -> {current[metric]:.1f}ms')
+    return regressions
@@ -0,0 +1,41 @@
+"""
+Static file serving.
+
+WhiteNoise serves ``STATIC_ROOT`` from the app server. Files the manifest
+storage renamed after their content hash (the CSS bundles among them) are
+sent with ``Cache-Control: max-age=315360000, public, immutable``, and a
+client that accepts brotli or gzip gets the precompressed variant that
+``collectstatic`` wrote next to the file.
+
+``StaticFilesMiddleware`` adds an async path to WhiteNoise's middleware,
+which is sync only: under ASGI a sync middleware at the top of the stack
+would move every request, static or not, onto a thread and back.
+"""
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from whitenoise.middleware import WhiteNoiseMiddleware
+
+
+class StaticFilesMiddleware(WhiteNoiseMiddleware):
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None, settings=settings):
+        super().__init__(get_response, settings)
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return super().__call__(request)
+
+    async def __acall__(self, request):
+        if self.autorefresh:
+            # Looks for the file on disk; DEBUG only
+            static_file = await sync_to_async(self.find_file)(request.path_info)
+        else:
+            static_file = self.files.get(request.path_info)
+        if static_file is not None:
+            return await sync_to_async(self.serve)(static_file, request)
+        return await self.get_response(request)
@@ -0,0 +1,399 @@
+"""
+Background tasks.
+
+Functions decorated with ``@task`` can be queued instead of called::
+
+    @task(max_attempts=5)
+    def send_welcome_email(user_id):
+        ...
+
+    send_welcome_email.enqueue(user.pk, idempotency_key=f'welcome-email:{user.pk}')
+
+The ``run_tasks`` worker command claims due tasks and runs them on a thread
+or process pool. A task that raises is retried with exponential backoff
+(``backoff ** attempt`` seconds, with jitter) until ``max_attempts``, then
+marked failed. If an idempotency key has been queued before, later enqueues
+with that key are ignored, so repeated signals or retried requests queue
+the work only once (keys are remembered until the finished task is pruned,
+after ``TASK_RETENTION_DAYS``). Every run records its duration, and ``stats()``
+summarises them per task.
+
+Two backends store the queue, chosen by ``TASK_BACKEND``:
+
+- ``DatabaseBackend`` (default): the ``core.Task`` table. A task enqueued
+  inside a transaction exists only if the transaction commits. Workers
+  claim tasks with ``SELECT ... FOR UPDATE SKIP LOCKED`` where the database
+  supports it, and with conditional UPDATEs elsewhere.
+- ``RedisBackend``: sorted sets in ``TASK_REDIS_URL``. It needs the
+  ``redis`` package, and enqueues on commit.
+
+Claims are leases. If a worker dies mid-task, the task becomes due again
+after ``TASK_LEASE_SECONDS``. With ``TASKS_EAGER`` set, tasks run in the
+enqueuing process once its transaction commits, with no worker; tests turn
+it on with ``override_settings`` where they need a task's effect.
+"""
+import json
+import logging
+import random
+import socket
+import os
+import time
+import traceback
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Avg, Count, Max, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from . import db_router
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+class Job:
+    """A claimed task as handed to a worker, whatever the backend"""
+
+    def __init__(self, id, name, args, kwargs, attempts, max_attempts, queue='default', payload=None):
+        self.id = id
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+        self.attempts = attempts
+        self.max_attempts = max_attempts
+        self.queue = queue
+        self.payload = payload
+
+
+class Task:
+    """A registered task function; call it directly or queue it with enqueue()"""
+
+    def __init__(self, func, name, queue, max_attempts, backoff):
+        self.func = func
+        self.name = name
+        self.queue = queue
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+
+    def __call__(self, *args, **kwargs):
+        return self.func(*args, **kwargs)
+
+    def enqueue(self, *args, idempotency_key=None, delay=0, **kwargs):
+        """Queue a run; returns the task id, or None if the idempotency key was already used"""
+        if _setting('TASKS_EAGER', False):
+            run_eagerly(self, args, kwargs)
+            return None
+        return get_backend().enqueue(
+            self.name, list(args), kwargs, queue=self.queue,
+            run_at=timezone.now() + timedelta(seconds=delay),
+            idempotency_key=idempotency_key, max_attempts=self.max_attempts,
+        )
+
+    def retry_delay(self, attempts):
+        return self.backoff ** attempts * random.uniform(0.8, 1.2)
+
+
+def task(func=None, *, name=None, queue='default', max_attempts=3, backoff=5.0):
+    """Register func as a background task"""
+    def decorator(func):
+        registered = Task(func, name or f'{func.__module__}.{func.__qualname__}', queue, max_attempts, backoff)
+        _registry[registered.name] = registered
+        return registered
+
+    return decorator(func) if func is not None else decorator
+
+
+def get_task(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise LookupError(f'No task registered as {name!r}; is its module imported by an app\'s tasks.py?')
+
+
+def run_eagerly(registered, args, kwargs):
+    # Tests and local development: run once the caller's transaction commits, like a worker would
+    transaction.on_commit(lambda: registered.func(*args, **kwargs))
+
+
+def execute(name, args, kwargs):
+    """Run one task and report (error or None, duration in ms); safe to call in a pool worker"""
+    close_old_connections()
+    started = time.perf_counter()
+    try:
+        # Like a request: reads may use a replica until the task writes
+        with db_router.unit_of_work():
+            get_task(name).func(*args, **kwargs)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    finally:
+        close_old_connections()
+    return error, (time.perf_counter() - started) * 1000
+
+
+def setup_process():
+    """Process pool initializer: a spawned process needs Django set up before running tasks"""
+    import django
+
+    django.setup()
+
+
+class DatabaseBackend:
+    """Queue in the core.Task table"""
+
+    def enqueue(self, name, args, kwargs, queue, run_at, idempotency_key, max_attempts):
+        from .models import Task as TaskRow
+
+        try:
+            with transaction.atomic():
+                row = TaskRow.objects.create(
+                    name=name, args=args, kwargs=kwargs, queue=queue, run_at=run_at,
+                    idempotency_key=idempotency_key, max_attempts=max_attempts,
+                )
+        except IntegrityError:
+            if idempotency_key is None:
+                raise
+            return None
+        return row.pk
+
+    def claim(self, queues, worker_id, limit, lease_seconds):
+        from .models import Task as TaskRow
+
+        now = timezone.now()
+        due = TaskRow.objects.filter(queue__in=queues).filter(
+            Q(status=TaskRow.QUEUED, run_at__lte=now) | Q(status=TaskRow.RUNNING, locked_until__lt=now)
+        ).order_by('run_at', 'id')
+        lease = {
+            'status': TaskRow.RUNNING,
+            'locked_by': worker_id,
+            'locked_until': now + timedelta(seconds=lease_seconds),
+            'started_at': now,
+        }
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                ids = list(due.select_for_update(skip_locked=True).values_list('id', flat=True)[:limit])
+                TaskRow.objects.filter(pk__in=ids).update(**lease)
+        else:
+            # No row locks to skip (SQLite); a conditional UPDATE lets exactly one worker win each task
+            ids = [
+                pk for pk, status, locked_until in due.values_list('id', 'status', 'locked_until')[:limit]
+                if TaskRow.objects.filter(pk=pk, status=status, locked_until=locked_until).update(**lease)
+            ]
+        return [
+            Job(row.pk, row.name, row.args, row.kwargs, row.attempts, row.max_attempts, row.queue)
+            for row in TaskRow.objects.filter(pk__in=ids).order_by('run_at', 'id')
+        ]
+
+    def complete(self, job, duration_ms):
+        from .models import Task as TaskRow
+
+        TaskRow.objects.filter(pk=job.id).update(
+            status=TaskRow.DONE, attempts=job.attempts + 1, finished_at=timezone.now(),
+            duration_ms=duration_ms, locked_by='', locked_until=None, last_error='',
+        )
+
+    def retry(self, job, error, duration_ms, run_at):
+        from .models import Task as TaskRow
+
+        TaskRow.objects.filter(pk=job.id).update(
+            status=TaskRow.QUEUED, attempts=job.attempts + 1, run_at=run_at, duration_ms=duration_ms,
+            locked_by='', locked_until=None, last_error=error,
+        )
+
+    def fail(self, job, error, duration_ms):
+        from .models import Task as TaskRow
+
+        TaskRow.objects.filter(pk=job.id).update(
+            status=TaskRow.FAILED, attempts=job.attempts + 1, finished_at=timezone.now(),
+            duration_ms=duration_ms, locked_by='', locked_until=None, last_error=error,
+        )
+
+    def prune(self, before):
+        """Delete tasks that finished before the given time; returns how many"""
+        from .models import Task as TaskRow
+
+        deleted, _ = TaskRow.objects.filter(
+            status__in=[TaskRow.DONE, TaskRow.FAILED], finished_at__lt=before,
+        ).delete()
+        return deleted
+
+    def stats(self):
+        from .models import Task as TaskRow
+
+        stats = {}
+        rows = TaskRow.objects.order_by().values('name', 'status').annotate(
+            count=Count('id'), mean_ms=Avg('duration_ms'), max_ms=Max('duration_ms'),
+        )
+        for row in rows:
+            entry = stats.setdefault(row['name'], {'statuses': {}, 'mean_ms': None, 'max_ms': None})
+            entry['statuses'][row['status']] = row['count']
+            if row['status'] == TaskRow.DONE:
+                entry['mean_ms'] = row['mean_ms']
+                entry['max_ms'] = row['max_ms']
+        return stats
+
+
+class RedisBackend:
+    """Queue in Redis: a due-time sorted set per queue, a lease sorted set and a job hash
+
+    Keys live under TASK_REDIS_PREFIX. Completed runs only update the per-task
+    counters in the stats hash; the jobs themselves are deleted.
+    """
+
+    def __init__(self):
+        try:
+            import redis
+        except ImportError:
+            raise ImproperlyConfigured('RedisBackend needs the redis package (pip install redis)')
+        self.redis = redis.Redis.from_url(_setting('TASK_REDIS_URL', 'redis://localhost:6379/0'))
+        self.prefix = _setting('TASK_REDIS_PREFIX', 'tasks')
+
+    def key(self, *parts):
+        return ':'.join((self.prefix,) + parts)
+
+    def enqueue(self, name, args, kwargs, queue, run_at, idempotency_key, max_attempts):
+        job_id = uuid.uuid4().hex
+        payload = json.dumps({
+            'id': job_id, 'name': name, 'args': args, 'kwargs': kwargs, 'queue': queue,
+            'attempts': 0, 'max_attempts': max_attempts,
+        })
+
+        def push():
+            if idempotency_key is not None and not self.redis.set(
+                self.key('idempotency', idempotency_key), job_id, nx=True,
+                ex=_setting('TASK_RETENTION_DAYS', 7) * 24 * 60 * 60,
+            ):
+                return
+            pipe = self.redis.pipeline()
+            pipe.hset(self.key('jobs'), job_id, payload)
+            pipe.zadd(self.key('queue', queue), {job_id: run_at.timestamp()})
+            pipe.execute()
+
+        # Redis is outside the database transaction; only queue work the caller committed
+        transaction.on_commit(push)
+        return job_id
+
+    def claim(self, queues, worker_id, limit, lease_seconds):
+        now = time.time()
+        jobs = []
+        for queue in queues:
+            expired = self.redis.zrangebyscore(self.key('leases'), 0, now)
+            for job_id in expired:
+                # Its worker died; make it due again
+                if self.redis.zrem(self.key('leases'), job_id):
+                    payload = self.redis.hget(self.key('jobs'), job_id)
+                    if payload:
+                        self.redis.zadd(self.key('queue', json.loads(payload)['queue']), {job_id: now})
+            for job_id in self.redis.zrangebyscore(self.key('queue', queue), 0, now, start=0, num=limit - len(jobs)):
+                # ZREM succeeds for exactly one of the workers racing for this job
+                if not self.redis.zrem(self.key('queue', queue), job_id):
+                    continue
+                self.redis.zadd(self.key('leases'), {job_id: now + lease_seconds})
+                payload = json.loads(self.redis.hget(self.key('jobs'), job_id))
+                jobs.append(Job(
+                    payload['id'], payload['name'], payload['args'], payload['kwargs'],
+                    payload['attempts'], payload['max_attempts'], payload['queue'], payload=payload,
+                ))
+            if len(jobs) >= limit:
+                break
+        return jobs
+
+    def _record(self, job, status, duration_ms):
+        pipe = self.redis.pipeline()
+        pipe.hincrby(self.key('stats'), f'{job.name}:{status}', 1)
+        if status == 'done':
+            pipe.hincrbyfloat(self.key('stats'), f'{job.name}:total_ms', duration_ms)
+        pipe.execute()
+
+    def complete(self, job, duration_ms):
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key('leases'), job.id)
+        pipe.hdel(self.key('jobs'), job.id)
+        pipe.execute()
+        self._record(job, 'done', duration_ms)
+
+    def retry(self, job, error, duration_ms, run_at):
+        payload = dict(job.payload, attempts=job.attempts + 1, last_error=error)
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key('leases'), job.id)
+        pipe.hset(self.key('jobs'), job.id, json.dumps(payload))
+        pipe.zadd(self.key('queue', job.queue), {job.id: run_at.timestamp()})
+        pipe.execute()
+        self._record(job, 'retried', duration_ms)
+
+    def fail(self, job, error, duration_ms):
+        payload = dict(job.payload, attempts=job.attempts + 1, last_error=error)
+        pipe = self.redis.pipeline()
+        pipe.zrem(self.key('leases'), job.id)
+        pipe.hdel(self.key('jobs'), job.id)
+        pipe.hset(self.key('failed'), job.id, json.dumps(payload))
+        pipe.execute()
+        self._record(job, 'failed', duration_ms)
+
+    def prune(self, before):
+        # Finished jobs are deleted straight away and idempotency keys expire on their own
+        return 0
+
+    def stats(self):
+        stats = {}
+        for field, value in self.redis.hgetall(self.key('stats')).items():
+            name, metric = field.decode().rsplit(':', 1)
+            entry = stats.setdefault(name, {'statuses': {}, 'mean_ms': None, 'max_ms': None})
+            if metric == 'total_ms':
+                entry['total_ms'] = float(value)
+            else:
+                entry['statuses'][metric] = int(value)
+        for entry in stats.values():
+            done = entry['statuses'].get('done')
+            if done:
+                entry['mean_ms'] = entry.pop('total_ms', 0.0) / done
+        return stats
+
+
+_backend = None
+
+
+def get_backend():
+    global _backend
+    path = _setting('TASK_BACKEND', 'core.tasks.DatabaseBackend')
+    if _backend is None or f'{type(_backend).__module__}.{type(_backend).__qualname__}' != path:
+        _backend = import_string(path)()
+    return _backend
+
+
+def stats():
+    """Per task name: run counts by status and mean/max duration of successful runs"""
+    return get_backend().stats()
+
+
+def worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def finish(backend, job, error, duration_ms):
+    """Record a run's outcome: done, queued again with backoff, or failed for good"""
+    record = {'task': job.name, 'id': str(job.id), 'attempt': job.attempts + 1, 'duration_ms': round(duration_ms, 3)}
+    if error is None:
+        backend.complete(job, duration_ms)
+        logger.info(json.dumps({**record, 'status': 'done'}))
+        return
+    try:
+        registered = get_task(job.name)
+    except LookupError:
+        registered = None
+    if registered is not None and job.attempts + 1 < job.max_attempts:
+        delay = registered.retry_delay(job.attempts + 1)
+        backend.retry(job, error, duration_ms, timezone.now() + timedelta(seconds=delay))
+        logger.warning('Task %s %s failed (attempt %s), retrying in %.0fs\n%s', job.name, job.id, job.attempts + 1, delay, error)
+    else:
+        backend.fail(job, error, duration_ms)
+        logger.error('Task %s %s failed for good after %s attempt(s)\n%s', job.name, job.id, job.attempts + 1, error)
@@ -0,0 +1,40 @@
+from django import template
+from django.forms.utils import flatatt
+from django.utils.html import format_html
+
+from core import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(derivatives, size, fallback='', alt='', sizes=None, **attrs):
+    """<picture> with WebP and JPEG srcsets of the built derivatives, else a plain <img> of fallback
+
+    {% responsive_image image.derivatives 'card' fallback=image.image_url alt=product.name class='product-image' %}
+    """
+    attrs = {'loading': 'lazy', 'decoding': 'async', **attrs}
+    bucket = images.bucket(derivatives, size)
+    if bucket is None:
+        return format_html('<img src="{}" alt="{}"{}>', fallback, alt, flatatt(attrs))
+
+    sizes = sizes or f'{bucket["width"]}px'
+    return format_html(
+        '<picture style="display: contents">'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}"{}>'
+        '</picture>',
+        images.srcset(derivatives, 'webp'), sizes,
+        images.image_url(derivatives, size), images.srcset(derivatives, 'jpeg'), sizes, bucket['width'], bucket['height'], alt, flatatt(attrs),
+    )
+
+
+@register.simple_tag
+def image_srcset(derivatives, fmt='jpeg'):
+    """Just the srcset list, e.g. for data attributes read by scripts"""
+    return images.srcset(derivatives, fmt)
+
+
+@register.simple_tag
+def image_url(derivatives, size, fallback='', fmt='jpeg'):
+    return images.image_url(derivatives, size, fmt) or fallback
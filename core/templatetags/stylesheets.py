@@ -0,0 +1,35 @@
+from django import template
+from django.conf import settings
+from django.templatetags.static import static
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
+
+from core import css
+
+register = template.Library()
+
+
+class StylesheetNode(template.Node):
+
+    def __init__(self, name, nodelist):
+        self.name = name
+        self.nodelist = nodelist
+
+    def render(self, context):
+        if settings.CSS_BUNDLES:
+            return format_html('<link rel="stylesheet" href="{}">', static(css.bundle_path(self.name)))
+        return mark_safe(f'<style>{self.nodelist.render(context)}</style>')
+
+
+@register.tag
+def stylesheet(parser, token):
+    """Page CSS, inline or as a link to its build_css bundle (see core.css)
+
+    {% stylesheet 'products/product_list' %} .product-card { ... } {% endstylesheet %}
+    """
+    bits = token.split_contents()
+    if len(bits) != 2 or bits[1][0] not in '"\'' or bits[1][0] != bits[1][-1]:
+        raise template.TemplateSyntaxError(f'{bits[0]} takes one quoted bundle name')
+    nodelist = parser.parse(('endstylesheet',))
+    parser.delete_first_token()
+    return StylesheetNode(bits[1][1:-1], nodelist)
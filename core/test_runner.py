@@ -0,0 +1,21 @@
+"""
+Test runner for the project.
+
+Runs the suite with ``QUERY_BUDGET_RAISE`` on, so a view going over its
+``query_budget`` fails the test that requested it instead of logging.
+"""
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner that turns query budget overruns into failures"""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._query_budget_raise = getattr(settings, 'QUERY_BUDGET_RAISE', False)
+        settings.QUERY_BUDGET_RAISE = True
+
+    def teardown_test_environment(self, **kwargs):
+        settings.QUERY_BUDGET_RAISE = self._query_budget_raise
+        super().teardown_test_environment(**kwargs)
@@ -1,3 +1,393 @@
-from django.test import TestCase
+import json
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.models import Session
+from django.core.files.base import ContentFile
+from django.core import mail
+from django.db import connection
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.template import Context, Template
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import resolve, reverse
+from django.utils import timezone
+from PIL import Image
+
+from cart.models import Cart
+from products.cache import catalog_cache
+from products.models import Category, Product
+from . import benchmark, concurrency, css, db_router, images, performance, sessions, startup, tasks
+from .models import Task
+from .paginator import EstimatedCountPaginator
+
+
+class BenchmarkTests(TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual((benchmark.percentile(values, 50), benchmark.percentile(values, 99)), (50, 99))
+
+    def test_compare_flags_extra_queries_and_slowdowns(self):
+        baseline = {'list': {'queries': 3, 'p90_ms': 10.0}, 'detail': {'queries': 1, 'p90_ms': 2.0}}
+        current = {'list': {'queries': 4, 'p90_ms': 15.0}, 'detail': {'queries': 1, 'p90_ms': 2.6}}
+
+        regressions = benchmark.compare(current, baseline, threshold=0.2)
+
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(all(regression.startswith('list') for regression in regressions))
+
+    def test_runs_are_saved_and_compared(self):
+        call_command('generate_catalog', products=20, categories=2, users=2, skip_index=True, stdout=StringIO())
+        with tempfile.TemporaryDirectory() as output_dir:
+            for _ in range(2):
+                out = StringIO()
+                call_command(
+                    'benchmark', iterations=2, warmup=0, only=['product_list', 'cart_api_batch'],
+                    output_dir=output_dir, stdout=out,
+                )
+
+            latest = json.loads((Path(output_dir) / 'latest.json').read_text())
+            self.assertIn('Compared with the run of', out.getvalue())
+            self.assertTrue(list(Path(output_dir).glob('run-*.json')))
+
+        self.assertEqual(sorted(latest['endpoints']), ['cart_api_batch', 'product_list'])
+        for result in latest['endpoints'].values():
+            self.assertEqual(result['status'], [200])
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+
+@override_settings(PERFORMANCE_SAMPLE_RATE=1.0, PERFORMANCE_SLOW_REQUEST_MS=0)
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        # Every request counts as slow here; keep the warnings out of the test output
+        self.enterContext(self.assertLogs('core.performance', 'INFO'))
+        performance.registry.reset()
+        catalog_cache.cache.clear()
+        call_command('generate_catalog', products=5, categories=1, users=0, skip_index=True, stdout=StringIO())
+
+    def test_server_timing_and_histograms(self):
+        self.client.get(reverse('products:product_list'))
+        response = self.client.get(reverse('products:product_list'))
+
+        timing = dict(part.split(';', 1) for part in response['Server-Timing'].split(', '))
+        self.assertEqual(set(timing), {'db', 'tpl', 'cache', 'app', 'total'})
+        # The sidebar categories, the facet counts and the five product cards
+        self.assertIn('7 hits 0 misses', timing['cache'])
+        histogram = performance.registry.snapshot()['histograms']['products:product_list']
+        self.assertEqual(histogram['count'], 2)
+        self.assertEqual(sum(histogram['buckets']), 2)
+
+    def test_slow_requests_are_captured_with_sql_and_stack(self):
+        self.client.get(reverse('products:category_list'))
+
+        record = performance.registry.snapshot()['slow_requests'][-1]
+        self.assertEqual(record['url_name'], 'products:category_list')
+        self.assertEqual(len(record['queries']), record['db_queries'])
+        self.assertTrue(any('products/views.py' in frame for query in record['queries'] for frame in query['stack']))
+        self.assertGreater(record['template_ms'], 0)
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.get(reverse('products:product_list'))
+        self.assertEqual(self.client.get(reverse('core:performance_stats')).status_code, 302)
+
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        stats = self.client.get(reverse('core:performance_stats')).json()
+        self.assertEqual(stats['histograms']['products:product_list']['count'], 1)
+        self.assertIsNotNone(stats['histograms']['products:product_list']['p50_ms'])
+
+
+class ConcurrencyTests(TestCase):
+
+    @override_settings(ASYNC_CONCURRENT_QUERIES=True)
+    async def test_gather_overlaps_calls_and_keeps_their_order(self):
+        def slow(value):
+            time.sleep(0.2)
+            return value
+
+        started = time.perf_counter()
+        self.assertEqual(await concurrency.gather(lambda: slow(1), lambda: slow(2), lambda: slow(3)), [1, 2, 3])
+        self.assertLess(time.perf_counter() - started, 0.4)
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    def setUp(self):
+        for n in range(3):
+            User.objects.create_user(f'user-{n}')
+
+    def test_small_or_unsupported_counts_are_exact(self):
+        self.assertEqual(EstimatedCountPaginator(User.objects.order_by('pk'), 10).count, 3)
+
+    def test_large_tables_use_the_planner_estimate(self):
+        if connection.vendor != 'postgresql':
+            self.skipTest('Estimates come from the PostgreSQL planner')
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE auth_user')
+        with patch.object(EstimatedCountPaginator, 'exact_threshold', 0), self.assertNumQueries(1):
+            self.assertEqual(EstimatedCountPaginator(User.objects.order_by('pk'), 10).count, 3)
+        with patch.object(EstimatedCountPaginator, 'exact_threshold', 0):
+            self.assertGreaterEqual(EstimatedCountPaginator(User.objects.filter(username='user-1').order_by('pk'), 10).count, 1)
+
+
+class StartupTests(SimpleTestCase):
+
+    def test_setup_never_touches_the_database(self):
+        self.assertEqual(startup._script(startup.SETUP_SCRIPT)['connected'], [])
+
+    def test_importtime_is_parsed_and_compared(self):
+        stderr = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:       900 |       1200 |   django.utils\n'
+            'import time:      5000 |      42000 | django.urls\n'
+            'import time:      3000 |       3000 | products.models\n'
+        )
+        imports = startup.parse_importtime(stderr)
+        self.assertEqual(imports[0], ('django.utils', 900, 1200, 1))
+        self.assertEqual(
+            [entry['module'] for entry in startup.slowest_imports(imports)], ['django.urls', 'products.models'],
+        )
+
+        baseline = {'setup_ms': 200.0, 'check_ms': 500.0, 'import_ms': 250.0, 'first_request_ms': 100.0}
+        current = {**baseline, 'setup_ms': 300.0, 'first_request_ms': 110.0, 'setup_connections': ['default']}
+        self.assertEqual(startup.compare(current, baseline), [
+            'django.setup() opened database connections: default',
+            'setup_ms: 200.0ms -> 300.0ms',
+        ])
+
+
+class CssBundleTests(TestCase):
+
+    def test_minify_keeps_strings_and_significant_spaces(self):
+        source = '''
+            /* cards */
+            .card > a :hover , .card {
+                font-family: 'Segoe UI' , sans-serif;
+                content: "a  /* b */ ;";
+                width: calc(100% - 2px);
+            }
+            @media (max-width: 768px) { .card { display: none; } }
+        '''
+        self.assertEqual(
+            css.minify(source),
+            '.card>a :hover,.card{font-family:\'Segoe UI\',sans-serif;content:"a  /* b */ ;";width:calc(100% - 2px)}'
+            '@media (max-width:768px){.card{display:none}}',
+        )
+
+    def test_tag_inlines_or_links_the_bundle(self):
+        page = Template("{% load stylesheets %}{% stylesheet 'core/test' %} a { color: red; } {% endstylesheet %}")
+        with override_settings(CSS_BUNDLES=False):
+            self.assertEqual(page.render(Context()), '<style> a { color: red; } </style>')
+        with override_settings(CSS_BUNDLES=True):
+            self.assertEqual(page.render(Context()), '<link rel="stylesheet" href="/static/bundles/core/test.css">')
+
+    def test_build_writes_every_page_bundle(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(CSS_BUNDLE_ROOT=root):
+            (Path(root) / 'stale.css').write_text('')
+            call_command('build_css', stdout=StringIO())
+            self.assertFalse((Path(root) / 'stale.css').exists())
+            bundle = (Path(root) / 'core' / 'base.css').read_text()
+        self.assertIn('.navbar{', bundle)
+        self.assertNotIn('\n    ', bundle)
+
+    def test_pages_link_the_bundles(self):
+        with override_settings(CSS_BUNDLES=True):
+            response = self.client.get(reverse('products:category_list'))
+        self.assertNotContains(response, '<style>')
+        self.assertContains(response, 'href="/static/bundles/core/base.css"')
+        self.assertContains(response, 'href="/static/bundles/products/category_list.css"')
+
+
+# Outside a test transaction, which would keep every read on the primary
+@override_settings(DATABASE_REPLICAS=['replica1'], REPLICA_APPS=['products'], DB_REPLICA_PIN_SECONDS=5)
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = db_router.PrimaryReplicaRouter()
+
+    def test_catalog_reads_use_the_replica_until_the_request_writes(self):
+        with db_router.unit_of_work():
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+            self.assertEqual(self.router.db_for_read(Cart), 'default')
+            self.assertEqual(self.router.db_for_write(Cart), 'default')
+            self.assertEqual(self.router.db_for_read(Product), 'default')
+        with db_router.unit_of_work():
+            self.assertEqual(self.router.db_for_read(Product), 'replica1')
+
+    def test_client_that_wrote_stays_on_the_primary(self):
+        def view(request):
+            self.router.db_for_write(Cart)
+            return HttpResponse()
+
+        factory = RequestFactory()
+        response = db_router.ReadYourWritesMiddleware(view)(factory.post('/cart/add/'))
+        cookie = response.cookies[db_router.PIN_COOKIE]
+        self.assertEqual(cookie['max-age'], 5)
+
+        reads = []
+        def read(request):
+            reads.append(self.router.db_for_read(Product))
+            return HttpResponse()
+
+        middleware = db_router.ReadYourWritesMiddleware(read)
+        request = factory.get('/products/')
+        request.COOKIES[db_router.PIN_COOKIE] = cookie.value
+        self.assertNotIn(db_router.PIN_COOKIE, middleware(request).cookies)
+        middleware(factory.get('/products/'))
+        self.assertEqual(reads, ['default', 'replica1'])
+
+
+@override_settings(SESSION_READ_ONLY_NAMESPACES=['products'])
+class SessionTests(TestCase):
+
+    def test_anonymous_catalog_reads_never_create_a_session(self):
+        def view(request):
+            request.session['seen'] = True
+            return HttpResponse()
+
+        factory = RequestFactory()
+        middleware = sessions.SessionMiddleware(view)
+        request = factory.get('/products/')
+        request.resolver_match = resolve(reverse('products:product_list'))
+        with self.assertLogs('core.sessions', 'WARNING'):
+            response = middleware(request)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        request = factory.post('/products/')
+        request.resolver_match = resolve(reverse('products:product_list'))
+        self.assertIn(settings.SESSION_COOKIE_NAME, middleware(request).cookies)
+
+    def test_messages_use_a_cookie(self):
+        category = Category.objects.create(name='Tees')
+        product = Product.objects.create(category=category, name='Tee', description='Tee', price=Decimal('500'), stock=5)
+        response = self.client.post(reverse('cart:add_to_cart'), {'product_id': product.pk})
+        self.assertIn('messages', response.cookies)
+        self.assertNotIn('_messages', self.client.session.keys())
+
+    def test_purge_deletes_expired_sessions_in_chunks(self):
+        now = timezone.now()
+        for n in range(5):
+            Session.objects.create(session_key=f'expired-{n}', session_data='', expire_date=now - timedelta(days=1))
+        Session.objects.create(session_key='live', session_data='', expire_date=now + timedelta(days=1))
+
+        with self.assertNumQueries(6):
+            self.assertEqual(sessions.purge_expired(chunk_size=2), 5)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['live'])
+
+
+@override_settings(TASKS_EAGER=True)
+class ImageDerivativeTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def png(self, width, height):
+        buffer = BytesIO()
+        Image.new('RGBA', (width, height), (200, 40, 90, 128)).save(buffer, 'PNG')
+        return ContentFile(buffer.getvalue(), name='tee.png')
+
+    def test_buckets_are_built_up_to_the_source_width_with_hashed_names(self):
+        rendered = images.render(self.png(1000, 1250).read())
+        derivatives = images.store('products/tee.png', rendered)
+
+        self.assertEqual(list(derivatives['sizes']), ['thumb', 'card', 'detail', 'zoom'])
+        self.assertEqual(derivatives['sizes']['card']['height'], 600)
+        # Never upscaled past the source
+        self.assertEqual(derivatives['sizes']['zoom']['width'], 1000)
+        card = derivatives['sizes']['card']
+        self.assertRegex(card['webp'], r'^derivatives/\w\w/tee-card\.[0-9a-f]{16}\.webp$')
+        self.assertTrue(default_storage.exists(card['jpeg']))
+        # Same content, same names
+        self.assertEqual(images.store('products/tee.png', rendered), derivatives)
+
+    def test_uploads_get_derivatives_and_render_as_srcset(self):
+        user = User.objects.create_user('shopper')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.profile.profile_picture = self.png(400, 400)
+            user.profile.save()
+        user.profile.refresh_from_db()
+        derivatives = user.profile.profile_picture_derivatives
+
+        self.assertEqual(derivatives['source'], user.profile.profile_picture.name)
+        html = Template(
+            "{% load responsive_images %}{% responsive_image derivatives 'card' alt='me' class='avatar' %}"
+        ).render(Context({'derivatives': derivatives}))
+        self.assertIn('<source type="image/webp" srcset="/media/derivatives/', html)
+        self.assertIn(' 160w, /media/derivatives/', html)
+        self.assertIn('width="400" height="400"', html)
+        self.assertIn('class="avatar"', html)
+
+    def test_images_without_derivatives_fall_back_to_their_url(self):
+        html = Template(
+            "{% load responsive_images %}{% responsive_image derivatives 'card' fallback='https://img.test/a.jpg' %}"
+        ).render(Context({'derivatives': {}}))
+        self.assertTrue(html.startswith('<img src="https://img.test/a.jpg"'))
+
+
+@tasks.task(max_attempts=3, backoff=60)
+def always_fails():
+    raise RuntimeError('out of ink')
+
+
+class TaskQueueTests(TransactionTestCase):
+    """Runs the worker's thread pool, whose threads only see committed rows"""
+
+    def run_worker(self):
+        call_command('run_tasks', once=True, concurrency=2, poll_interval=0.01, stdout=StringIO())
+
+    def test_signup_queues_one_welcome_email_for_the_worker(self):
+        user = User.objects.create_user('shopper', email='shopper@example.com')
+        self.assertEqual(mail.outbox, [])
+        # Same idempotency key: ignored
+        self.assertIsNone(tasks.get_task('accounts.tasks.send_welcome_email').enqueue(
+            user.pk, idempotency_key=f'welcome-email:{user.pk}',
+        ))
+
+        self.run_worker()
+
+        self.assertEqual([message.to for message in mail.outbox], [['shopper@example.com']])
+        task = Task.objects.get(idempotency_key=f'welcome-email:{user.pk}')
+        self.assertEqual((task.status, task.attempts), (Task.DONE, 1))
+        self.assertIsNotNone(task.duration_ms)
+        stats = tasks.stats()['accounts.tasks.send_welcome_email']
+        self.assertEqual(stats['statuses'], {Task.DONE: 1})
+
+    def test_failures_back_off_then_fail_for_good(self):
+        pk = always_fails.enqueue()
+        with self.assertLogs('core.tasks', 'WARNING'):
+            self.run_worker()
+
+        task = Task.objects.get(pk=pk)
+        self.assertEqual((task.status, task.attempts), (Task.QUEUED, 1))
+        self.assertIn('out of ink', task.last_error)
+        # Retried after about backoff ** attempts seconds
+        self.assertGreater(task.run_at, timezone.now() + timedelta(seconds=40))
+        self.run_worker()
+        self.assertEqual(Task.objects.get(pk=pk).attempts, 1)
+
+        for _ in range(2):
+            Task.objects.filter(pk=pk).update(run_at=timezone.now())
+            with self.assertLogs('core.tasks', 'WARNING'):
+                self.run_worker()
+        task = Task.objects.get(pk=pk)
+        self.assertEqual((task.status, task.attempts), (Task.FAILED, 3))
+
+    def test_expired_leases_are_claimed_again(self):
+        pk = always_fails.enqueue()
+        backend = tasks.get_backend()
+        self.assertEqual([job.id for job in backend.claim(['default'], 'a', 10, 300)], [pk])
+        self.assertEqual(backend.claim(['default'], 'b', 10, 300), [])
+
+        Task.objects.filter(pk=pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+        self.assertEqual([job.id for job in backend.claim(['default'], 'b', 10, 300)], [pk])
@@ -5,5 +5,6 @@ app_name = 'core'
 
 urlpatterns = [
     path('', views.home, name='home'),
+    path('performance/', views.performance_stats, name='performance_stats'),
 
 ]
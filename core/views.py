@@ -1,11 +1,26 @@
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import JsonResponse
 from django.shortcuts import render
 
+from products import homepage
+from .performance import merged_stats
+
 
 def home(request):
     """
-    Home page view displaying hero section, deals, featured products, and brands
+    Home page view displaying hero section, collections, featured products,
+    deals and new arrivals, all from the precomputed homepage payload
     """
     context = {
         'page_title': 'Home',
+        'homepage': homepage.payload(),
     }
     return render(request, 'core/index.html', context)
+
+
+@staff_member_required
+def performance_stats(request):
+    """
+    Per-URL-name latency histograms and recent slow requests, for staff
+    """
+    return JsonResponse(merged_stats())
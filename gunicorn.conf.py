@@ -0,0 +1,41 @@
+"""
+Gunicorn settings for production.
+
+Serves mystore.asgi with Uvicorn workers by default:
+
+    gunicorn -c gunicorn.conf.py mystore.asgi:application
+
+Set GUNICORN_WORKER_CLASS=sync (or gthread) and serve mystore.wsgi:application
+instead to run the sync views under WSGI.
+
+Worker counts follow the CPU count:
+
+- Uvicorn workers run one event loop each, which keeps a core busy while its
+  requests wait on the database, so one worker per CPU is enough.
+- Sync workers block for the whole request, so they use the usual
+  2 x CPUs + 1.
+
+WEB_CONCURRENCY overrides either count.
+"""
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'uvicorn_worker.UvicornWorker')
+is_async = 'uvicorn' in worker_class.lower()
+workers = int(os.environ.get('WEB_CONCURRENCY', max(cpus, 2) if is_async else cpus * 2 + 1))
+# gthread only: threads per worker
+threads = int(os.environ.get('GUNICORN_THREADS', 1 if is_async else 4))
+
+# Recycle workers now and then to bound slow leaks; jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Empty disables the access log
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
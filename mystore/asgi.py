@@ -12,5 +12,7 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mystore.settings')
+# Serve the async catalog views (products.async_views)
+os.environ.setdefault('CATALOG_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
@@ -38,16 +38,21 @@ INSTALLED_APPS = [
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
+    # Before staticfiles, so its collectstatic (which builds the CSS bundles first) wins
+    'core',
     'django.contrib.staticfiles',
     'accounts',
-    'core',
     'products',
     'cart',
 ]
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    # Serves static files before anything else runs for them
+    'core.staticfiles.StaticFilesMiddleware',
+    'core.performance.PerformanceMiddleware',
+    'core.db_router.ReadYourWritesMiddleware',
+    'core.sessions.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -67,6 +72,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cart.context_processors.cart',
             ],
         },
     },
@@ -82,6 +88,18 @@ WSGI_APPLICATION = 'mystore.wsgi.application'
 DB_ENGINE = config('DB_ENGINE', default='django.db.backends.sqlite3')
 
 if DB_ENGINE == 'django.db.backends.postgresql':
+    # Connection reuse. DB_POOL keeps a psycopg pool per process (needs psycopg[pool]),
+    # which also suits ASGI; without it each thread keeps its connection for
+    # DB_CONN_MAX_AGE seconds (0 reconnects on every request)
+    DB_POOL = config('DB_POOL', default=True, cast=bool)
+    DB_OPTIONS = {}
+    if DB_POOL:
+        DB_OPTIONS['pool'] = {
+            'min_size': config('DB_POOL_MIN_SIZE', default=2, cast=int),
+            'max_size': config('DB_POOL_MAX_SIZE', default=10, cast=int),
+            # Seconds to wait for a free connection before giving up
+            'timeout': config('DB_POOL_TIMEOUT', default=10, cast=float),
+        }
     DATABASES = {
         'default': {
             'ENGINE': DB_ENGINE,
@@ -90,16 +108,137 @@ if DB_ENGINE == 'django.db.backends.postgresql':
             'PASSWORD': config('DB_PASSWORD', default='postgres'),
             'HOST': config('DB_HOST', default='localhost'),
             'PORT': config('DB_PORT', default='5432'),
+            # The pool manages connection lifetimes itself
+            'CONN_MAX_AGE': 0 if DB_POOL else config('DB_CONN_MAX_AGE', default=60, cast=int),
+            'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
+            'OPTIONS': DB_OPTIONS,
         }
     }
+    # Read replicas for catalog reads (core.db_router), as comma-separated host or host:port
+    for number, replica in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), start=1):
+        host, _, port = replica.partition(':')
+        DATABASES[f'replica{number}'] = {
+            **DATABASES['default'],
+            'HOST': host,
+            'PORT': port or DATABASES['default']['PORT'],
+            'OPTIONS': dict(DB_OPTIONS),
+            'TEST': {'MIRROR': 'default'},
+        }
 else:
     DATABASES = {
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Writers queue on the busy timeout instead of failing to upgrade a read lock
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # A file, not memory, so the concurrency tests' threads share one database
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
+# Replica routing (core.db_router): reads of these apps go to a replica unless the
+# request or client wrote recently; everything else stays on the primary
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['core.db_router.PrimaryReplicaRouter'] if DATABASE_REPLICAS else []
+REPLICA_APPS = ['products']
+# How long a client's reads stay on the primary after it wrote (cover the replica lag)
+DB_REPLICA_PIN_SECONDS = config('DB_REPLICA_PIN_SECONDS', default=5, cast=int)
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Local memory by default; point CACHE_BACKEND/CACHE_LOCATION at Redis
+# (django.core.cache.backends.redis.RedisCache, redis://host:6379/1) or
+# Memcached (django.core.cache.backends.memcached.PyMemcacheCache, host:11211)
+# to share the cache between processes
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='abhirang'),
+    }
+}
+
+# Sessions (core.sessions). cached_db reads them from the cache and writes through to the
+# database; it needs a cache shared by every process, so locmem keeps the database backend
+SESSION_ENGINE = config('SESSION_ENGINE', default=(
+    'django.contrib.sessions.backends.db' if 'locmem' in CACHES['default']['BACKEND']
+    else 'django.contrib.sessions.backends.cached_db'
+))
+# Anonymous GETs of these URL namespaces never create a session
+SESSION_READ_ONLY_NAMESPACES = ['core', 'products']
+# Flash messages travel in a signed cookie rather than the session
+MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
+
+# Seconds a cached catalog read (categories, product pages, related products) lives
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60 * 60, cast=int)
+
+# Seconds a cached catalog read lives at most in a local memory cache, which other processes can't invalidate
+CATALOG_LOCAL_CACHE_SECONDS = config('CATALOG_LOCAL_CACHE_SECONDS', default=30, cast=int)
+
+# Seconds a search's facet counts live; there is one entry per distinct query
+SEARCH_FACET_CACHE_SECONDS = config('SEARCH_FACET_CACHE_SECONDS', default=5 * 60, cast=int)
+
+# Seconds a reverse proxy may serve anonymous catalog pages (s-maxage) before revalidating
+CATALOG_PAGE_CACHE_SECONDS = config('CATALOG_PAGE_CACHE_SECONDS', default=60, cast=int)
+
+# Seconds the precomputed homepage payload lives; refresh tasks and build_homepage replace it well before
+HOMEPAGE_CACHE_TIMEOUT = config('HOMEPAGE_CACHE_TIMEOUT', default=24 * 60 * 60, cast=int)
+
+# Catalog changes within this many seconds share one homepage rebuild, run when the window ends
+HOMEPAGE_REFRESH_SECONDS = config('HOMEPAGE_REFRESH_SECONDS', default=5, cast=int)
+
+
+# Product search
+# Dotted path to a products.search backend; empty picks PostgreSQL full-text
+# search on PostgreSQL and the in-memory inverted index elsewhere
+PRODUCT_SEARCH_BACKEND = config('PRODUCT_SEARCH_BACKEND', default='')
+PRODUCT_SEARCH_CONFIG = 'english'
+# Best matches the in-memory backend passes to the database; lower-ranked ones are dropped
+PRODUCT_SEARCH_MAX_RESULTS = config('PRODUCT_SEARCH_MAX_RESULTS', default=500, cast=int)
+
+
+# Async catalog views (products.async_views); mystore.asgi turns them on
+CATALOG_ASYNC_VIEWS = config('CATALOG_ASYNC_VIEWS', default=False, cast=bool)
+# Let async views run independent queries on separate connections at once (core.concurrency)
+ASYNC_CONCURRENT_QUERIES = config('ASYNC_CONCURRENT_QUERIES', default=True, cast=bool)
+
+# Performance instrumentation (core.performance.PerformanceMiddleware)
+PERFORMANCE_SERVER_TIMING = config('PERFORMANCE_SERVER_TIMING', default=True, cast=bool)
+# Requests slower than this are captured with their SQL, if sampled
+PERFORMANCE_SLOW_REQUEST_MS = config('PERFORMANCE_SLOW_REQUEST_MS', default=500, cast=int)
+# Fraction of requests that record SQL and stacks for slow request captures
+PERFORMANCE_SAMPLE_RATE = config('PERFORMANCE_SAMPLE_RATE', default=0.1, cast=float)
+# How often each process publishes its histograms to the cache
+PERFORMANCE_PUBLISH_SECONDS = config('PERFORMANCE_PUBLISH_SECONDS', default=10, cast=int)
+
+# Raise QueryBudgetExceeded when a view goes over its query_budget instead of logging a warning;
+# the test runner turns it on for the whole suite
+QUERY_BUDGET_RAISE = config('QUERY_BUDGET_RAISE', default=False, cast=bool)
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        # INFO logs one JSON line per request; WARNING only reports slow requests
+        'core.performance': {
+            'handlers': ['console'],
+            'level': config('PERFORMANCE_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+        # INFO logs one JSON line per finished task; WARNING only reports failures
+        'core.tasks': {
+            'handlers': ['console'],
+            'level': config('TASK_LOG_LEVEL', default='WARNING'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -142,6 +281,26 @@ STATICFILES_DIRS = [
     BASE_DIR / 'accounts' / 'static',
 ]
 
+# Hashed file names plus gzip and brotli copies, served by WhiteNoise with far-future
+# cache headers (core.staticfiles); needs collectstatic before the server starts
+STATIC_MANIFEST = config('STATIC_MANIFEST', default=not DEBUG, cast=bool)
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'whitenoise.storage.CompressedManifestStaticFilesStorage' if STATIC_MANIFEST
+            else 'django.contrib.staticfiles.storage.StaticFilesStorage'
+        ),
+    },
+}
+
+# Link the build_css bundles (core.css) instead of inlining each page's CSS
+CSS_BUNDLES = config('CSS_BUNDLES', default=STATIC_MANIFEST, cast=bool)
+# Where build_css writes them: bundles/ in a STATICFILES_DIRS directory, so collectstatic picks them up
+CSS_BUNDLE_ROOT = BASE_DIR / 'static' / 'bundles'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -155,3 +314,21 @@ LOGOUT_REDIRECT_URL = 'accounts:login'
 # Media Files (for profile pictures)
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+
+# Image derivatives (core.images): processes build_image_derivatives resizes with; 0 means one per CPU
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+
+# Background tasks (core.tasks), run by the run_tasks worker
+# core.tasks.DatabaseBackend, or core.tasks.RedisBackend with TASK_REDIS_URL (needs the redis package)
+TASK_BACKEND = config('TASK_BACKEND', default='core.tasks.DatabaseBackend')
+TASK_REDIS_URL = config('TASK_REDIS_URL', default='redis://localhost:6379/0')
+# A claimed task not finished within this is assumed lost with its worker and runs again
+TASK_LEASE_SECONDS = config('TASK_LEASE_SECONDS', default=300, cast=int)
+# Finished tasks (and so their idempotency keys) are deleted after this
+TASK_RETENTION_DAYS = config('TASK_RETENTION_DAYS', default=7, cast=int)
+# Run tasks inline when their transaction commits instead of queueing them
+TASKS_EAGER = config('TASKS_EAGER', default=False, cast=bool)
+
+# Email
+EMAIL_BACKEND = config('EMAIL_BACKEND', default='django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL', default='Abhirang <hello@abhirang.local>')
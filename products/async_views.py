@@ -0,0 +1,171 @@
+"""
+Async variants of the catalog views.
+
+mystore.asgi turns on ``CATALOG_ASYNC_VIEWS``, and ``products.urls`` then
+routes the catalog pages here. Each page starts its independent reads
+together through ``core.concurrency.gather``:
+
+- the page of products or search results
+- the product with its related products, on the detail page
+- the sidebar categories
+
+Under WSGI the sync views in ``products.views`` stay in place; an async view
+there would only add a thread hop per request. Templates still render in a
+thread, since context processors and template tags use the sync ORM.
+Query budgets match the sync views.
+"""
+from asgiref.sync import sync_to_async
+from django.db.models import Count
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.decorators import method_decorator
+from django.views import View
+
+from core.concurrency import gather
+from core.query_budget import query_budget
+from . import cache, facets
+from .conditional import category_list_state, category_products_state, conditional_page, product_detail_state
+from .facets import FacetSelection
+from .models import Category, Product
+from .pagination import CursorPaginator
+from .search import get_search_backend
+
+arender = sync_to_async(render)
+
+
+@method_decorator(query_budget(7), name='get')
+@method_decorator(conditional_page(category_list_state), name='get')
+class CategoryListView(View):
+    """Display all active categories"""
+    
+    async def get(self, request, *args, **kwargs):
+        categories = [
+            category async for category in
+            Category.objects.filter(is_active=True).annotate(product_count=Count('products'))
+        ]
+        
+        context = {
+            'categories': categories,
+            'page_title': 'All Collections'
+        }
+        
+        return await arender(request, 'products/category_list.html', context)
+
+
+@method_decorator(query_budget(8), name='get')
+class ProductListView(View):
+    """Display all available products with pagination"""
+    
+    async def get(self, request, *args, **kwargs):
+        listing = Product.objects.filter(is_available=True)
+        selection = FacetSelection.from_query(request.GET)
+        products = selection.filter(listing).for_listing()
+        cursor = request.GET.get('cursor')
+        page_obj, rows, categories = await gather(
+            lambda: CursorPaginator(products, 12).page(cursor),
+            lambda: cache.facet_rows('all', listing),
+            cache.active_categories,
+        )
+        
+        context = {
+            'products': page_obj,
+            'categories': categories,
+            'facets': facets.sidebar(rows, selection),
+            'facet_query': selection.querystring(),
+            'page_title': 'All T-Shirts',
+            'show_sidebar': True
+        }
+        
+        return await arender(request, 'products/product_list.html', context)
+
+
+@method_decorator(query_budget(9), name='get')
+@method_decorator(conditional_page(category_products_state), name='get')
+class CategoryProductsView(View):
+    """Display products filtered by category"""
+    
+    async def get(self, request, slug, *args, **kwargs):
+        # Filtering on the slug lets the page load alongside the category itself
+        products = Product.objects.filter(
+            category__slug=slug,
+            category__is_active=True,
+            is_available=True
+        ).for_listing()
+        cursor = request.GET.get('cursor')
+        category, page_obj, categories = await gather(
+            lambda: Category.objects.filter(slug=slug, is_active=True).first(),
+            lambda: CursorPaginator(products, 12).page(cursor),
+            cache.active_categories,
+        )
+        if category is None:
+            raise Http404('No Category matches the given query.')
+        
+        context = {
+            'products': page_obj,
+            'category': category,
+            'categories': categories,
+            'page_title': f'{category.name} Collection',
+            'show_sidebar': True
+        }
+        
+        return await arender(request, 'products/product_list.html', context)
+
+
+@method_decorator(conditional_page(product_detail_state), name='get')
+class ProductDetailView(View):
+    """Display detailed product information"""
+    
+    async def get(self, request, slug, *args, **kwargs):
+        def product_and_related():
+            product = cache.product_detail(slug)
+            return product, cache.related_products(product) if product else []
+        
+        (product, related_products), categories = await gather(product_and_related, cache.active_categories)
+        if product is None:
+            raise Http404('No Product matches the given query.')
+        
+        context = {
+            'product': product,
+            'related_products': related_products,
+            'categories': categories,
+            'page_title': product.name,
+            'show_sidebar': False
+        }
+        
+        return await arender(request, 'products/product_detail.html', context)
+
+
+@method_decorator(query_budget(10), name='get')
+class ProductSearchView(View):
+    """Search products by keywords"""
+    
+    async def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        selection = FacetSelection.from_query(request.GET)
+        cursor = request.GET.get('cursor')
+        
+        def search_page():
+            if not query:
+                return CursorPaginator(Product.objects.none(), 12).page(), []
+            # Ranked search over name, description, meta keywords and category name
+            matches = get_search_backend().search(
+                query,
+                Product.objects.filter(is_available=True)
+            )
+            # Keyset pagination on (-rank, -created_at, -id)
+            page_obj = CursorPaginator(selection.filter(matches).for_listing(), 12).page(cursor)
+            return page_obj, facets.sidebar(cache.search_facet_rows(query, matches), selection, q=query)
+        
+        (page_obj, facet_list), categories = await gather(search_page, cache.active_categories)
+        
+        context = {
+            'products': page_obj,
+            'categories': categories,
+            'facets': facet_list,
+            'facet_query': selection.querystring(),
+            'query': query,
+            'page_title': f'Search Results for "{query}"' if query else 'Search Products',
+            'show_sidebar': True
+        }
+        
+        return await arender(request, 'products/search_results.html', context)
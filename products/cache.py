@@ -0,0 +1,237 @@
+"""
+Versioned cache for catalog reads.
+
+Entries live under namespace version keys: a read of ``product`` data
+goes to ``catalog:product:v<N>:<key>``, and invalidating the namespace is
+a single ``incr`` of its version (see ``products.signals``), which orphans
+every entry written under the old version without having to find them.
+
+Stampedes are avoided with probabilistic early recomputation (XFetch):
+as an entry nears expiry, readers occasionally volunteer to recompute it
+while everyone else keeps being served the cached value, and a short
+``cache.add`` lock makes sure only one of them does the work. A cold key
+is likewise computed by the lock holder while the others wait briefly.
+
+A bump only reaches the processes that read the same cache. The default
+local memory cache is per process, so a bump by another web worker, a
+management command or the task worker never invalidates it. There every
+entry lives at most ``CATALOG_LOCAL_CACHE_SECONDS``, which bounds how long
+a process serves stale prices, stock or related products. Serve more than
+one worker with a shared cache (Redis or Memcached) to keep the full
+``CATALOG_CACHE_TIMEOUT``.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+
+from core import performance
+from . import facets
+from .models import Category, Product
+
+CATEGORIES = 'categories'
+FACETS = 'facets'
+HOMEPAGE = 'homepage'
+PRODUCT = 'product'
+RELATED = 'related'
+
+
+class CatalogCache:
+    """Namespaced, versioned get-or-compute cache with hit/miss counters"""
+
+    lock_timeout = 10
+    max_wait = 2
+    poll_interval = 0.05
+
+    def __init__(self, alias='default', timeout=None, beta=1.0):
+        self.alias = alias
+        self.timeout = timeout
+        self.beta = beta
+        self._stats_lock = threading.Lock()
+        self._stats = Counter()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def is_shared(self):
+        """Whether every process reads the same cache; local memory is per process"""
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def get_timeout(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        if timeout is None:
+            timeout = getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60)
+        if not self.is_shared:
+            # Other processes' bumps never reach a local memory cache
+            timeout = min(timeout, getattr(settings, 'CATALOG_LOCAL_CACHE_SECONDS', 30))
+        return timeout
+
+    # Versions
+
+    def _version_key(self, namespace):
+        return f'catalog:{namespace}:version'
+
+    def version(self, namespace):
+        version = self.cache.get(self._version_key(namespace))
+        if version is None:
+            self.cache.add(self._version_key(namespace), 1, timeout=None)
+            version = self.cache.get(self._version_key(namespace), 1)
+        return version
+
+    def bump(self, *namespaces):
+        """Invalidate every entry of the given namespaces"""
+        for namespace in namespaces:
+            try:
+                self.cache.incr(self._version_key(namespace))
+            except ValueError:
+                # No version stored yet (or it was evicted); start past the default
+                self.cache.set(self._version_key(namespace), 2, timeout=None)
+
+    def make_key(self, namespace, key):
+        prefix = f'catalog:{namespace}:v{self.version(namespace)}'
+        if len(prefix) + len(key) > 200:
+            # Stay under memcached's key length limit
+            key = hashlib.md5(key.encode()).hexdigest()
+        return f'{prefix}:{key}'
+
+    # Stats
+
+    def _record(self, namespace, outcome):
+        with self._stats_lock:
+            self._stats[(namespace, outcome)] += 1
+        performance.record_cache(outcome == 'hits')
+
+    def stats(self):
+        """Hit/miss counters of this process, as {namespace: {'hits': n, 'misses': n}}"""
+        with self._stats_lock:
+            stats = {}
+            for (namespace, outcome), count in self._stats.items():
+                stats.setdefault(namespace, {'hits': 0, 'misses': 0})[outcome] = count
+            return stats
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self._stats.clear()
+
+    # Reads
+
+    def _store(self, key, compute, timeout):
+        started = time.monotonic()
+        value = compute()
+        delta = time.monotonic() - started
+        self.cache.set(key, (value, time.time() + timeout, delta), timeout)
+        return value
+
+    def _should_recompute_early(self, expires_at, delta):
+        # XFetch: the closer to expiry and the costlier the recompute, the likelier
+        return time.time() - delta * self.beta * math.log(random.random() or 1e-12) >= expires_at
+
+    def refresh(self, namespace, key, compute, timeout=None):
+        """Compute and store the value for key now, replacing any cached one"""
+        return self._store(self.make_key(namespace, key), compute, self.get_timeout(timeout))
+
+    def get_or_set(self, namespace, key, compute, timeout=None):
+        """Return the cached value for key, computing and storing it on a miss"""
+        timeout = self.get_timeout(timeout)
+        cache_key = self.make_key(namespace, key)
+        lock_key = f'{cache_key}:lock'
+
+        entry = self.cache.get(cache_key)
+        if entry is not None:
+            value, expires_at, delta = entry
+            self._record(namespace, 'hits')
+            if self._should_recompute_early(expires_at, delta) and self.cache.add(lock_key, 1, self.lock_timeout):
+                try:
+                    return self._store(cache_key, compute, timeout)
+                finally:
+                    self.cache.delete(lock_key)
+            return value
+
+        self._record(namespace, 'misses')
+        if not self.cache.add(lock_key, 1, self.lock_timeout):
+            # Someone else is computing this key; give them a moment
+            deadline = time.monotonic() + self.max_wait
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                entry = self.cache.get(cache_key)
+                if entry is not None:
+                    return entry[0]
+                if self.cache.get(lock_key) is None:
+                    break
+            return self._store(cache_key, compute, timeout)
+        try:
+            return self._store(cache_key, compute, timeout)
+        finally:
+            self.cache.delete(lock_key)
+
+
+catalog_cache = CatalogCache()
+
+
+def active_categories():
+    """Active categories for the storefront sidebar"""
+    return catalog_cache.get_or_set(
+        CATEGORIES, 'active', lambda: list(Category.objects.filter(is_active=True))
+    )
+
+
+def product_detail(slug):
+    """Available product by slug with its category and images, or None"""
+    return catalog_cache.get_or_set(
+        PRODUCT, slug,
+        lambda: Product.objects.select_related('category').prefetch_related('images').filter(
+            slug=slug, is_available=True
+        ).first(),
+    )
+
+
+def related_products(product):
+    """Up to four related products, best precomputed score first
+
+    Products the related products job has not scored yet fall back to the
+    newest products of the same category.
+    """
+    def compute():
+        related = list(
+            Product.objects.filter(
+                recommended_in__product=product,
+                is_available=True
+            ).order_by('-recommended_in__score').for_listing()[:4]
+        )
+        if not related:
+            related = list(
+                Product.objects.filter(
+                    category_id=product.category_id,
+                    is_available=True
+                ).exclude(id=product.id).for_listing()[:4]
+            )
+        return related
+
+    return catalog_cache.get_or_set(RELATED, str(product.pk), compute)
+
+
+def facet_rows(key, queryset, timeout=None):
+    """Grouped facet counts of an unfiltered listing (see products.facets)"""
+    return catalog_cache.get_or_set(FACETS, key, lambda: facets.facet_rows(queryset), timeout)
+
+
+def search_facet_rows(query, queryset):
+    """Facet counts of a search's matches, keyed by a hash of the normalised query
+
+    The raw query could hold spaces or control characters, which memcached
+    rejects in keys. Every distinct query gets an entry, so they expire
+    sooner than other catalog reads.
+    """
+    normalised = ' '.join(query.lower().split())
+    key = f'search:{hashlib.md5(normalised.encode()).hexdigest()}'
+    return facet_rows(key, queryset, getattr(settings, 'SEARCH_FACET_CACHE_SECONDS', 5 * 60))
@@ -0,0 +1,46 @@
+"""
+Pre-rendered product cards.
+
+A product card's HTML depends only on the product (and its category name),
+so it is rendered once per version and cached under
+``product-card:<variant>:<id>:<updated_at>:<category updated_at>``. A page
+fetches every card it shows with a single ``get_many`` and renders only
+the misses, which are written back with one ``set_many``. Saving a product
+gives it a new ``updated_at`` and so a new key; stale cards simply expire.
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.template.loader import get_template
+from django.utils.safestring import mark_safe
+
+from core import performance
+
+CARD_TEMPLATES = {
+    'grid': 'products/includes/product_card.html',
+    'related': 'products/includes/related_product_card.html',
+}
+
+
+def card_key(product, variant='grid'):
+    return (
+        f'product-card:{variant}:{product.pk}:{product.updated_at.timestamp()}'
+        f':{product.category.updated_at.timestamp()}'
+    )
+
+
+def render_cards(products, variant='grid'):
+    """Card HTML for each product, in order, rendering only the ones not cached"""
+    cache = caches['default']
+    products = list(products)
+    keys = [card_key(product, variant) for product in products]
+    cards = cache.get_many(keys)
+
+    missing = {key: product for key, product in zip(keys, products) if key not in cards}
+    performance.record_cache(True, len(keys) - len(missing))
+    if missing:
+        template = get_template(CARD_TEMPLATES[variant])
+        rendered = {key: template.render({'product': product}) for key, product in missing.items()}
+        cache.set_many(rendered, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60))
+        cards.update(rendered)
+        performance.record_cache(False, len(missing))
+    return [mark_safe(cards[key]) for key in keys]
@@ -0,0 +1,379 @@
+"""
+Streaming catalog import and export.
+
+Rows are products, one per CSV line or JSONL object::
+
+    slug, name, category, description, price, discount_price, fabric, color,
+    available_sizes, stock, is_available, is_featured, meta_keywords, images
+
+``images`` is a ``|``-separated list of URLs in CSV and a list in JSONL;
+the first one is the primary image. Rows with a ``slug`` update that
+product (or create it under that slug). Rows without one are new products
+and get a unique slug generated from their name.
+
+Files are read and written row by row, and imports are written in batches:
+categories, products and images are each upserted with one
+``bulk_create(update_conflicts=True)`` per batch. A bad row is reported
+with its line number and skipped; it never aborts the import. Bulk writes
+skip model signals, so each batch also does the signal receivers' work:
+reindexing search, syncing sizes, refreshing the totals of carts holding the
+products, and (once, at the end) invalidating the catalog cache.
+"""
+import csv
+import gzip
+import io
+import json
+import re
+import sys
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import slugify
+
+from . import cache, facets, homepage
+from .models import Category, Product, ProductImage
+from .search import get_search_backend
+
+FIELDS = [
+    'slug', 'name', 'category', 'description', 'price', 'discount_price', 'fabric', 'color',
+    'available_sizes', 'stock', 'is_available', 'is_featured', 'meta_keywords', 'images',
+]
+PRODUCT_FIELDS = [
+    'category', 'name', 'description', 'price', 'discount_price', 'fabric', 'color',
+    'available_sizes', 'stock', 'is_available', 'is_featured', 'meta_keywords',
+]
+TRUE = {'1', 'true', 'yes', 'y', 't'}
+FALSE = {'0', 'false', 'no', 'n', 'f', ''}
+SLUG_PATTERN = re.compile(r'^[-a-zA-Z0-9_]+$')
+# Bases looked up per query; SQLite caps the depth of the OR tree at 1000
+SLUG_QUERY_CHUNK = 200
+
+
+class RowError(ValueError):
+    """A row that cannot be imported; the import reports it and carries on"""
+
+    def __init__(self, line, message):
+        self.line = line
+        self.message = message
+        super().__init__(f'line {line}: {message}')
+
+
+def detect_format(path, default='csv'):
+    name = path[:-3] if path.endswith('.gz') else path
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.csv'):
+        return 'csv'
+    return default
+
+
+def open_text(path, mode='r'):
+    """Open a path (or '-' for stdin/stdout) as text, transparently gzipped for .gz"""
+    if path == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8', newline='') if 'r' in mode else sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def read_rows(stream, fmt):
+    """Yield (line number, raw row dict) pairs without loading the file"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as error:
+            yield line, RowError(line, f'invalid JSON ({error})')
+            continue
+        yield line, row if isinstance(row, dict) else RowError(line, 'expected a JSON object')
+
+
+def _text(row, field, line, required=False, max_length=None):
+    value = row.get(field)
+    value = '' if value is None else str(value).strip()
+    if required and not value:
+        raise RowError(line, f'{field} is required')
+    if max_length and len(value) > max_length:
+        raise RowError(line, f'{field} is longer than {max_length} characters')
+    return value
+
+
+def _decimal(row, field, line, required=False):
+    value = _text(row, field, line, required=required)
+    if not value:
+        return None
+    try:
+        number = Decimal(value)
+    except InvalidOperation:
+        raise RowError(line, f'{field} is not a number: {value!r}')
+    if not number.is_finite() or number < 0 or number >= Decimal('1e8'):
+        raise RowError(line, f'{field} is out of range: {value!r}')
+    return number.quantize(Decimal('0.01'))
+
+
+def _boolean(row, field, line, default):
+    value = row.get(field)
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE:
+        return True
+    if value in FALSE:
+        return False
+    raise RowError(line, f'{field} must be true or false, not {value!r}')
+
+
+def parse_row(line, row):
+    """Validate a raw row into clean product values, raising RowError"""
+    stock = _text(row, 'stock', line) or '0'
+    if not stock.isdigit():
+        raise RowError(line, f'stock must be a whole number, not {stock!r}')
+    slug = _text(row, 'slug', line, max_length=300)
+    if slug and not SLUG_PATTERN.match(slug):
+        raise RowError(line, f'slug {slug!r} may only contain letters, numbers, hyphens and underscores')
+    price = _decimal(row, 'price', line, required=True)
+    discount_price = _decimal(row, 'discount_price', line)
+    if discount_price is not None and discount_price > price:
+        raise RowError(line, 'discount_price is higher than price')
+
+    images = row.get('images')
+    if isinstance(images, str):
+        images = [url.strip() for url in images.split('|') if url.strip()]
+    elif images is not None and not isinstance(images, list):
+        raise RowError(line, 'images must be a list of URLs')
+    for url in images or []:
+        if not isinstance(url, str) or not url.startswith(('http://', 'https://')) or len(url) > 500:
+            raise RowError(line, f'invalid image URL {url!r}')
+
+    return {
+        'line': line,
+        'slug': slug,
+        'name': _text(row, 'name', line, required=True, max_length=300),
+        'category': _text(row, 'category', line, required=True, max_length=200),
+        'description': _text(row, 'description', line),
+        'price': price,
+        'discount_price': discount_price,
+        'fabric': _text(row, 'fabric', line, max_length=100) or '100% Cotton',
+        'color': _text(row, 'color', line, max_length=50) or 'White',
+        'available_sizes': _text(row, 'available_sizes', line, max_length=100) or 'S,M,L,XL',
+        'stock': int(stock),
+        'is_available': _boolean(row, 'is_available', line, True),
+        'is_featured': _boolean(row, 'is_featured', line, False),
+        'meta_keywords': _text(row, 'meta_keywords', line, max_length=300),
+        # None leaves a product's images alone; a list (even empty) replaces them
+        'images': images if 'images' in row and row.get('images') is not None else None,
+    }
+
+
+def unique_slugs(model, names, max_length, reserved=()):
+    """Unique slugs for names, avoiding existing rows, reserved slugs and each other
+
+    One query finds exact matches, then only the bases already taken are
+    searched for their numbered variants.
+    """
+    bases = [slugify(name)[:max_length - 8] or 'item' for name in names]
+    taken = set(model.objects.filter(slug__in=set(bases)).values_list('slug', flat=True)) | set(reserved)
+    clashing = {base for base in bases if base in taken} | {base for base in bases if bases.count(base) > 1}
+    clashing = sorted(clashing)
+    for start in range(0, len(clashing), SLUG_QUERY_CHUNK):
+        # 'base-' <= slug < 'base.' is every suffixed slug of base, as an index range scan
+        prefixes = Q()
+        for base in clashing[start:start + SLUG_QUERY_CHUNK]:
+            prefixes |= Q(slug__gt=f'{base}-', slug__lt=f'{base}.')
+        taken.update(model.objects.filter(prefixes).values_list('slug', flat=True))
+
+    slugs = []
+    for base in bases:
+        slug, suffix = base, 2
+        while slug in taken:
+            slug, suffix = f'{base}-{suffix}', suffix + 1
+        taken.add(slug)
+        slugs.append(slug)
+    return slugs
+
+
+class CatalogImporter:
+    """Upserts parsed rows in batches and keeps count of what happened"""
+
+    def __init__(self, batch_size=1000, on_error=None):
+        self.batch_size = batch_size
+        self.on_error = on_error
+        self.created = 0
+        self.updated = 0
+        self.images = 0
+        self.errors = 0
+        self.batch = []
+        self.batch_slugs = set()
+
+    def error(self, error):
+        self.errors += 1
+        if self.on_error:
+            self.on_error(error)
+
+    def run(self, rows):
+        for line, row in rows:
+            if isinstance(row, RowError):
+                self.error(row)
+                continue
+            try:
+                self.add(parse_row(line, row))
+            except RowError as error:
+                self.error(error)
+        self.flush()
+        cache.catalog_cache.bump(cache.CATEGORIES, cache.FACETS, cache.PRODUCT, cache.RELATED)
+        homepage.invalidate()
+        return self
+
+    def add(self, row):
+        # A slug may only be upserted once per statement, so a repeat starts a new batch
+        if row['slug'] and row['slug'] in self.batch_slugs:
+            self.flush()
+        self.batch.append(row)
+        if row['slug']:
+            self.batch_slugs.add(row['slug'])
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        rows, self.batch, self.batch_slugs = self.batch, [], set()
+        if not rows:
+            return
+        try:
+            with transaction.atomic():
+                product_ids, (created, updated, images) = self.write(rows)
+        except Exception as error:
+            # Something the row checks did not catch; fall back to row by row to isolate it
+            if len(rows) == 1:
+                self.error(RowError(rows[0]['line'], str(error)))
+                return
+            for row in rows:
+                self.batch = [row]
+                self.flush()
+            return
+        # Counted only once the batch commits: a failed batch is retried row by row
+        self.created += created
+        self.updated += updated
+        self.images += images
+        self.after_write(product_ids)
+
+    def write(self, rows):
+        """Upsert one batch; returns its product ids and (created, updated, images) counts"""
+        categories = self.upsert_categories({row['category'] for row in rows})
+
+        given = [row['slug'] for row in rows if row['slug']]
+        generated = iter(unique_slugs(Product, [row['name'] for row in rows if not row['slug']], 300, given))
+        slugs = [row['slug'] or next(generated) for row in rows]
+        existing = set(Product.objects.filter(slug__in=given).values_list('slug', flat=True))
+
+        products = Product.objects.bulk_create(
+            [
+                Product(slug=slug, **{
+                    field: categories[row['category']] if field == 'category' else row[field]
+                    for field in PRODUCT_FIELDS
+                })
+                for slug, row in zip(slugs, rows)
+            ],
+            update_conflicts=True,
+            unique_fields=['slug'],
+            update_fields=PRODUCT_FIELDS + ['updated_at'],
+        )
+        facets.sync_sizes(products)
+
+        with_images = [(product, row['images']) for product, row in zip(products, rows) if row['images'] is not None]
+        images = self.replace_images(with_images) if with_images else 0
+        return [product.pk for product in products], (len(rows) - len(existing), len(existing), images)
+
+    def upsert_categories(self, names):
+        found = {category.name: category for category in Category.objects.filter(name__in=names)}
+        missing = sorted(names - set(found))
+        if missing:
+            created = Category.objects.bulk_create(
+                [
+                    Category(name=name, slug=slug)
+                    for name, slug in zip(missing, unique_slugs(Category, missing, 200))
+                ],
+                update_conflicts=True,
+                unique_fields=['name'],
+                update_fields=['updated_at'],
+            )
+            found.update((category.name, category) for category in created)
+        return found
+
+    def replace_images(self, with_images):
+        wanted = {
+            (product.pk, url): ProductImage(
+                product=product, image_url=url, alt_text=product.name[:200], is_primary=order == 0, order=order,
+            )
+            for product, urls in with_images
+            for order, url in enumerate(dict.fromkeys(urls))
+        }
+        stale = [
+            pk for pk, product_id, url in ProductImage.objects.filter(
+                product_id__in=[product.pk for product, _ in with_images]
+            ).values_list('pk', 'product_id', 'image_url')
+            if (product_id, url) not in wanted
+        ]
+        if stale:
+            ProductImage.objects.filter(pk__in=stale).delete()
+        if wanted:
+            ProductImage.objects.bulk_create(
+                list(wanted.values()),
+                update_conflicts=True,
+                unique_fields=['product', 'image_url'],
+                update_fields=['alt_text', 'is_primary', 'order'],
+            )
+        return len(wanted)
+
+    def after_write(self, product_ids):
+        from cart.models import Cart, CartItem
+
+        get_search_backend().index_products(product_ids)
+        # Prices may have changed under carts holding these products
+        cart_ids = set(CartItem.objects.filter(product_id__in=product_ids).values_list('cart_id', flat=True))
+        if cart_ids:
+            Cart.objects.filter(pk__in=cart_ids).recalculate_totals()
+
+
+def export_rows(queryset, fmt, stream, chunk_size=2000):
+    """Write products as CSV or JSONL, streaming from the database in chunks"""
+    products = queryset.select_related('category').prefetch_related('images').order_by('pk')
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(stream, fieldnames=FIELDS)
+        writer.writeheader()
+    count = 0
+    for product in products.iterator(chunk_size=chunk_size):
+        images = [
+            image.image_url
+            for image in sorted(product.images.all(), key=lambda image: (not image.is_primary, image.order, image.pk))
+        ]
+        row = {
+            'slug': product.slug,
+            'name': product.name,
+            'category': product.category.name,
+            'description': product.description,
+            'price': str(product.price),
+            'discount_price': str(product.discount_price) if product.discount_price is not None else '',
+            'fabric': product.fabric,
+            'color': product.color,
+            'available_sizes': product.available_sizes,
+            'stock': product.stock,
+            'is_available': product.is_available,
+            'is_featured': product.is_featured,
+            'meta_keywords': product.meta_keywords,
+        }
+        if writer:
+            writer.writerow({**row, 'images': '|'.join(images)})
+        else:
+            stream.write(json.dumps({**row, 'images': images}, ensure_ascii=False) + '\n')
+        count += 1
+    return count
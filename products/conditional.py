@@ -0,0 +1,185 @@
+"""
+Conditional GET for catalog pages.
+
+Before a page renders, ``conditional_page`` computes its validators from
+one aggregate query. The query covers the rows the page shows: the ``updated_at``
+watermark and row count of each set, the active categories in the sidebar
+and, for signed-in users, the cart count in the navbar. Anonymous carts
+live in the session and are read from there.
+
+The weak ETag hashes that state together with the viewer, and Last-Modified
+is the newest ``updated_at`` in it. A matching ``If-None-Match`` (or
+``If-Modified-Since``) gets a ``304 Not Modified`` without rendering
+anything.
+
+Pages for visitors without a session are the same for everyone, so they are
+marked ``public`` with an ``s-maxage`` for a reverse proxy, unless the
+render used something of the visitor's own: a CSRF token (the add-to-cart
+form) or a flash message. Those pages, and everyone else's, get
+``private, no-cache`` and revalidate on every visit.
+"""
+import hashlib
+from calendar import timegm
+from datetime import datetime
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db.models import Count, Max, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+from cart.models import Cart
+from cart.session import SessionCart
+from .models import Category, Product, RelatedProduct
+
+
+def scalar(queryset, aggregate):
+    """One aggregate over queryset, as a scalar subquery"""
+    return Subquery(
+        queryset.order_by().annotate(group=Value(1)).values('group').annotate(value=aggregate).values('value')
+    )
+
+
+def catalog_state(request, **subqueries):
+    """Evaluate the page's scalar subqueries, the sidebar and the viewer's cart count in one query"""
+    if request.user.is_authenticated:
+        subqueries['cart'] = Subquery(Cart.objects.filter(user=request.user).values('item_count')[:1])
+    # The subqueries are uncorrelated, so MAX over the category rows is just their value
+    state = Category.objects.filter(is_active=True).aggregate(
+        categories_changed=Max('updated_at'),
+        categories=Count('id'),
+        **{name: Max(subquery) for name, subquery in subqueries.items()},
+    )
+    if not state['categories']:
+        # Nothing to aggregate over; let the page render unconditionally
+        return None
+    if not request.user.is_authenticated:
+        state['cart'] = SessionCart(request.session).total_items
+    return state
+
+
+def category_list_state(request):
+    products = Product.objects.filter(category__is_active=True)
+    return catalog_state(
+        request,
+        products_changed=scalar(products, Max('updated_at')),
+        products=scalar(products, Count('id')),
+    )
+
+
+def category_products_state(request, slug):
+    # Unavailable products count too: hiding one changes its updated_at
+    products = Product.objects.filter(category__slug=slug)
+    state = catalog_state(
+        request,
+        category_changed=scalar(Category.objects.filter(slug=slug, is_active=True), Max('updated_at')),
+        products_changed=scalar(products, Max('updated_at')),
+        products=scalar(products, Count('id')),
+    )
+    if state is None or state['category_changed'] is None:
+        return None
+    return state
+
+
+def product_detail_state(request, slug):
+    product = Product.objects.filter(slug=slug, is_available=True)
+    scores = RelatedProduct.objects.filter(product__slug=slug)
+    state = catalog_state(
+        request,
+        product_changed=scalar(product, Max('updated_at')),
+        category_changed=scalar(product, Max('category__updated_at')),
+        related_scored=scalar(scores, Max('updated_at')),
+        related=scalar(scores, Count('id')),
+        # Scored products, or the same-category fallback when the product has none yet
+        related_changed=Coalesce(
+            scalar(Product.objects.filter(recommended_in__product__slug=slug), Max('updated_at')),
+            scalar(Product.objects.filter(category__products__slug=slug), Max('updated_at')),
+        ),
+    )
+    if state is None or state['product_changed'] is None:
+        return None
+    return state
+
+
+def _validators(request, state):
+    viewer = request.user.pk if request.user.is_authenticated else 'anonymous'
+    fingerprint = repr((viewer, sorted(state.items())))
+    etag = f'W/"{hashlib.md5(fingerprint.encode()).hexdigest()}"'
+    last_modified = max((value for value in state.values() if isinstance(value, datetime)), default=None)
+    return etag, last_modified
+
+
+def _shareable(request, response):
+    """Whether a proxy may serve this response to every visitor"""
+    if request.user.is_authenticated or settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return False
+    # get_token() flags this; CsrfViewMiddleware then sets the visitor's cookie
+    if request.META.get('CSRF_COOKIE_NEEDS_UPDATE') or response.cookies:
+        return False
+    messages = getattr(request, '_messages', None)
+    return messages is None or not len(messages)
+
+
+def _cache_control(request, response):
+    if not _shareable(request, response):
+        patch_cache_control(response, private=True, no_cache=True)
+    else:
+        patch_cache_control(
+            response, public=True, max_age=0,
+            s_maxage=getattr(settings, 'CATALOG_PAGE_CACHE_SECONDS', 60),
+        )
+
+
+def _prepare(request, state_func, args, kwargs):
+    """The page's validators and, if they still match, the 304 to answer with"""
+    state = state_func(request, *args, **kwargs)
+    if state is None:
+        return None
+    etag, last_modified = _validators(request, state)
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    return etag, timestamp, get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def _finish(request, response, etag, timestamp):
+    if response.status_code in (200, 304):
+        response.headers.setdefault('ETag', etag)
+        if timestamp is not None:
+            response.headers.setdefault('Last-Modified', http_date(timestamp))
+        _cache_control(request, response)
+    return response
+
+
+def conditional_page(state_func):
+    """Answer GETs whose validators still match with 304, before the view renders
+
+    state_func(request, *args, **kwargs) returns the page's state dict, or
+    None to skip conditional handling (e.g. when the page will be a 404).
+    Works on sync and async views; for async ones state_func runs in a thread.
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                prepared = await sync_to_async(_prepare)(request, state_func, args, kwargs)
+                if prepared is None:
+                    return await view(request, *args, **kwargs)
+                etag, timestamp, response = prepared
+                if response is None:
+                    response = await view(request, *args, **kwargs)
+                return _finish(request, response, etag, timestamp)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                prepared = _prepare(request, state_func, args, kwargs)
+                if prepared is None:
+                    return view(request, *args, **kwargs)
+                etag, timestamp, response = prepared
+                if response is None:
+                    response = view(request, *args, **kwargs)
+                return _finish(request, response, etag, timestamp)
+
+        return wrapper
+
+    return decorator
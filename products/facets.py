@@ -0,0 +1,280 @@
+"""
+Faceted filtering for the product list and search pages.
+
+Shoppers narrow a listing by size, color, fabric, price band and stock.
+Values of one facet are ORed and facets are ANDed, e.g.
+``?size=M&size=L&color=Black&price=500-999``. Every filter is served by an
+index:
+
+- sizes live in ``ProductSize`` rows (kept in step with
+  ``Product.available_sizes`` by ``sync_sizes``) and are matched with an
+  ``EXISTS`` on ``(size, product)``;
+- color and fabric use ``(is_available, color)`` and
+  ``(is_available, fabric)``;
+- price bands are ranges over the final price expression index
+  (``final_price_expression``: ``discount_price`` when above zero, else
+  ``price``, as ``Product.final_price``).
+
+Facet counts come from ``facet_rows``: one grouped query over the unfiltered
+listing that counts products per combination of color, fabric, price band,
+stock and size set. Counts for any selection are then summed from those rows
+in Python, so the rows are cached per listing (``products.cache.facet_rows``)
+and shared by every filter combination until a product changes. Each facet
+counts with the other facets' filters applied but not its own, so picking a
+value never hides its alternatives.
+"""
+from collections import Counter
+from urllib.parse import urlencode
+
+from django.db import transaction
+from django.db.models import BooleanField, Case, Count, Exists, ExpressionWrapper, OuterRef, Q, Value, When
+from django.db.models.lookups import GreaterThanOrEqual, LessThan
+
+from .models import Product, ProductSize, final_price_expression
+
+SIZES = [code for code, _ in Product.SIZE_CHOICES]
+
+# (key, label, lower bound, upper bound) in rupees; the related products job bands prices with these too
+PRICE_BANDS = [
+    ('under-500', 'Under ₹500', None, 500),
+    ('500-999', '₹500 – ₹999', 500, 1000),
+    ('1000-1999', '₹1,000 – ₹1,999', 1000, 2000),
+    ('2000-4999', '₹2,000 – ₹4,999', 2000, 5000),
+    ('5000-up', '₹5,000 and up', 5000, None),
+]
+
+# Most values a shopper can pick per facet; more are ignored
+MAX_VALUES = 20
+
+
+def final_price():
+    """Price a product sells at, matching the product_final_price_idx expression"""
+    return final_price_expression()
+
+
+def sync_sizes(products):
+    """Rewrite the ProductSize rows of products from their available_sizes"""
+    products = list(products)
+    if not products:
+        return
+    with transaction.atomic():
+        ProductSize.objects.filter(product__in=[product.pk for product in products]).delete()
+        ProductSize.objects.bulk_create([
+            ProductSize(product_id=product.pk, size=code)
+            for product in products
+            for code in product.get_size_codes()
+        ])
+
+
+class Facet:
+    name = ''
+    label = ''
+
+    def clean(self, values):
+        """Valid, distinct picked values, in query string order"""
+        return list(dict.fromkeys(value for value in values if value))[:MAX_VALUES]
+
+    def q(self, values):
+        raise NotImplementedError
+
+    def row_values(self, row):
+        raise NotImplementedError
+
+    def options(self, counts):
+        """(value, label) pairs to offer, in display order"""
+        return [(value, value) for value in sorted(counts)]
+
+
+class FieldFacet(Facet):
+    """A plain product field, e.g. color"""
+
+    def __init__(self, name, label):
+        self.name = name
+        self.label = label
+        self.max_length = Product._meta.get_field(name).max_length
+
+    def clean(self, values):
+        return super().clean(value for value in values if len(value) <= self.max_length)
+
+    def q(self, values):
+        return Q(**{f'{self.name}__in': values})
+
+    def row_values(self, row):
+        return (row[self.name],)
+
+
+class SizeFacet(Facet):
+    name = 'size'
+    label = 'Size'
+
+    def clean(self, values):
+        return super().clean(value.upper() for value in values if value.upper() in SIZES)
+
+    def q(self, values):
+        return Q(Exists(ProductSize.objects.filter(product=OuterRef('pk'), size__in=values)))
+
+    def row_values(self, row):
+        return row['sizes']
+
+    def options(self, counts):
+        return [(code, code) for code in SIZES if code in counts]
+
+
+class PriceFacet(Facet):
+    name = 'price'
+    label = 'Price'
+    bands = {key: (lower, upper) for key, _, lower, upper in PRICE_BANDS}
+
+    def clean(self, values):
+        return super().clean(value for value in values if value in self.bands)
+
+    def q(self, values):
+        condition = Q()
+        for value in values:
+            lower, upper = self.bands[value]
+            band = Q()
+            if lower is not None:
+                band &= Q(GreaterThanOrEqual(final_price(), lower))
+            if upper is not None:
+                band &= Q(LessThan(final_price(), upper))
+            condition |= band
+        return condition
+
+    def row_values(self, row):
+        return (row['price_band'],)
+
+    def options(self, counts):
+        return [(key, label) for key, label, _, _ in PRICE_BANDS if key in counts]
+
+    @classmethod
+    def band_expression(cls):
+        return Case(
+            *[
+                When(LessThan(final_price(), upper), then=Value(key))
+                for key, _, _, upper in PRICE_BANDS if upper is not None
+            ],
+            default=Value(PRICE_BANDS[-1][0]),
+        )
+
+
+class InStockFacet(Facet):
+    name = 'in_stock'
+    label = 'Availability'
+
+    def clean(self, values):
+        return ['1'] if '1' in values else []
+
+    def q(self, values):
+        return Q(stock__gt=0)
+
+    def row_values(self, row):
+        return ('1',) if row['in_stock'] else ()
+
+    def options(self, counts):
+        return [('1', 'In stock')] if '1' in counts else []
+
+
+FACETS = [
+    SizeFacet(),
+    FieldFacet('color', 'Color'),
+    FieldFacet('fabric', 'Fabric'),
+    PriceFacet(),
+    InStockFacet(),
+]
+FACETS_BY_NAME = {facet.name: facet for facet in FACETS}
+
+
+class FacetSelection:
+    """Facet values picked in a query string, as {facet name: [values]}"""
+
+    def __init__(self, values=None):
+        self.values = {name: list(picked) for name, picked in (values or {}).items() if picked}
+
+    @classmethod
+    def from_query(cls, query):
+        return cls({facet.name: facet.clean(query.getlist(facet.name)) for facet in FACETS})
+
+    def __bool__(self):
+        return bool(self.values)
+
+    def filter(self, queryset):
+        for name, picked in self.values.items():
+            queryset = queryset.filter(FACETS_BY_NAME[name].q(picked))
+        return queryset
+
+    def matches(self, row, skip=None):
+        """Whether a facet_rows row passes every picked facet except skip"""
+        for name, picked in self.values.items():
+            if name != skip and not set(FACETS_BY_NAME[name].row_values(row)) & set(picked):
+                return False
+        return True
+
+    def toggle(self, name, value):
+        """The selection with value picked or unpicked"""
+        values = {key: list(picked) for key, picked in self.values.items()}
+        picked = values.setdefault(name, [])
+        if value in picked:
+            picked.remove(value)
+        else:
+            picked.append(value)
+        return FacetSelection(values)
+
+    def querystring(self, **params):
+        """URL-encoded selection, after params (e.g. the search query)"""
+        pairs = [(key, value) for key, value in params.items() if value]
+        pairs += [(facet.name, value) for facet in FACETS for value in self.values.get(facet.name, ())]
+        return urlencode(pairs)
+
+
+def facet_rows(queryset):
+    """Product counts per (color, fabric, price band, in stock, sizes) of an unfiltered listing"""
+    sizes = {
+        f'size_{code}': Exists(ProductSize.objects.filter(product=OuterRef('pk'), size=code))
+        for code in SIZES
+    }
+    grouped = queryset.order_by().annotate(
+        price_band=PriceFacet.band_expression(),
+        in_stock=ExpressionWrapper(Q(stock__gt=0), output_field=BooleanField()),
+        **sizes,
+    ).values('color', 'fabric', 'price_band', 'in_stock', *sizes).annotate(count=Count('pk'))
+    return [
+        {
+            'color': row['color'],
+            'fabric': row['fabric'],
+            'price_band': row['price_band'],
+            'in_stock': bool(row['in_stock']),
+            'sizes': tuple(code for code in SIZES if row[f'size_{code}']),
+            'count': row['count'],
+        }
+        for row in grouped
+    ]
+
+
+def total(rows, selection):
+    """Products of the listing that match the whole selection"""
+    return sum(row['count'] for row in rows if selection.matches(row))
+
+
+def sidebar(rows, selection, **params):
+    """Facets with their options, counts and toggle links, for the listing template"""
+    facets = []
+    for facet in FACETS:
+        counts = Counter()
+        for row in rows:
+            if selection.matches(row, skip=facet.name):
+                for value in facet.row_values(row):
+                    counts[value] += row['count']
+        picked = selection.values.get(facet.name, [])
+        options = [
+            {
+                'value': value,
+                'label': label,
+                'count': counts[value],
+                'selected': value in picked,
+                'query': selection.toggle(facet.name, value).querystring(**params),
+            }
+            for value, label in facet.options(counts.keys() | set(picked))
+        ]
+        if options:
+            facets.append({'name': facet.name, 'label': facet.label, 'options': options})
+    return facets
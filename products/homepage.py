@@ -0,0 +1,133 @@
+"""
+Precomputed homepage.
+
+The homepage shows four blocks built from the catalog: collections (active
+categories), featured products (``is_featured``), top deals (biggest
+``discount_percentage`` first) and new arrivals. A product appears in one
+product block at most. ``build`` assembles them into one plain payload, with
+the product cards already rendered, and stores it in the catalog cache, so
+a homepage view is a single cache read and no catalog queries.
+
+Catalog changes call ``invalidate``. It bumps the ``HOMEPAGE`` namespace
+once the transaction commits, so the next read rebuilds the payload from
+the primary database. With a cache shared between processes (Redis or
+Memcached) it also queues one ``refresh_homepage`` task (products.tasks)
+per ``HOMEPAGE_REFRESH_SECONDS`` window. The task runs at the end of the
+window and stores a fresh payload, so readers rarely wait on a miss.
+``build_homepage`` does the same from cron, as a safety net for changes
+made behind the signals' back.
+
+Local memory caches are per process: a bump or a worker's rebuild never
+reaches the other web processes. There the payload only lives for
+``HOMEPAGE_REFRESH_SECONDS``, so each process rebuilds it that often.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, Q
+
+from core import db_router
+from .cache import HOMEPAGE, catalog_cache
+from .cards import render_cards
+from .models import Category, Product
+
+# Products per block
+BLOCK_SIZE = 8
+COLLECTIONS = 4
+
+BLOCKS = [
+    ('featured', 'Featured Products', 'Hand-picked by our team'),
+    ('deals', 'Top Deals', 'The biggest discounts right now'),
+    ('new_arrivals', 'New Arrivals', 'Just landed in the store'),
+]
+
+
+def _refresh_seconds():
+    return getattr(settings, 'HOMEPAGE_REFRESH_SECONDS', 5)
+
+
+def _timeout():
+    if not catalog_cache.is_shared:
+        return _refresh_seconds()
+    return getattr(settings, 'HOMEPAGE_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def block_products(key, exclude=()):
+    available = Product.objects.filter(is_available=True).exclude(pk__in=exclude)
+    if key == 'featured':
+        products = available.filter(is_featured=True).order_by('-created_at', '-id')
+    elif key == 'deals':
+        discount = ExpressionWrapper(
+            (F('price') - F('discount_price')) / F('price'), output_field=DecimalField(max_digits=10, decimal_places=4),
+        )
+        # A zero discount_price means no discount (see Product.final_price)
+        products = available.filter(discount_price__gt=0, discount_price__lt=F('price')).alias(
+            discount=discount,
+        ).order_by('-discount', '-created_at', '-id')
+    else:
+        products = available.order_by('-created_at', '-id')
+    return list(products.for_listing()[:BLOCK_SIZE])
+
+
+def collections():
+    categories = Category.objects.filter(is_active=True).annotate(
+        product_count=Count('products', filter=Q(products__is_available=True)),
+    ).filter(product_count__gt=0).order_by('-product_count', 'name')[:COLLECTIONS]
+    return [
+        {
+            'name': category.name,
+            'description': category.description,
+            'image': category.image,
+            'url': category.get_absolute_url(),
+            'product_count': category.product_count,
+        }
+        for category in categories
+    ]
+
+
+def build():
+    """The homepage payload: collections and the product blocks with rendered cards"""
+    shown, blocks = [], []
+    for key, title, subtitle in BLOCKS:
+        products = block_products(key, exclude=shown)
+        shown += [product.pk for product in products]
+        blocks.append({'key': key, 'title': title, 'subtitle': subtitle, 'cards': render_cards(products)})
+    return {'built_at': time.time(), 'collections': collections(), 'blocks': blocks}
+
+
+def _build_on_primary():
+    # A replica may not have the change that invalidated the payload yet
+    with db_router.unit_of_work(pinned=True):
+        return build()
+
+
+def payload():
+    """The cached homepage payload, built now only if the cache has none"""
+    return catalog_cache.get_or_set(HOMEPAGE, 'payload', _build_on_primary, _timeout())
+
+
+def refresh():
+    """Rebuild and store the payload in place"""
+    return catalog_cache.refresh(HOMEPAGE, 'payload', _build_on_primary, _timeout())
+
+
+def invalidate():
+    """Drop the payload once the current transaction commits and schedule its rebuild"""
+    transaction.on_commit(lambda: catalog_cache.bump(HOMEPAGE))
+    schedule_refresh()
+
+
+def schedule_refresh():
+    """Queue a rebuild at the end of the current HOMEPAGE_REFRESH_SECONDS window, once per window
+
+    Only with a shared cache: a worker's local memory cache is its own.
+    """
+    from .tasks import refresh_homepage
+
+    if not catalog_cache.is_shared:
+        return
+    window = _refresh_seconds()
+    now = time.time()
+    ends = (now // window + 1) * window
+    refresh_homepage.enqueue(idempotency_key=f'homepage:{int(ends)}', delay=ends - now)
@@ -0,0 +1,17 @@
+import time
+
+from django.core.management.base import BaseCommand
+from products import homepage
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the precomputed homepage payload (run from cron as a safety net for the refresh tasks)'
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        payload = homepage.refresh()
+        blocks = ', '.join(f'{len(block["cards"])} {block["key"]}' for block in payload['blocks'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Built the homepage: {len(payload["collections"])} collections, {blocks} '
+            f'in {(time.perf_counter() - started) * 1000:.0f}ms'
+        ))
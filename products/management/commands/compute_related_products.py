@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from products import recommendations
+from products.cache import RELATED, catalog_cache
+
+
+class Command(BaseCommand):
+    help = 'Score related products from cart co-occurrence and attribute similarity'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Rescore every product instead of only those whose carts or attributes changed',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of products scored per batch (default: 500)',
+        )
+        parser.add_argument(
+            '--limit', type=int, default=8,
+            help='Related products stored per product (default: 8)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1 or options['limit'] < 1:
+            raise CommandError('--batch-size and --limit must be positive integers')
+
+        run = recommendations.run(
+            full=options['full'], batch_size=options['batch_size'], limit=options['limit']
+        )
+        catalog_cache.bump(RELATED)
+
+        kind = 'Full' if run.is_full else 'Incremental'
+        self.stdout.write(self.style.SUCCESS(
+            f'{kind} run rescored {run.products_updated} product(s) '
+            f'in {(run.finished_at - run.started_at).total_seconds():.1f}s'
+        ))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_io import detect_format, export_rows, open_text
+from products.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Export products to CSV or JSONL in the format import_catalog reads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to write (.csv, .jsonl, optionally .gz), or - for stdout')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Output format (default: from the file extension, else csv)',
+        )
+        parser.add_argument('--category', help='Only export products of the category with this slug')
+        parser.add_argument(
+            '--chunk-size', type=int, default=2000,
+            help='Products fetched from the database at a time (default: 2000)',
+        )
+
+    def handle(self, *args, **options):
+        fmt = options['format'] or detect_format(options['path'])
+        products = Product.objects.all()
+        if options['category']:
+            try:
+                category = Category.objects.get(slug=options['category'])
+            except Category.DoesNotExist:
+                raise CommandError(f'No category with slug {options["category"]!r}')
+            products = products.filter(category=category)
+
+        if options['path'] == '-':
+            export_rows(products, fmt, self.stdout, chunk_size=options['chunk_size'])
+            return
+        with open_text(options['path'], 'w') as stream:
+            count = export_rows(products, fmt, stream, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} products to {options["path"]}'))
@@ -0,0 +1,178 @@
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.text import slugify
+
+from accounts.models import Profile
+from cart.models import Cart, CartItem
+from products import homepage
+from products.cache import CATEGORIES, FACETS, PRODUCT, RELATED, catalog_cache
+from products.facets import sync_sizes
+from products.models import Category, Product, ProductImage
+from products.search import get_search_backend
+
+ADJECTIVES = [
+    'Classic', 'Vintage', 'Oversized', 'Relaxed', 'Slim', 'Cropped', 'Washed', 'Heavyweight',
+    'Organic', 'Boxy', 'Tie-Dye', 'Minimal', 'Retro', 'Graphic', 'Striped', 'Embroidered',
+]
+STYLES = [
+    'Crew Neck', 'V-Neck', 'Polo', 'Henley', 'Pocket', 'Raglan', 'Longline', 'Muscle',
+    'Hooded', 'Zip', 'Drop Shoulder', 'Ringer',
+]
+ITEMS = ['Tee', 'Shirt', 'Hoodie', 'Sweatshirt', 'Tank', 'Jacket', 'Kurta', 'Joggers']
+THEMES = [
+    'Streetwear', 'Anime', 'Cartoon', 'Typography', 'Nature', 'Music', 'Sports', 'Travel',
+    'Retro Gaming', 'Abstract', 'Festival', 'Monochrome', 'Pastel', 'Desi', 'Space', 'Coffee',
+]
+COLORS = ['White', 'Black', 'Navy', 'Olive', 'Maroon', 'Beige', 'Grey', 'Mustard', 'Lavender', 'Teal']
+FABRICS = ['100% Cotton', 'Cotton Blend', 'Organic Cotton', 'Linen', 'Polyester', 'French Terry', 'Fleece']
+SIZE_SETS = ['S,M,L,XL', 'XS,S,M,L', 'M,L,XL,XXL', 'S,M,L,XL,XXL']
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic catalog (categories, products, images, users with carts) for load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=10000, help='Products to create (default: 10000)')
+        parser.add_argument('--categories', type=int, default=len(THEMES), help='Categories to create')
+        parser.add_argument('--images', type=int, default=2, help='Images per product (default: 2)')
+        parser.add_argument('--users', type=int, default=200, help='Users, each with a cart (default: 200)')
+        parser.add_argument('--cart-items', type=int, default=3, help='Items per cart (default: 3)')
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Rows per bulk_create batch (default: 5000)',
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible catalogs')
+        parser.add_argument(
+            '--skip-index', action='store_true',
+            help='Do not rebuild the search index afterwards',
+        )
+
+    def handle(self, *args, **options):
+        for name in ('products', 'categories', 'batch_size'):
+            if options[name] < 1:
+                raise CommandError(f'--{name.replace("_", "-")} must be a positive integer')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        # Keep names and slugs unique across repeated runs
+        self.run_tag = str(int(time.time()))[-6:]
+
+        started = time.perf_counter()
+        categories = self.create_categories(options['categories'])
+        product_ids = self.create_products(categories, options['products'])
+        images = self.create_images(product_ids, options['images'])
+        carts = self.create_carts(product_ids, options['users'], options['cart_items'])
+
+        if not options['skip_index']:
+            get_search_backend().rebuild()
+        for namespace in (CATEGORIES, FACETS, PRODUCT, RELATED):
+            catalog_cache.bump(namespace)
+        homepage.refresh()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Created {len(categories)} categories, {len(product_ids)} products, {images} images '
+            f'and {carts} carts in {time.perf_counter() - started:.1f}s'
+        ))
+
+    def batches(self, rows):
+        for start in range(0, len(rows), self.batch_size):
+            yield rows[start:start + self.batch_size]
+
+    def create_categories(self, count):
+        categories = []
+        for n in range(count):
+            theme = THEMES[n % len(THEMES)]
+            name = f'{theme} {n // len(THEMES) + 1} {self.run_tag}' if count > len(THEMES) else f'{theme} {self.run_tag}'
+            categories.append(Category(
+                name=name, slug=slugify(name), description=f'{theme} inspired apparel',
+                image=f'https://picsum.photos/seed/category-{self.run_tag}-{n}/600/400',
+            ))
+        return Category.objects.bulk_create(categories, batch_size=self.batch_size)
+
+    def create_products(self, categories, count):
+        product_ids = []
+        rows = []
+        for n in range(count):
+            category = self.random.choice(categories)
+            name = (
+                f'{self.random.choice(ADJECTIVES)} {self.random.choice(STYLES)} '
+                f'{self.random.choice(ITEMS)} {n + 1}'
+            )
+            price = Decimal(self.random.randrange(299, 4999))
+            discount_price = None
+            if self.random.random() < 0.35:
+                discount_price = (price * Decimal(self.random.choice(['0.6', '0.7', '0.8', '0.9']))).quantize(Decimal('1'))
+            rows.append(Product(
+                category=category,
+                name=name,
+                slug=f'{slugify(name)}-{self.run_tag}',
+                description=f'{name} from our {category.name} collection.',
+                price=price,
+                discount_price=discount_price,
+                fabric=self.random.choice(FABRICS),
+                color=self.random.choice(COLORS),
+                available_sizes=self.random.choice(SIZE_SETS),
+                stock=self.random.choice([0, 3, 10, 25, 50, 100, 250]),
+                is_available=self.random.random() > 0.05,
+                is_featured=self.random.random() < 0.02,
+                meta_keywords=f'{category.name}, {name}',
+            ))
+        for batch in self.batches(rows):
+            with transaction.atomic():
+                batch = Product.objects.bulk_create(batch)
+                # bulk_create skips the post_save receiver that indexes sizes
+                sync_sizes(batch)
+                product_ids.extend(product.pk for product in batch)
+            self.stdout.write(f'  products: {len(product_ids)}/{count}')
+        return product_ids
+
+    def create_images(self, product_ids, per_product):
+        created = 0
+        rows = [
+            ProductImage(
+                product_id=product_id,
+                image_url=f'https://picsum.photos/seed/product-{product_id}-{order}/600/800',
+                alt_text=f'Product {product_id} image {order + 1}',
+                is_primary=order == 0,
+                order=order,
+            )
+            for product_id in product_ids
+            for order in range(per_product)
+        ]
+        for batch in self.batches(rows):
+            with transaction.atomic():
+                created += len(ProductImage.objects.bulk_create(batch))
+        return created
+
+    def create_carts(self, product_ids, user_count, items_per_cart):
+        if not user_count:
+            return 0
+        # Hashing once keeps 100k users from spending minutes in the password hasher
+        password = make_password('loadtest')
+        users = [
+            User(username=f'loadtest-{self.run_tag}-{n}', email=f'loadtest{n}@example.com', password=password)
+            for n in range(user_count)
+        ]
+        created = 0
+        for batch in self.batches(users):
+            with transaction.atomic():
+                batch = User.objects.bulk_create(batch)
+                # bulk_create skips the post_save receiver that creates profiles
+                Profile.objects.bulk_create([Profile(user=user) for user in batch])
+                carts = Cart.objects.bulk_create([Cart(user=user) for user in batch])
+                CartItem.objects.bulk_create([
+                    CartItem(
+                        cart=cart, product_id=product_id,
+                        size=self.random.choice(['S', 'M', 'L']), quantity=self.random.randint(1, 3),
+                    )
+                    for cart in carts
+                    for product_id in self.random.sample(product_ids, min(items_per_cart, len(product_ids)))
+                ])
+                Cart.objects.filter(pk__in=[cart.pk for cart in carts]).recalculate_totals()
+                created += len(carts)
+        return created
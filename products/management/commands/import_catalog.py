@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from products.catalog_io import CatalogImporter, detect_format, open_text, read_rows
+
+
+class Command(BaseCommand):
+    help = 'Import products from a CSV or JSONL file, upserting by slug in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import (.csv, .jsonl, optionally .gz), or - for stdin')
+        parser.add_argument(
+            '--format', choices=['csv', 'jsonl'],
+            help='Input format (default: from the file extension, else csv)',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per bulk upsert (default: 1000)')
+        parser.add_argument('--errors-file', help='Also write rejected rows\' errors to this file')
+        parser.add_argument(
+            '--max-errors-shown', type=int, default=20,
+            help='Errors to print before only counting them (default: 20)',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be a positive integer')
+        fmt = options['format'] or detect_format(options['path'])
+        errors_file = open(options['errors_file'], 'w', encoding='utf-8') if options['errors_file'] else None
+
+        def report(error):
+            if errors_file:
+                errors_file.write(f'{error}\n')
+            if importer.errors <= options['max_errors_shown']:
+                self.stderr.write(self.style.WARNING(str(error)))
+
+        importer = CatalogImporter(batch_size=options['batch_size'], on_error=report)
+        started = time.perf_counter()
+        try:
+            stream = open_text(options['path'])
+        except OSError as error:
+            raise CommandError(f'Cannot open {options["path"]}: {error}')
+        try:
+            importer.run(read_rows(stream, fmt))
+        finally:
+            if options['path'] != '-':
+                stream.close()
+            if errors_file:
+                errors_file.close()
+
+        elapsed = time.perf_counter() - started
+        rows = importer.created + importer.updated
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {rows} products ({importer.created} created, {importer.updated} updated, '
+            f'{importer.images} images) in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):.0f} rows/s)'
+        ))
+        if importer.errors:
+            self.stdout.write(self.style.WARNING(f'{importer.errors} row(s) rejected'))
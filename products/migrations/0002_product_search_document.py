@@ -0,0 +1,58 @@
+# Generated by Django 5.2.5 on 2026-10-18 00:41
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+POSTGRES_FORWARDS = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS products_searchdoc_vector_gin '
+    'ON products_productsearchdocument USING gin (vector)',
+    'CREATE INDEX IF NOT EXISTS products_product_name_trgm '
+    'ON products_product USING gin (name gin_trgm_ops)',
+    """
+    INSERT INTO products_productsearchdocument (product_id, vector)
+    SELECT p.id,
+           setweight(to_tsvector('english', coalesce(p.name, '')), 'A') ||
+           setweight(to_tsvector('english', coalesce(p.meta_keywords, '')), 'B') ||
+           setweight(to_tsvector('english', coalesce(c.name, '')), 'B') ||
+           setweight(to_tsvector('english', coalesce(p.description, '')), 'C')
+    FROM products_product p
+    JOIN products_category c ON c.id = p.category_id
+    ON CONFLICT (product_id) DO NOTHING
+    """,
+]
+
+POSTGRES_BACKWARDS = [
+    'DROP INDEX IF EXISTS products_product_name_trgm',
+    'DROP INDEX IF EXISTS products_searchdoc_vector_gin',
+]
+
+
+def postgres_only(statements):
+    """GIN/trigram indexes and tsvector backfill only exist on PostgreSQL"""
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='products.product')),
+                ('vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+            ],
+        ),
+        migrations.RunPython(postgres_only(POSTGRES_FORWARDS), postgres_only(POSTGRES_BACKWARDS)),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:04
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def drop_duplicate_images(apps, schema_editor):
+    # Keep the first image of each (product, URL) pair so the constraint can be added
+    ProductImage = apps.get_model('products', 'ProductImage')
+    keep = ProductImage.objects.order_by().values('product', 'image_url').annotate(first=Min('id')).values('first')
+    ProductImage.objects.exclude(id__in=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_related_products'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_duplicate_images, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productimage',
+            constraint=models.UniqueConstraint(fields=('product', 'image_url'), name='unique_product_image_url'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0006_product_category_updated_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Resized copies built from image'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image',
+            field=models.ImageField(blank=True, help_text='Uploaded or mirrored copy of the image', upload_to='products/'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 5.2.5 on 2026-10-18 01:39
+
+import django.db.models.deletion
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+SIZES = ['XS', 'S', 'M', 'L', 'XL', 'XXL']
+
+
+def backfill_product_sizes(apps, schema_editor):
+    Product = apps.get_model('products', 'Product')
+    ProductSize = apps.get_model('products', 'ProductSize')
+    batch = []
+    for pk, available_sizes in Product.objects.values_list('pk', 'available_sizes').iterator():
+        codes = {size.strip().upper() for size in available_sizes.split(',')}
+        batch.extend(ProductSize(product_id=pk, size=code) for code in SIZES if code in codes)
+        if len(batch) >= 5000:
+            ProductSize.objects.bulk_create(batch)
+            batch = []
+    ProductSize.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0007_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSize',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(choices=[('XS', 'Extra Small'), ('S', 'Small'), ('M', 'Medium'), ('L', 'Large'), ('XL', 'Extra Large'), ('XXL', 'Double XL')], max_length=5)),
+            ],
+            options={
+                'ordering': ['product', 'size'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_available', 'color'], name='product_color_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['is_available', 'fabric'], name='product_fabric_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('discount_price', 'price'), name='product_final_price_idx'),
+        ),
+        migrations.AddField(
+            model_name='productsize',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sizes', to='products.product'),
+        ),
+        migrations.AddIndex(
+            model_name='productsize',
+            index=models.Index(fields=['size', 'product'], name='product_size_lookup_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='productsize',
+            constraint=models.UniqueConstraint(fields=('product', 'size'), name='unique_product_size'),
+        ),
+        migrations.RunPython(backfill_product_sizes, migrations.RunPython.noop),
+    ]
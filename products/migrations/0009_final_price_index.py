@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0008_product_sizes_and_facet_indexes'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='product',
+            name='product_final_price_idx',
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(models.Case(models.When(discount_price__gt=0, then=models.F('discount_price')), default=models.F('price')), name='product_final_price_idx'),
+        ),
+    ]
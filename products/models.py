@@ -1,8 +1,18 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.db.models import Case, F, When
 from django.urls import reverse
 from django.utils.text import slugify
 
 
+def final_price_expression(prefix=''):
+    """Product.final_price in SQL: a discount_price above zero, else price"""
+    return Case(
+        When(**{f'{prefix}discount_price__gt': 0}, then=F(f'{prefix}discount_price')),
+        default=F(f'{prefix}price'),
+    )
+
+
 class Category(models.Model):
     name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=200, unique=True, blank=True)
@@ -28,6 +38,19 @@ class Category(models.Model):
         return reverse('products:category_products', kwargs={'slug': self.slug})
 
 
+class ProductQuerySet(models.QuerySet):
+    
+    def for_listing(self):
+        """Load what a product card renders: category plus at most one image per product"""
+        return self.select_related('category').prefetch_related(
+            models.Prefetch(
+                'images',
+                queryset=ProductImage.objects.order_by('-is_primary', 'order', 'id')[:1],
+                to_attr='primary_images',
+            )
+        )
+
+
 class Product(models.Model):
     SIZE_CHOICES = [
         ('XS', 'Extra Small'),
@@ -62,11 +85,21 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    objects = ProductQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
         indexes = [
             models.Index(fields=['slug']),
-            models.Index(fields=['category', 'is_available']),
+            # Keyset pagination walks these in (-created_at, -id) order
+            models.Index(fields=['is_available', '-created_at', '-id'], name='product_available_keyset_idx'),
+            models.Index(fields=['category', 'is_available', '-created_at', '-id'], name='product_category_keyset_idx'),
+            # Conditional GET validators read the newest updated_at of a category
+            models.Index(fields=['category', 'updated_at'], name='product_category_updated_idx'),
+            # Facet filters (see products.facets)
+            models.Index(fields=['is_available', 'color'], name='product_color_idx'),
+            models.Index(fields=['is_available', 'fabric'], name='product_fabric_idx'),
+            models.Index(final_price_expression(), name='product_final_price_idx'),
         ]
     
     def __str__(self):
@@ -92,6 +125,13 @@ class Product(models.Model):
             return int(((self.price - self.discount_price) / self.price) * 100)
         return 0
     
+    @property
+    def primary_image(self):
+        """Image shown on product cards; uses the for_listing() prefetch when present"""
+        if hasattr(self, 'primary_images'):
+            return self.primary_images[0] if self.primary_images else None
+        return self.images.order_by('-is_primary', 'order', 'id').first()
+    
     @property
     def in_stock(self):
         """Check if product is in stock"""
@@ -101,15 +141,41 @@ class Product(models.Model):
         """Return list of available sizes"""
         return [size.strip() for size in self.available_sizes.split(',') if size.strip()]
     
+    def get_size_codes(self):
+        """Known size codes in available_sizes, normalised to SIZE_CHOICES"""
+        codes = {code for code, _ in self.SIZE_CHOICES}
+        return sorted({size.upper() for size in self.get_available_sizes_list()} & codes)
+    
     @classmethod
     def total_products(cls):
         """Return total number of images for the product"""
         return cls.objects.count()
 
 
+class ProductSize(models.Model):
+    """A size a product comes in: the indexed form of ``Product.available_sizes`` for size filters"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='sizes')
+    size = models.CharField(max_length=5, choices=Product.SIZE_CHOICES)
+    
+    class Meta:
+        ordering = ['product', 'size']
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'size'], name='unique_product_size'),
+        ]
+        indexes = [
+            # "Products in size M" starts from the size
+            models.Index(fields=['size', 'product'], name='product_size_lookup_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.size} for product {self.product_id}"
+
+
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image_url = models.URLField(max_length=500, help_text="Product image URL (e.g., from Unsplash)")
+    image = models.ImageField(upload_to='products/', blank=True, help_text="Uploaded or mirrored copy of the image")
+    derivatives = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized copies built from image")
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False, help_text="Main product image")
     order = models.PositiveIntegerField(default=0, help_text="Display order")
@@ -117,6 +183,10 @@ class ProductImage(models.Model):
     
     class Meta:
         ordering = ['order', '-is_primary']
+        constraints = [
+            # Lets catalog imports upsert images by URL
+            models.UniqueConstraint(fields=['product', 'image_url'], name='unique_product_image_url'),
+        ]
     
     def __str__(self):
         return f"Image for {self.product.name}"
@@ -127,5 +197,43 @@ class ProductImage(models.Model):
         super().save(*args, **kwargs)
 
 
-Product.object.first()
-Product.objects.last()
+class RelatedProduct(models.Model):
+    """Precomputed "you may also like" link, scored by the compute_related_products job"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommended_in')
+    score = models.FloatField()
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['product', '-score']
+        unique_together = ['product', 'related']
+        indexes = [
+            models.Index(fields=['product', '-score']),
+        ]
+    
+    def __str__(self):
+        return f"{self.related_id} for product {self.product_id} ({self.score:.3f})"
+
+
+class RelatedProductRun(models.Model):
+    """One run of the related products job; the last finished run is the incremental watermark"""
+    started_at = models.DateTimeField()
+    finished_at = models.DateTimeField(null=True, blank=True)
+    is_full = models.BooleanField(default=False)
+    products_updated = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-started_at']
+    
+    def __str__(self):
+        return f"Related products run at {self.started_at:%Y-%m-%d %H:%M}"
+
+
+class ProductSearchDocument(models.Model):
+    """Full-text search vector for a product, kept apart from Product so listing queries stay lean"""
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+    vector = SearchVectorField(null=True)
+    
+    def __str__(self):
+        return f"Search document for product {self.product_id}"
+
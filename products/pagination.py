@@ -0,0 +1,189 @@
+"""
+Keyset (cursor) pagination.
+
+Instead of ``COUNT(*)`` plus ``OFFSET``, each page is fetched with a
+``WHERE (ordering columns) < (values of the last row seen)`` filter, so
+the cost of a page does not grow with its depth. Pages carry opaque
+``next_cursor``/``previous_cursor`` tokens in place of page numbers.
+"""
+import base64
+import binascii
+import datetime
+import decimal
+import json
+import uuid
+
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db import connections
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+class CursorEncoder(json.JSONEncoder):
+    """JSON encoder keeping full datetime precision (DjangoJSONEncoder drops microseconds)"""
+
+    def default(self, o):
+        if isinstance(o, (datetime.date, datetime.time)):
+            return o.isoformat()
+        if isinstance(o, (decimal.Decimal, uuid.UUID)):
+            return str(o)
+        return super().default(o)
+
+
+class CursorPage:
+    """One page of a CursorPaginator; iterates like a Django Page"""
+
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<CursorPage of {len(self.object_list)} items>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    @property
+    def approximate_count(self):
+        return self.paginator.approximate_count
+
+
+class CursorPaginator:
+    """
+    Paginate a queryset by keyset on its ordering.
+
+    ``ordering`` defaults to the queryset's ordering (or the model's
+    ``Meta.ordering``) with the primary key appended as a tie-breaker,
+    e.g. ``('-created_at', '-id')`` for products. Ordering names may be
+    model fields or annotations on the queryset.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering or self._default_ordering(queryset))
+        self._approximate_count = None
+
+    @staticmethod
+    def _default_ordering(queryset):
+        ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+        pk_name = queryset.model._meta.pk.name
+        if not any(name.lstrip('-') in ('pk', pk_name) for name in ordering):
+            descending = bool(ordering) and ordering[-1].startswith('-')
+            ordering.append(f'-{pk_name}' if descending else pk_name)
+        return ordering
+
+    def encode_cursor(self, instance, direction):
+        values = [getattr(instance, name.lstrip('-')) for name in self.ordering]
+        payload = json.dumps({'d': direction, 'v': values}, cls=CursorEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+            direction, values = payload['d'], payload['v']
+        except (binascii.Error, ValueError, TypeError, KeyError):
+            raise InvalidCursor(cursor)
+        if direction not in ('next', 'prev') or len(values) != len(self.ordering):
+            raise InvalidCursor(cursor)
+
+        opts = self.queryset.model._meta
+        decoded = []
+        for name, value in zip(self.ordering, values):
+            name = name.lstrip('-')
+            try:
+                field = opts.pk if name == 'pk' else opts.get_field(name)
+            except FieldDoesNotExist:
+                # Annotations (e.g. search rank) travel as plain JSON values
+                decoded.append(value)
+                continue
+            try:
+                decoded.append(field.to_python(value))
+            except ValidationError:
+                raise InvalidCursor(cursor)
+        return direction, decoded
+
+    def _keyset_filter(self, values, reverse):
+        """Q matching rows strictly after ``values`` in ordering (before if ``reverse``)"""
+        condition = Q()
+        equal_so_far = Q()
+        for name, value in zip(self.ordering, values):
+            descending = name.startswith('-')
+            name = name.lstrip('-')
+            lookup = 'lt' if descending != reverse else 'gt'
+            condition |= equal_so_far & Q(**{f'{name}__{lookup}': value})
+            equal_so_far &= Q(**{name: value})
+        return condition
+
+    def page(self, cursor=None):
+        """Return the page a cursor points at; a missing or invalid cursor gives the first page"""
+        direction, values = 'next', None
+        if cursor:
+            try:
+                direction, values = self.decode_cursor(cursor)
+            except InvalidCursor:
+                pass
+
+        reverse = direction == 'prev'
+        queryset = self.queryset
+        if values is not None:
+            queryset = queryset.filter(self._keyset_filter(values, reverse))
+        if reverse:
+            ordering = [name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering]
+        else:
+            ordering = list(self.ordering)
+
+        # One extra row tells whether there is another page in this direction
+        rows = list(queryset.order_by(*ordering)[:self.per_page + 1])
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if reverse:
+            rows.reverse()
+
+        if not rows:
+            return CursorPage(rows, self)
+        if reverse:
+            has_next, has_previous = True, has_more
+        else:
+            has_next, has_previous = has_more, values is not None
+        return CursorPage(
+            rows,
+            self,
+            next_cursor=self.encode_cursor(rows[-1], 'next') if has_next else None,
+            previous_cursor=self.encode_cursor(rows[0], 'prev') if has_previous else None,
+        )
+
+    @property
+    def approximate_count(self):
+        """Row estimate from the planner's table statistics (PostgreSQL only), or None"""
+        if self._approximate_count is None:
+            connection = connections[self.queryset.db]
+            if connection.vendor != 'postgresql':
+                return None
+            try:
+                plan = json.loads(self.queryset.order_by().explain(format='json'))
+                self._approximate_count = int(plan[0]['Plan']['Plan Rows'])
+            except (ValueError, KeyError, IndexError, TypeError):
+                return None
+        return self._approximate_count
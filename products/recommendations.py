@@ -0,0 +1,292 @@
+"""
+Related products batch job.
+
+Scores every candidate product for a target product as
+
+    CO_OCCURRENCE_WEIGHT * cosine co-occurrence in baskets (carts and orders)
+    + ATTRIBUTE_WEIGHT * attribute similarity (category, color, fabric, price band)
+
+and stores the best ``limit`` as ``RelatedProduct`` rows, which the
+product detail page reads with one indexed query. Candidates for a target
+are the products of its category plus anything that shared a basket with
+it. Orders count as baskets because checkout empties the cart they came
+from. Co-occurrence counts come from a vectorised self-join of the
+(basket, product) pairs in NumPy, attribute similarity from array
+comparisons over integer-coded attributes. A run loads the attributes of
+the scored categories once and reuses them for every batch.
+
+Run through ``manage.py compute_related_products``; incremental runs only
+rescore products whose carts, orders or attributes changed since the last
+run.
+"""
+from collections import defaultdict
+
+import numpy as np
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .facets import PRICE_BANDS
+from .models import Product, RelatedProduct, RelatedProductRun
+
+CO_OCCURRENCE_WEIGHT = 0.7
+ATTRIBUTE_WEIGHT = 0.3
+
+# Attribute similarity weights, summing to 1
+CATEGORY_WEIGHT = 0.4
+COLOR_WEIGHT = 0.2
+FABRIC_WEIGHT = 0.2
+PRICE_BAND_WEIGHT = 0.2
+
+# Upper bounds (in rupees) of the facet price bands
+PRICE_BAND_BOUNDS = [upper for _, _, _, upper in PRICE_BANDS if upper is not None]
+
+
+def _cart_items():
+    # cart depends on products, so look the model up lazily
+    return apps.get_model('cart', 'CartItem').objects
+
+
+def _order_items():
+    return apps.get_model('cart', 'OrderItem').objects
+
+
+# (items, basket field): carts get even basket ids and orders odd ones
+BASKETS = [(_cart_items, 'cart_id'), (_order_items, 'order_id')]
+
+
+def basket_pairs(product_ids):
+    """(basket, product) pairs of every cart and order holding one of product_ids"""
+    pairs = []
+    for kind, (items, basket) in enumerate(BASKETS):
+        baskets = items().filter(product_id__in=product_ids).values(basket)
+        rows = np.array(
+            list(
+                items().filter(**{f'{basket}__in': baskets}, product__isnull=False)
+                .order_by().values_list(basket, 'product_id').distinct()
+            ),
+            dtype=np.int64,
+        ).reshape(-1, 2)
+        rows[:, 0] = rows[:, 0] * 2 + kind
+        pairs.append(rows)
+    return np.concatenate(pairs)
+
+
+def basket_counts(product_ids):
+    """{product_id: number of carts and orders holding it}, for cosine normalisation"""
+    counts = defaultdict(int)
+    for items, basket in BASKETS:
+        rows = (
+            items().filter(product_id__in=product_ids).order_by().values('product_id')
+            .annotate(baskets=Count(basket, distinct=True)).values_list('product_id', 'baskets')
+        )
+        for product_id, baskets in rows:
+            counts[product_id] += baskets
+    return counts
+
+
+def co_occurrences(target_ids):
+    """Return (targets, partners, counts) arrays of baskets shared by target/partner pairs"""
+    pairs = basket_pairs(target_ids)
+    if not len(pairs):
+        empty = np.empty(0, dtype=np.int64)
+        return empty, empty, empty
+
+    pairs = pairs[np.argsort(pairs[:, 0], kind='stable')]
+    cart_column, product_column = pairs[:, 0], pairs[:, 1]
+    anchors = pairs[np.isin(product_column, target_ids)]
+
+    # Pair every (cart, target) with every product of the same cart
+    starts = np.searchsorted(cart_column, anchors[:, 0], side='left')
+    lengths = np.searchsorted(cart_column, anchors[:, 0], side='right') - starts
+    targets = np.repeat(anchors[:, 1], lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    partners = product_column[np.repeat(starts, lengths) + offsets]
+
+    keep = targets != partners
+    combined, counts = np.unique(
+        np.stack([targets[keep], partners[keep]], axis=1), axis=0, return_counts=True
+    )
+    return combined[:, 0], combined[:, 1], counts
+
+
+class ProductAttributes:
+    """Integer-coded attributes of the available products of a queryset, indexed by position
+
+    ``in_category`` only covers the products loaded up front; ``include``
+    appends products from other categories (basket partners) as they come up.
+    """
+
+    def __init__(self, queryset):
+        self.ids = self.categories = self.colors = self.fabrics = self.price_bands = np.empty(0, dtype=np.int64)
+        self.position = {}
+        self._codes = ({}, {})  # color, fabric -> code
+        self._looked_up = set()
+        self._append(queryset)
+        order = np.argsort(self.categories, kind='stable')
+        self._by_category = order
+        self._category_sorted = self.categories[order]
+
+    def _append(self, queryset):
+        columns = ([], [], [], [], [])
+        colors, fabrics = self._codes
+        rows = queryset.filter(is_available=True).order_by().values_list(
+            'id', 'category_id', 'color', 'fabric', 'price', 'discount_price',
+        )
+        for pk, category_id, color, fabric, price, discount_price in rows.iterator(chunk_size=5000):
+            self.position[pk] = len(self.position)
+            columns[0].append(pk)
+            columns[1].append(category_id)
+            columns[2].append(colors.setdefault(color.strip().lower(), len(colors)))
+            columns[3].append(fabrics.setdefault(fabric.strip().lower(), len(fabrics)))
+            columns[4].append(float(discount_price or price))
+        ids, categories, color_codes, fabric_codes, prices = (np.array(column) for column in columns)
+        self.ids = np.concatenate([self.ids, ids.astype(np.int64)])
+        self.categories = np.concatenate([self.categories, categories.astype(np.int64)])
+        self.colors = np.concatenate([self.colors, color_codes.astype(np.int64)])
+        self.fabrics = np.concatenate([self.fabrics, fabric_codes.astype(np.int64)])
+        self.price_bands = np.concatenate([self.price_bands, np.digitize(prices.astype(np.float64), PRICE_BAND_BOUNDS)])
+
+    def include(self, product_ids):
+        """Load whichever of product_ids are not loaded (or known unavailable) yet"""
+        missing = [pk for pk in product_ids if pk not in self.position and pk not in self._looked_up]
+        if missing:
+            self._looked_up.update(missing)
+            self._append(Product.objects.filter(pk__in=missing))
+
+    def in_category(self, category_id):
+        start, end = np.searchsorted(self._category_sorted, [category_id, category_id + 1])
+        return self._by_category[start:end]
+
+    def similarity(self, index, candidates):
+        """Attribute similarity of product ``index`` to each of ``candidates``"""
+        return (
+            CATEGORY_WEIGHT * (self.categories[candidates] == self.categories[index]) +
+            COLOR_WEIGHT * (self.colors[candidates] == self.colors[index]) +
+            FABRIC_WEIGHT * (self.fabrics[candidates] == self.fabrics[index]) +
+            PRICE_BAND_WEIGHT * (self.price_bands[candidates] == self.price_bands[index])
+        )
+
+
+def score_products(target_ids, limit=8, attributes=None):
+    """Return {target_id: [(related_id, score), ...]} for the given products, best first
+
+    ``attributes`` must cover the categories of target_ids; without it they
+    are loaded for this call.
+    """
+    target_ids = np.unique(np.asarray(list(target_ids), dtype=np.int64))
+    if not len(target_ids):
+        return {}
+
+    targets, partners, counts = co_occurrences(target_ids)
+    if attributes is None:
+        target_categories = Product.objects.filter(pk__in=target_ids.tolist()).values('category_id')
+        attributes = ProductAttributes(Product.objects.filter(category_id__in=target_categories))
+    involved = np.unique(np.concatenate([target_ids, partners])).tolist()
+    attributes.include(involved)
+
+    # Cosine normalisation needs how many baskets each product is in overall
+    cart_counts = basket_counts(involved)
+
+    order = np.argsort(targets, kind='stable')
+    targets, partners, counts = targets[order], partners[order], counts[order]
+
+    results = {}
+    for target_id in target_ids.tolist():
+        index = attributes.position.get(target_id)
+        if index is None:
+            # Unavailable products get no recommendations
+            results[target_id] = []
+            continue
+
+        start, end = np.searchsorted(targets, [target_id, target_id + 1])
+        partner_ids = partners[start:end]
+        partner_positions = np.array(
+            [attributes.position.get(pk, -1) for pk in partner_ids.tolist()], dtype=np.int64
+        )
+        known = partner_positions >= 0
+        partner_positions = partner_positions[known]
+        co_counts = counts[start:end][known].astype(np.float64)
+
+        candidates = np.union1d(attributes.in_category(attributes.categories[index]), partner_positions)
+        candidates = candidates[candidates != index]
+        if not len(candidates):
+            results[target_id] = []
+            continue
+
+        co_scores = np.zeros(len(candidates))
+        if len(partner_positions):
+            norms = np.sqrt(
+                cart_counts.get(target_id, 1) *
+                np.array([cart_counts.get(pk, 1) for pk in attributes.ids[partner_positions].tolist()], dtype=np.float64)
+            )
+            co_scores[np.searchsorted(candidates, partner_positions)] = co_counts / norms
+
+        scores = CO_OCCURRENCE_WEIGHT * co_scores + ATTRIBUTE_WEIGHT * attributes.similarity(index, candidates)
+
+        top = min(limit, len(candidates))
+        best = np.argpartition(-scores, top - 1)[:top]
+        # Highest score first, newest product (highest id) on ties
+        best = best[np.lexsort((-attributes.ids[candidates[best]], -scores[best]))]
+        results[target_id] = [
+            (int(attributes.ids[candidates[position]]), float(scores[position])) for position in best
+        ]
+    return results
+
+
+def store_related_products(scored):
+    """Replace the RelatedProduct rows of the scored products"""
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id__in=list(scored)).delete()
+        RelatedProduct.objects.bulk_create(
+            [
+                RelatedProduct(product_id=product_id, related_id=related_id, score=score)
+                for product_id, related in scored.items()
+                for related_id, score in related
+            ],
+            batch_size=1000,
+        )
+
+
+def changed_product_ids(since):
+    """Products whose carts, orders or own attributes changed since the given time"""
+    changed_carts = apps.get_model('cart', 'Cart').objects.filter(updated_at__gt=since).values('pk')
+    new_orders = apps.get_model('cart', 'Order').objects.filter(created_at__gt=since).values('pk')
+    return set(
+        _cart_items().filter(cart_id__in=changed_carts).values_list('product_id', flat=True).distinct()
+    ) | set(
+        _order_items().filter(order_id__in=new_orders, product__isnull=False).values_list('product_id', flat=True)
+    ) | set(
+        Product.objects.filter(updated_at__gt=since).values_list('pk', flat=True)
+    )
+
+
+def run(full=False, batch_size=500, limit=8):
+    """Rescore changed products (or all with ``full``) and record the run; returns the run"""
+    last_run = RelatedProductRun.objects.filter(finished_at__isnull=False).first()
+    started_at = timezone.now()
+    full = full or last_run is None
+    run = RelatedProductRun.objects.create(started_at=started_at, is_full=full)
+
+    if full:
+        product_ids = list(Product.objects.order_by('pk').values_list('pk', flat=True))
+        attributes = ProductAttributes(Product.objects.all())
+    else:
+        product_ids = sorted(changed_product_ids(last_run.started_at))
+        categories = set()
+        for start in range(0, len(product_ids), batch_size):
+            categories.update(
+                Product.objects.filter(pk__in=product_ids[start:start + batch_size])
+                .order_by().values_list('category_id', flat=True).distinct()
+            )
+        attributes = ProductAttributes(Product.objects.filter(category_id__in=categories))
+
+    # Candidate attributes are loaded once per run, not once per batch
+    for start in range(0, len(product_ids), batch_size):
+        store_related_products(score_products(product_ids[start:start + batch_size], limit=limit, attributes=attributes))
+
+    run.products_updated = len(product_ids)
+    run.finished_at = timezone.now()
+    run.save(update_fields=['products_updated', 'finished_at'])
+    return run
@@ -0,0 +1,289 @@
+"""
+Product search backends.
+
+Both backends expose the same API: ``search(query, queryset)`` returns
+``queryset`` narrowed to the matching products and ordered by relevance,
+and the ``index_*``/``remove_*`` hooks are called from the signals in
+``products.signals`` to keep the index current.
+
+``PostgresSearchBackend`` ranks over an indexed tsvector stored in
+``ProductSearchDocument`` and falls back to trigram word similarity on
+the product name when the full-text query finds nothing (typos).
+``InMemorySearchBackend`` is a pure-Python inverted index used on SQLite
+dev and test setups. It lives in process memory, so each process builds
+its own copy lazily on the first search. It ranks in Python and hands the
+database only the ``PRODUCT_SEARCH_MAX_RESULTS`` best ids, so a common
+term does not turn into a statement with one parameter per match.
+"""
+import difflib
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import defaultdict
+from functools import lru_cache
+from operator import itemgetter
+
+from django.conf import settings
+from django.contrib.postgres.lookups import TrigramWordSimilar
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramWordSimilarity
+from django.db import connection, transaction
+from django.db.models import Case, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Cast
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductSearchDocument
+
+
+class BaseSearchBackend:
+    """Interface shared by the product search backends"""
+
+    def search(self, query, queryset=None):
+        """Return ``queryset`` filtered to products matching ``query``, best match first"""
+        raise NotImplementedError
+
+    def index_products(self, product_ids):
+        """(Re)index the given products"""
+
+    def index_category(self, category):
+        """Reindex every product of a category, e.g. after it was renamed"""
+
+    def remove_products(self, product_ids):
+        """Drop the given products from the index"""
+
+    def rebuild(self):
+        """Rebuild the whole index from the database"""
+
+    def clear(self):
+        """Drop any state cached in this process"""
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """Full-text search over ``ProductSearchDocument.vector`` with a trigram fallback"""
+
+    def __init__(self):
+        self.config = getattr(settings, 'PRODUCT_SEARCH_CONFIG', 'english')
+
+    def vector(self):
+        """Weighted tsvector expression for a ``Product`` row"""
+        return (
+            SearchVector('name', weight='A', config=self.config) +
+            SearchVector('meta_keywords', weight='B', config=self.config) +
+            SearchVector('category__name', weight='B', config=self.config) +
+            SearchVector('description', weight='C', config=self.config)
+        )
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Product.objects.all()
+
+        search_query = SearchQuery(query, search_type='websearch', config=self.config)
+        # Ranks are float4; as double precision they survive the pagination cursor's JSON exactly
+        matches = queryset.filter(search_document__vector=search_query).annotate(
+            rank=Cast(SearchRank(F('search_document__vector'), search_query), FloatField())
+        ).order_by('-rank', '-created_at', '-id')
+        if matches.exists():
+            return matches
+
+        # Nothing matched the lexemes; look for near spellings of a word in
+        # the name instead (pg_trgm's %> operator, served by the trigram index)
+        return queryset.filter(
+            TrigramWordSimilar(F('name'), Value(query))
+        ).annotate(
+            rank=Cast(TrigramWordSimilarity(query, 'name'), FloatField())
+        ).order_by('-rank', '-created_at', '-id')
+
+    def _update_documents(self, documents):
+        vectors = Product.objects.filter(pk=OuterRef('product_id')).annotate(
+            document=self.vector()
+        ).values('document')
+        documents.update(vector=Subquery(vectors))
+
+    def index_products(self, product_ids):
+        product_ids = list(product_ids)
+        with transaction.atomic():
+            ProductSearchDocument.objects.bulk_create(
+                [ProductSearchDocument(product_id=pk) for pk in product_ids],
+                ignore_conflicts=True,
+            )
+            self._update_documents(ProductSearchDocument.objects.filter(product_id__in=product_ids))
+
+    def index_category(self, category):
+        self._update_documents(ProductSearchDocument.objects.filter(product__category=category))
+
+    def remove_products(self, product_ids):
+        ProductSearchDocument.objects.filter(product_id__in=list(product_ids)).delete()
+
+    def rebuild(self):
+        with transaction.atomic():
+            ProductSearchDocument.objects.bulk_create(
+                [ProductSearchDocument(product_id=pk) for pk in Product.objects.values_list('pk', flat=True)],
+                batch_size=1000,
+                ignore_conflicts=True,
+            )
+            self._update_documents(ProductSearchDocument.objects.all())
+
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+STOP_WORDS = frozenset(['a', 'an', 'and', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+# Field weights mirror the A/B/B/C weights of the PostgreSQL vector
+FIELD_WEIGHTS = (
+    ('name', 4.0),
+    ('meta_keywords', 2.0),
+    ('category__name', 2.0),
+    ('description', 1.0),
+)
+
+
+def tokenize(text):
+    """Split text into lowercase search terms"""
+    return [
+        token for token in TOKEN_RE.findall((text or '').lower())
+        if token not in STOP_WORDS
+    ]
+
+
+class InMemorySearchBackend(BaseSearchBackend):
+    """Pure-Python inverted index over the same fields as the PostgreSQL vector"""
+
+    def __init__(self):
+        self.fuzzy_cutoff = getattr(settings, 'PRODUCT_SEARCH_FUZZY_CUTOFF', 0.75)
+        self.max_results = getattr(settings, 'PRODUCT_SEARCH_MAX_RESULTS', 500)
+        self._lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        """Forget the index; it is rebuilt from the database on the next search"""
+        with self._lock:
+            self._built = False
+            self._postings = defaultdict(dict)  # term -> {product_id: weight}
+            self._documents = {}  # product_id -> set of terms
+            self._vocabulary = None
+
+    def _ensure_built(self):
+        if not self._built:
+            with self._lock:
+                if not self._built:
+                    self._add_rows(Product.objects.values('pk', *(field for field, _ in FIELD_WEIGHTS)))
+                    self._built = True
+
+    def _add_rows(self, rows):
+        for row in rows:
+            product_id = row['pk']
+            self._discard(product_id)
+            weights = defaultdict(float)
+            for field, weight in FIELD_WEIGHTS:
+                for term in tokenize(row[field]):
+                    weights[term] += weight
+            for term, weight in weights.items():
+                self._postings[term][product_id] = weight
+            self._documents[product_id] = set(weights)
+        self._vocabulary = None
+
+    def _discard(self, product_id):
+        for term in self._documents.pop(product_id, ()):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(product_id, None)
+                if not postings:
+                    del self._postings[term]
+        self._vocabulary = None
+
+    def _sorted_vocabulary(self):
+        if self._vocabulary is None:
+            self._vocabulary = sorted(self._postings)
+        return self._vocabulary
+
+    def _expand(self, token, fuzzy):
+        """Index terms a query token matches: prefix matches, or near spellings"""
+        if fuzzy:
+            return difflib.get_close_matches(token, self._sorted_vocabulary(), n=3, cutoff=self.fuzzy_cutoff)
+        vocabulary = self._sorted_vocabulary()
+        position = bisect_left(vocabulary, token)
+        terms = []
+        while position < len(vocabulary) and vocabulary[position].startswith(token):
+            terms.append(vocabulary[position])
+            position += 1
+        return terms
+
+    def _score(self, tokens, fuzzy):
+        total = len(self._documents) or 1
+        scores = None
+        for token in tokens:
+            token_scores = defaultdict(float)
+            for term in self._expand(token, fuzzy):
+                postings = self._postings[term]
+                idf = math.log(1 + total / len(postings))
+                for product_id, weight in postings.items():
+                    token_scores[product_id] += weight * idf
+            if fuzzy:
+                # Typo fallback matches any token
+                scores = token_scores if scores is None else {
+                    pk: scores.get(pk, 0) + token_scores.get(pk, 0) for pk in scores.keys() | token_scores.keys()
+                }
+            else:
+                # Every token has to match, like the websearch query on PostgreSQL
+                scores = token_scores if scores is None else {
+                    pk: score + token_scores[pk] for pk, score in scores.items() if pk in token_scores
+                }
+        return scores or {}
+
+    def search(self, query, queryset=None):
+        if queryset is None:
+            queryset = Product.objects.all()
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        self._ensure_built()
+        with self._lock:
+            scores = self._score(tokens, fuzzy=False) or self._score(tokens, fuzzy=True)
+        if not scores:
+            return queryset.none()
+
+        # Rank in Python; the query only carries the best max_results ids
+        best = heapq.nlargest(self.max_results, scores.items(), key=itemgetter(1))
+        return queryset.filter(pk__in=[pk for pk, _ in best]).annotate(
+            rank=Case(*[When(pk=pk, then=Value(score)) for pk, score in best], output_field=FloatField())
+        ).order_by('-rank', '-created_at', '-id')
+
+    def index_products(self, product_ids):
+        if self._built:
+            rows = Product.objects.filter(pk__in=list(product_ids)).values(
+                'pk', *(field for field, _ in FIELD_WEIGHTS)
+            )
+            with self._lock:
+                self._add_rows(rows)
+
+    def index_category(self, category):
+        if self._built:
+            rows = Product.objects.filter(category=category).values('pk', *(field for field, _ in FIELD_WEIGHTS))
+            with self._lock:
+                self._add_rows(rows)
+
+    def remove_products(self, product_ids):
+        with self._lock:
+            for product_id in product_ids:
+                self._discard(product_id)
+
+    def rebuild(self):
+        self.clear()
+        self._ensure_built()
+
+
+@lru_cache(maxsize=None)
+def get_search_backend():
+    """Return the configured search backend (``PRODUCT_SEARCH_BACKEND``)
+
+    Without an explicit setting PostgreSQL databases use full-text search
+    and every other database the in-memory index.
+    """
+    path = getattr(settings, 'PRODUCT_SEARCH_BACKEND', '')
+    if path:
+        return import_string(path)()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return InMemorySearchBackend()
@@ -0,0 +1,84 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from core import images
+from . import cache, facets, homepage, tasks
+from .models import Category, Product, ProductImage
+from .search import get_search_backend
+
+
+# Keep the search index current
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Reindex a product whenever it is saved"""
+    get_search_backend().index_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def sync_product_sizes(sender, instance, update_fields=None, **kwargs):
+    """Keep the indexed sizes in step with available_sizes"""
+    if update_fields is None or 'available_sizes' in update_fields:
+        facets.sync_sizes([instance])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Drop a deleted product from the search index"""
+    get_search_backend().remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+def index_category_products(sender, instance, created, **kwargs):
+    """Reindex the products of a category, whose name is part of their search text"""
+    if not created:
+        get_search_backend().index_category(instance)
+
+
+@receiver(post_save, sender=ProductImage)
+def build_image_derivatives(sender, instance, **kwargs):
+    """Resize a newly uploaded or mirrored image in the background"""
+    if images.needs_derivatives(instance, 'image', 'derivatives'):
+        images.schedule(instance, 'image', 'derivatives')
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def touch_product(sender, instance, **kwargs):
+    """Image changes count as product changes for cached cards and conditional GET"""
+    Product.objects.filter(pk=instance.product_id).update(updated_at=timezone.now())
+
+
+# Invalidate cached catalog reads
+@receiver([post_save, post_delete], sender=Category)
+def invalidate_category_cache(sender, **kwargs):
+    """Category changes show up in the sidebar, on product pages and in search facets"""
+    # Bumping before the commit would let a concurrent read cache the old rows under the new version
+    transaction.on_commit(
+        lambda: cache.catalog_cache.bump(cache.CATEGORIES, cache.FACETS, cache.PRODUCT, cache.RELATED)
+    )
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_product_cache(sender, **kwargs):
+    """Product and image changes show up on product pages, related product lists and facet counts"""
+    transaction.on_commit(lambda: cache.catalog_cache.bump(cache.FACETS, cache.PRODUCT, cache.RELATED))
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+def invalidate_homepage(sender, **kwargs):
+    """Drop the precomputed homepage and queue its rebuild"""
+    homepage.invalidate()
+
+
+@receiver(post_save, sender=Product)
+def queue_cache_warming(sender, instance, **kwargs):
+    """Refill the invalidated entries in the background rather than on the next page view"""
+    # A worker's local memory cache is its own, so warming it would help no page view
+    if not cache.catalog_cache.is_shared:
+        return
+    tasks.warm_product_cache.enqueue(
+        instance.pk, idempotency_key=f'warm-product:{instance.pk}:{instance.updated_at.timestamp()}',
+    )
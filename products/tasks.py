@@ -0,0 +1,25 @@
+from core.tasks import task
+from . import cache, homepage
+from .cards import render_cards
+from .models import Product
+
+
+@task(queue='cache')
+def warm_product_cache(product_id):
+    """Refill a saved product's detail, related products and card entries
+
+    Only useful with a cache shared between processes (Redis or Memcached);
+    a worker's local memory cache is its own.
+    """
+    slug = Product.objects.filter(pk=product_id, is_available=True).values_list('slug', flat=True).first()
+    product = cache.product_detail(slug) if slug else None
+    if product is None:
+        return
+    render_cards(Product.objects.filter(pk=product_id).for_listing())
+    render_cards(cache.related_products(product), 'related')
+
+
+@task(queue='cache')
+def refresh_homepage():
+    """Rebuild the homepage payload after catalog changes (see products.homepage)"""
+    homepage.refresh()
@@ -0,0 +1,11 @@
+from django import template
+
+from products.cards import render_cards
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_cards(products, variant='grid'):
+    """Rendered cards for a page of products: {% product_cards products as cards %}"""
+    return render_cards(products, variant)
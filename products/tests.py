@@ -1,3 +1,709 @@
-from django.test import TestCase
+import importlib
+import tempfile
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest.mock import patch
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.models import AnonymousUser, User
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.http import HttpResponse
+from django.template.loader import get_template
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+
+from cart.checkout import place_order
+from cart.models import Cart, CartItem
+from core.models import Task
+from core.query_budget import QueryBudgetExceeded, query_budget
+from . import conditional, homepage, recommendations, urls
+from .cache import PRODUCT, active_categories, catalog_cache, product_detail, related_products
+from .cards import render_cards
+from .catalog_io import CatalogImporter
+from .models import Category, Product, ProductImage
+from .pagination import CursorPaginator
+from .search import InMemorySearchBackend, get_search_backend
+
+
+class ListingQueryCountTests(TestCase):
+    """Listing pages load with a fixed number of queries, however many products they show"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Graphic Tees')
+        cls.user = User.objects.create_user('shopper', password='secret-pass-123')
+
+    def setUp(self):
+        get_search_backend().clear()
+        catalog_cache.cache.clear()
+
+    def add_products(self, count):
+        for _ in range(count):
+            number = Product.objects.count()
+            product = Product.objects.create(
+                category=self.category,
+                name=f'Graphic Tee {number}',
+                description='Soft cotton tee',
+                price=Decimal('499.00'),
+                stock=5,
+            )
+            ProductImage.objects.create(product=product, image_url=f'https://example.com/{number}-a.jpg')
+            ProductImage.objects.create(product=product, image_url=f'https://example.com/{number}-b.jpg', is_primary=True)
+
+    def assertConstantQueries(self, url, data=None):
+        """Fetch url with 1 and then 10 products and check the query count stays the same"""
+        self.add_products(1)
+        self.client.get(url, data)  # warm up lazily built state such as the search index
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, data)
+        expected = len(queries)
+        self.add_products(9)
+        self.client.get(url, data)  # and again for state the new products invalidated, such as facet counts
+        with self.assertNumQueries(expected):
+            response = self.client.get(url, data)
+        return response
+
+    def test_product_list(self):
+        self.client.force_login(self.user)
+        response = self.assertConstantQueries(reverse('products:product_list'))
+        self.assertTrue(response.context['products'][0].primary_image.is_primary)
+
+    def test_category_products(self):
+        self.assertConstantQueries(reverse('products:category_products', args=[self.category.slug]))
+
+    def test_search(self):
+        self.assertConstantQueries(reverse('products:search'), {'q': 'graphic'})
+
+    def test_category_list(self):
+        response = self.assertConstantQueries(reverse('products:category_list'))
+        self.assertEqual(response.context['categories'][0].product_count, 10)
+
+
+class QueryBudgetTests(TestCase):
+
+    def setUp(self):
+        self.request = RequestFactory().get('/products/')
+
+        @query_budget(1)
+        def view(request):
+            list(Category.objects.all())
+            list(Product.objects.all())
+            return HttpResponse()
+        self.view = view
+
+    def test_over_budget_raises_in_the_test_suite(self):
+        with self.assertRaises(QueryBudgetExceeded):
+            self.view(self.request)
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_over_budget_logs_when_disabled(self):
+        with self.assertLogs('core.query_budget', level='WARNING'):
+            self.assertEqual(self.view(self.request).status_code, 200)
+
+
+class InMemorySearchTests(TestCase):
+
+    @override_settings(PRODUCT_SEARCH_MAX_RESULTS=3)
+    def test_only_the_best_matches_reach_the_database(self):
+        category = Category.objects.create(name='Basics')
+        for index in range(10):
+            Product.objects.create(
+                category=category, name=f'{"Shirt" if index % 2 else "Tee"} {index}', description='Cotton tee',
+                price=Decimal('399.00'),
+            )
+        with CaptureQueriesContext(connection) as queries:
+            results = list(InMemorySearchBackend().search('tee'))
+        self.assertEqual(len(results), 3)
+        # Name matches outrank description-only ones
+        self.assertTrue(all(product.name.startswith('Tee') for product in results))
+        self.assertLess(queries[-1]['sql'].count(' WHEN '), 4)
+
+
+class SearchPaginationTests(TestCase):
+
+    def test_tied_ranks_page_without_gaps_or_repeats(self):
+        category = Category.objects.create(name='Basics')
+        products = [
+            Product.objects.create(category=category, name=f'Tee {index}', description='Cotton', price=Decimal('399.00'))
+            for index in range(10)
+        ]
+        matches = get_search_backend().search('tee')
+        self.assertEqual(len({product.rank for product in matches}), 1)
+
+        seen, cursor = [], None
+        # Bounded: a cursor that misses the tie-break hands back the same page forever
+        for _ in range(len(products)):
+            page = CursorPaginator(matches, 4).page(cursor)
+            seen += [product.pk for product in page]
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(sorted(seen), sorted(product.pk for product in products))
+        self.assertEqual(len(seen), len(products))
+
+
+class CatalogCacheTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        catalog_cache.reset_stats()
+        self.category = Category.objects.create(name='Plain Tees')
+        self.product = Product.objects.create(
+            category=self.category, name='Plain White Tee', description='Cotton', price=Decimal('399.00')
+        )
+
+    def test_product_detail_is_served_from_cache(self):
+        url = self.product.get_absolute_url()
+        self.client.get(url)
+        # Only the conditional GET validator query reaches the database
+        with self.assertNumQueries(1):
+            response = self.client.get(url)
+        self.assertEqual(response.context['product'], self.product)
+        self.assertEqual(catalog_cache.stats()[PRODUCT], {'hits': 1, 'misses': 1})
+
+    def test_cache_warming_is_only_queued_for_a_shared_cache(self):
+        warming = Task.objects.filter(name='products.tasks.warm_product_cache')
+        self.product.save()
+        self.assertFalse(warming.exists())
+
+        with patch.object(type(catalog_cache), 'is_shared', True):
+            self.product.save()
+        self.assertEqual(warming.count(), 1)
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=3600, CATALOG_LOCAL_CACHE_SECONDS=30)
+    def test_local_memory_entries_expire_soon(self):
+        # Another process's bump never reaches this cache, so its entries must not outlive a short window
+        self.assertEqual(catalog_cache.get_timeout(), 30)
+        self.assertEqual(catalog_cache.get_timeout(300), 30)
+        with patch.object(type(catalog_cache), 'is_shared', True):
+            self.assertEqual(catalog_cache.get_timeout(), 3600)
+            self.assertEqual(catalog_cache.get_timeout(300), 300)
+
+    def test_saves_invalidate_cached_reads(self):
+        self.assertEqual(active_categories(), [self.category])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.is_active = False
+            self.category.save()
+            # Until the save commits, other readers only see the old rows; the cached copy stays
+            self.assertEqual(active_categories(), [self.category])
+        self.assertEqual(active_categories(), [])
+
+        self.assertEqual(product_detail(self.product.slug).name, 'Plain White Tee')
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductImage.objects.create(product=self.product, image_url='https://example.com/tee.jpg')
+        self.assertEqual(len(product_detail(self.product.slug).images.all()), 1)
+
+
+class ProductCardTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        category = Category.objects.create(name='Plain Tees')
+        self.products = [
+            Product.objects.create(
+                category=category, name=f'Plain Tee {number}', description='Cotton', price=Decimal('399.00'), stock=5,
+            )
+            for number in range(3)
+        ]
+
+    def listing(self):
+        return list(Product.objects.filter(pk__in=[product.pk for product in self.products]).for_listing())
+
+    def test_only_cache_misses_are_rendered(self):
+        cards = render_cards(self.listing())
+        self.assertIn('Plain Tee 2', ''.join(cards))
+
+        with self.assertTemplateNotUsed('products/includes/product_card.html'):
+            self.assertEqual(render_cards(self.listing()), cards)
+
+        self.products[0].stock = 0
+        self.products[0].save()
+        rendered = []
+        with patch('products.cards.get_template', side_effect=lambda name: rendered.append(name) or get_template(name)):
+            cards = render_cards(self.listing())
+        self.assertEqual(len(rendered), 1)
+        self.assertIn('Out of Stock', cards[[product.pk for product in self.listing()].index(self.products[0].pk)])
+
+    def test_image_changes_refresh_cards(self):
+        render_cards(self.listing())
+        ProductImage.objects.create(product=self.products[1], image_url='https://example.com/new.jpg', is_primary=True)
+        self.assertIn('https://example.com/new.jpg', ''.join(render_cards(self.listing())))
+
+    def test_listing_fetches_cards_in_one_cache_read(self):
+        url = reverse('products:product_list')
+        self.client.get(url)
+        with patch.object(catalog_cache.cache, 'get_many', wraps=catalog_cache.cache.get_many) as get_many:
+            response = self.client.get(url)
+        get_many.assert_called_once()
+        self.assertContains(response, 'Plain Tee 1')
+
+
+class ConditionalGetTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        self.category = Category.objects.create(name='Plain Tees')
+        self.product = Product.objects.create(
+            category=self.category, name='Plain White Tee', description='Cotton', price=Decimal('399.00'), stock=5,
+        )
+        self.urls = [
+            self.product.get_absolute_url(),
+            reverse('products:category_products', args=[self.category.slug]),
+            reverse('products:category_list'),
+        ]
+
+    def test_unchanged_pages_are_not_modified(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertIn('Last-Modified', response)
+                with self.assertNumQueries(1), self.assertTemplateNotUsed('products/base_products.html'):
+                    revalidated = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(revalidated.status_code, 304)
+                self.assertEqual(revalidated['ETag'], response['ETag'])
+                self.assertEqual(
+                    self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304,
+                )
+
+    def test_product_changes_invalidate_validators(self):
+        etags = [self.client.get(url)['ETag'] for url in self.urls]
+        self.product.price = Decimal('349.00')
+        self.product.save()
+        for url, etag in zip(self.urls, etags):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_partial_sales_refresh_the_product_page(self):
+        url = self.product.get_absolute_url()
+        response = self.client.get(url)
+        self.assertContains(response, '5 units')
+
+        cart = Cart.objects.create(user=User.objects.create_user('buyer'))
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            place_order(cart.user)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '3 units')
+
+    def test_cart_changes_invalidate_validators(self):
+        user = User.objects.create_user('shopper', password='secret-pass-123')
+        self.client.force_login(user)
+        url = self.product.get_absolute_url()
+        response = self.client.get(url)
+        self.assertIn('private', response['Cache-Control'])
+
+        self.client.post(reverse('cart:add_to_cart'), {'product_id': self.product.pk, 'quantity': 1, 'size': 'M'})
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_anonymous_pages_are_publicly_cacheable(self):
+        response = self.client.get(self.urls[1])
+        self.assertIn('public', response['Cache-Control'])
+        self.assertIn('s-maxage=60', response['Cache-Control'])
+        self.assertNotIn(settings.CSRF_COOKIE_NAME, response.cookies)
+
+    def test_pages_with_a_csrf_token_or_message_stay_private(self):
+        # The product page's add-to-cart form carries a CSRF token
+        response = self.client.get(self.urls[0])
+        self.assertContains(response, 'csrfmiddlewaretoken')
+        self.assertIn(settings.CSRF_COOKIE_NAME, response.cookies)
+        self.assertIn('private', response['Cache-Control'])
+        self.assertNotIn('s-maxage', response['Cache-Control'])
+
+        self.client.cookies.clear()
+        request = RequestFactory().get(self.urls[1])
+        request.user, request._messages = AnonymousUser(), CookieStorage(request)
+        messages.info(request, 'Welcome back')
+        self.assertFalse(conditional._shareable(request, HttpResponse()))
+
+    def test_missing_pages_are_not_conditional(self):
+        response = self.client.get(reverse('products:product_detail', args=['no-such-tee']))
+        self.assertEqual(response.status_code, 404)
+        self.assertNotIn('ETag', response)
+
+
+class FacetedFilteringTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        get_search_backend().clear()
+        category = Category.objects.create(name='Basics')
+        self.black = Product.objects.create(
+            category=category, name='Black Cotton Tee', description='Tee', price=Decimal('399.00'),
+            color='Black', fabric='100% Cotton', available_sizes='S, m', stock=5,
+        )
+        self.white = Product.objects.create(
+            category=category, name='White Linen Tee', description='Tee', price=Decimal('999.00'),
+            discount_price=Decimal('799.00'), color='White', fabric='Linen', available_sizes='M,L', stock=0,
+        )
+        # A zero discount_price means no discount, as in Product.final_price
+        self.linen = Product.objects.create(
+            category=category, name='Black Linen Tee', description='Tee', price=Decimal('1500.00'),
+            discount_price=Decimal('0.00'), color='Black', fabric='Linen', available_sizes='XL,3XL', stock=3,
+        )
+
+    def facet_counts(self, response):
+        return {
+            facet['name']: {option['value']: option['count'] for option in facet['options']}
+            for facet in response.context['facets']
+        }
+
+    def test_sizes_are_normalised_into_rows(self):
+        self.assertEqual(list(self.black.sizes.values_list('size', flat=True)), ['M', 'S'])
+        self.assertEqual(list(self.linen.sizes.values_list('size', flat=True)), ['XL'])
+        self.black.available_sizes = 'XS'
+        self.black.save()
+        self.assertEqual(list(self.black.sizes.values_list('size', flat=True)), ['XS'])
+
+    def test_filters_combine_and_count_other_facets(self):
+        response = self.client.get(reverse('products:product_list'), {'size': ['m', 'XL'], 'color': 'Black'})
+
+        self.assertEqual({product.pk for product in response.context['products']}, {self.black.pk, self.linen.pk})
+        counts = self.facet_counts(response)
+        # A facet's counts ignore its own filter, so the alternatives stay visible
+        self.assertEqual(counts['color'], {'Black': 2, 'White': 1})
+        self.assertEqual(counts['size'], {'S': 1, 'M': 1, 'XL': 1})
+        self.assertEqual(counts['price'], {'under-500': 1, '1000-1999': 1})
+        self.assertEqual(response.context['facet_query'], 'size=M&size=XL&color=Black')
+
+        response = self.client.get(reverse('products:product_list'), {'price': '500-999'})
+        self.assertEqual([product.pk for product in response.context['products']], [self.white.pk])
+        response = self.client.get(reverse('products:product_list'), {'price': '1000-1999'})
+        self.assertEqual([product.pk for product in response.context['products']], [self.linen.pk])
+        response = self.client.get(reverse('products:product_list'), {'in_stock': '1', 'fabric': 'Linen'})
+        self.assertEqual([product.pk for product in response.context['products']], [self.linen.pk])
+
+    def test_search_results_are_faceted(self):
+        response = self.client.get(reverse('products:search'), {'q': 'linen', 'color': 'White'})
+
+        self.assertEqual([product.pk for product in response.context['products']], [self.white.pk])
+        self.assertEqual(self.facet_counts(response)['fabric'], {'Linen': 1})
+        self.assertIn('q=linen', response.context['facets'][0]['options'][0]['query'])
+
+    def test_search_facets_are_cached_under_a_safe_key(self):
+        with patch.object(catalog_cache, 'get_or_set', wraps=catalog_cache.get_or_set) as get_or_set:
+            self.client.get(reverse('products:search'), {'q': '  Linen\tTee '})
+            self.client.get(reverse('products:search'), {'q': 'linen tee'})
+        keys = {call.args[1] for call in get_or_set.call_args_list if call.args[0] == 'facets'}
+        self.assertEqual(len(keys), 1)
+        self.assertRegex(keys.pop(), r'^search:[0-9a-f]{32}$')
+
+    def test_facet_counts_are_cached_until_a_product_changes(self):
+        url = reverse('products:product_list')
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'color': 'White'})
+        self.assertFalse(any('GROUP BY' in query['sql'] for query in queries))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.white.color = 'Black'
+            self.white.save()
+        self.assertEqual(self.facet_counts(self.client.get(url))['color'], {'Black': 3})
+
+
+class AsyncCatalogViewTests(TestCase):
+    """The async catalog views, as mystore.asgi routes them"""
+
+    def setUp(self):
+        def route_views():
+            importlib.reload(urls)
+            clear_url_caches()
+
+        # Cleanups run last in, first out: restore the sync views after the settings
+        self.addCleanup(route_views)
+        # Concurrent queries would run on connections outside the test transaction
+        self.enterContext(override_settings(CATALOG_ASYNC_VIEWS=True, ASYNC_CONCURRENT_QUERIES=False))
+        route_views()
+        catalog_cache.cache.clear()
+        get_search_backend().clear()
+        self.category = Category.objects.create(name='Plain Tees')
+        self.product = Product.objects.create(
+            category=self.category, name='Plain White Tee', description='Cotton', price=Decimal('399.00'), stock=5,
+        )
+        Product.objects.create(
+            category=self.category, name='Plain Black Tee', description='Cotton', price=Decimal('399.00'), stock=5,
+        )
+
+    async def test_pages_render_like_the_sync_views(self):
+        pages = [
+            (reverse('products:product_list'), 'products/product_list.html', 'Plain Black Tee'),
+            (reverse('products:category_list'), 'products/category_list.html', '2 Products'),
+            (reverse('products:category_products', args=[self.category.slug]), 'products/product_list.html', 'Plain Black Tee'),
+            (self.product.get_absolute_url(), 'products/product_detail.html', 'Plain Black Tee'),
+            (reverse('products:search') + '?q=plain', 'products/search_results.html', 'Plain White Tee'),
+        ]
+        for url, template, text in pages:
+            with self.subTest(url=url):
+                response = await self.async_client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTemplateUsed(response, template)
+                self.assertIn(text, response.content.decode())
+
+        response = await self.async_client.get(self.product.get_absolute_url())
+        self.assertEqual([product.name for product in response.context['related_products']], ['Plain Black Tee'])
+
+    async def test_missing_pages_are_404(self):
+        for url in [
+            reverse('products:product_detail', args=['no-such-tee']),
+            reverse('products:category_products', args=['no-such-category']),
+        ]:
+            with self.subTest(url=url):
+                self.assertEqual((await self.async_client.get(url)).status_code, 404)
+
+    async def test_unchanged_pages_are_not_modified(self):
+        url = self.product.get_absolute_url()
+        response = await self.async_client.get(url)
+        revalidated = await self.async_client.get(url, headers={'if-none-match': response['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+
+
+class RelatedProductsTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        tees = Category.objects.create(name='Tees')
+        hoodies = Category.objects.create(name='Hoodies')
+        self.tee = Product.objects.create(category=tees, name='Black Tee', description='Tee', price=Decimal('499'), color='Black')
+        self.twin = Product.objects.create(category=tees, name='Black Tee Twin', description='Tee', price=Decimal('499'), color='Black')
+        self.other = Product.objects.create(category=tees, name='Red Tee', description='Tee', price=Decimal('2499'), color='Red')
+        self.hoodie = Product.objects.create(category=hoodies, name='Grey Hoodie', description='Hoodie', price=Decimal('1499'))
+        for username in ('first', 'second'):
+            cart = Cart.objects.create(user=User.objects.create_user(username))
+            CartItem.objects.create(cart=cart, product=self.tee)
+            CartItem.objects.create(cart=cart, product=self.hoodie)
+
+    def test_scores_cart_co_occurrence_and_attributes(self):
+        scored = recommendations.score_products([self.tee.pk])[self.tee.pk]
+        ranked = [product_id for product_id, _ in scored]
+        # Bought together beats same category; matching attributes break the tie within it
+        self.assertEqual(ranked, [self.hoodie.pk, self.twin.pk, self.other.pk])
+
+    def test_incremental_run_only_rescores_changed_products(self):
+        run = recommendations.run()
+        self.assertTrue(run.is_full)
+        self.assertEqual(run.products_updated, 4)
+        self.assertEqual(related_products(self.tee)[0], self.hoodie)
+
+        cart = Cart.objects.create(user=User.objects.create_user('third'))
+        CartItem.objects.create(cart=cart, product=self.other)
+        run = recommendations.run()
+        self.assertFalse(run.is_full)
+        self.assertEqual(run.products_updated, 1)
+
+    def test_orders_keep_co_occurrence_after_checkout_empties_the_cart(self):
+        Product.objects.filter(pk__in=[self.other.pk, self.hoodie.pk]).update(stock=5)
+        for username in ('third', 'fourth', 'fifth'):
+            user = User.objects.create_user(username)
+            cart = Cart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=self.other)
+            CartItem.objects.create(cart=cart, product=self.hoodie)
+            place_order(user)
+        self.assertFalse(CartItem.objects.filter(product=self.other).exists())
+
+        ranked = [product_id for product_id, _ in recommendations.score_products([self.other.pk])[self.other.pk]]
+        self.assertEqual(ranked[0], self.hoodie.pk)
+
+    def test_attributes_are_loaded_once_per_run(self):
+        with CaptureQueriesContext(connection) as queries:
+            recommendations.run(full=True, batch_size=1)
+        attribute_loads = [query for query in queries if '"products_product"."color"' in query['sql']]
+        self.assertEqual(len(attribute_loads), 1)
+
+
+class HomepageTests(TestCase):
+
+    def setUp(self):
+        catalog_cache.cache.clear()
+        self.category = Category.objects.create(name='Graphic Tees', description='Bold prints')
+        self.featured = Product.objects.create(
+            category=self.category, name='Featured Tee', description='Cotton', price=Decimal('500.00'), is_featured=True,
+        )
+        self.small_deal = Product.objects.create(
+            category=self.category, name='Small Deal Tee', description='Cotton', price=Decimal('500.00'),
+            discount_price=Decimal('450.00'),
+        )
+        self.big_deal = Product.objects.create(
+            category=self.category, name='Big Deal Tee', description='Cotton', price=Decimal('500.00'),
+            discount_price=Decimal('250.00'),
+        )
+        self.plain = Product.objects.create(
+            category=self.category, name='Plain Tee', description='Cotton', price=Decimal('300.00'),
+            discount_price=Decimal('0.00'),
+        )
+
+    def test_homepage_makes_no_catalog_queries_once_built(self):
+        homepage.refresh()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('core:home'))
+        self.assertContains(response, 'Featured Tee')
+        self.assertContains(response, self.category.get_absolute_url())
+        self.assertNotContains(response, 'Add to Cart')
+
+    def test_blocks_show_featured_deals_and_new_arrivals_once_each(self):
+        self.assertEqual(homepage.block_products('featured'), [self.featured])
+        self.assertEqual(homepage.block_products('deals'), [self.big_deal, self.small_deal])
+        self.assertGreater(self.big_deal.discount_percentage, self.small_deal.discount_percentage)
+
+        blocks = {block['key']: ''.join(block['cards']) for block in homepage.build()['blocks']}
+        self.assertIn('Featured Tee', blocks['featured'])
+        self.assertIn('Big Deal Tee', blocks['deals'])
+        self.assertEqual(blocks['new_arrivals'].count('class="product-link"'), 1)
+        self.assertIn('Plain Tee', blocks['new_arrivals'])
+
+    def featured_cards(self, response):
+        return ''.join(response.context['homepage']['blocks'][0]['cards'])
+
+    def test_web_reads_see_catalog_changes_without_a_worker(self):
+        self.assertNotIn('Plain Tee', self.featured_cards(self.client.get(reverse('core:home'))))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain.is_featured = True
+            self.plain.save()
+
+        self.assertIn('Plain Tee', self.featured_cards(self.client.get(reverse('core:home'))))
+        # A worker could not refresh this process's local memory cache, so nothing was queued for one
+        self.assertFalse(Task.objects.filter(name='products.tasks.refresh_homepage').exists())
+
+    @override_settings(HOMEPAGE_REFRESH_SECONDS=3600)
+    def test_catalog_changes_share_one_refresh_per_window(self):
+        self.enterContext(patch.object(type(catalog_cache), 'is_shared', True))
+        Task.objects.all().delete()
+        self.plain.name = 'Plainer Tee'
+        self.plain.save()
+        self.featured.is_featured = False
+        self.featured.save()
+        self.assertEqual(Task.objects.filter(name='products.tasks.refresh_homepage').count(), 1)
+
+    @override_settings(TASKS_EAGER=True)
+    def test_catalog_changes_refresh_the_payload(self):
+        self.enterContext(patch.object(type(catalog_cache), 'is_shared', True))
+        homepage.refresh()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.plain.is_featured = True
+            self.plain.save()
+        with self.assertNumQueries(0):
+            featured = homepage.payload()['blocks'][0]
+        self.assertIn('Plain Tee', ''.join(featured['cards']))
+
+
+class GenerateCatalogTests(TestCase):
+
+    def test_generates_the_requested_catalog_in_batches(self):
+        call_command(
+            'generate_catalog', products=25, categories=3, images=2, users=4, cart_items=2,
+            batch_size=10, stdout=StringIO(),
+        )
+
+        self.assertEqual(Product.objects.count(), 25)
+        self.assertEqual(Category.objects.count(), 3)
+        self.assertEqual(ProductImage.objects.filter(is_primary=True).count(), 25)
+        self.assertEqual(CartItem.objects.count(), 8)
+        self.assertFalse(Cart.objects.with_computed_totals().exclude(item_count=F('computed_item_count')).exists())
+
+
+class CatalogImportExportTests(TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+
+    def import_file(self, name, content, **options):
+        path = self.directory / name
+        path.write_text(content)
+        stdout, stderr = StringIO(), StringIO()
+        call_command('import_catalog', str(path), batch_size=2, stdout=stdout, stderr=stderr, **options)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_upserts_by_slug_and_replaces_images(self):
+        self.import_file('catalog.csv', (
+            'slug,name,category,price,discount_price,stock,images\n'
+            'plain-tee,Plain Tee,Basics,500,450,10,https://img.test/a.jpg|https://img.test/b.jpg\n'
+            'polo,Polo,Basics,800,,5,https://img.test/c.jpg\n'
+            ',Graphic Tee,Graphics,600,,3,\n'
+        ))
+        self.import_file('update.jsonl', (
+            '{"slug": "plain-tee", "name": "Plain Tee", "category": "Basics", "price": "520", '
+            '"stock": 7, "images": ["https://img.test/b.jpg"]}\n'
+        ))
+
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertEqual(Category.objects.count(), 2)
+        tee = Product.objects.get(slug='plain-tee')
+        self.assertEqual((tee.price, tee.discount_price, tee.stock), (Decimal('520.00'), None, 7))
+        self.assertEqual(list(tee.images.values_list('image_url', 'is_primary')), [('https://img.test/b.jpg', True)])
+        self.assertTrue(Product.objects.filter(slug='graphic-tee', category__name='Graphics').exists())
+
+    def test_reports_bad_rows_without_aborting(self):
+        stdout, stderr = self.import_file('catalog.csv', (
+            'name,category,price,stock\n'
+            'Good Tee,Basics,500,1\n'
+            'No Price,Basics,,1\n'
+            'Bad Stock,Basics,500,lots\n'
+            'Another Tee,Basics,400,2\n'
+        ), errors_file=str(self.directory / 'errors.txt'))
+
+        self.assertEqual(Product.objects.count(), 2)
+        self.assertIn('line 3: price is required', stderr)
+        self.assertIn('line 4: stock must be a whole number', stderr)
+        self.assertEqual(len((self.directory / 'errors.txt').read_text().splitlines()), 2)
+        self.assertIn('2 row(s) rejected', stdout)
+
+    def test_counts_only_rows_that_were_written(self):
+        replace_images = CatalogImporter.replace_images
+
+        def failing_replace_images(importer, with_images):
+            if any(product.name == 'Broken Tee' for product, _ in with_images):
+                raise ValueError('image store unavailable')
+            return replace_images(importer, with_images)
+
+        with patch.object(CatalogImporter, 'replace_images', failing_replace_images):
+            stdout, stderr = self.import_file('catalog.csv', (
+                'name,category,price,stock,images\n'
+                'Good Tee,Basics,500,1,https://img.test/a.jpg\n'
+                'Broken Tee,Basics,500,1,https://img.test/b.jpg\n'
+            ))
+
+        # The batch rolled back and was retried row by row
+        self.assertEqual(list(Product.objects.values_list('name', flat=True)), ['Good Tee'])
+        self.assertIn('Imported 1 products (1 created, 0 updated, 1 images)', stdout)
+        self.assertIn('image store unavailable', stderr)
+
+    def test_generates_unique_slugs_for_new_products(self):
+        Product.objects.create(
+            name='Tee', slug='tee', category=Category.objects.create(name='Basics'), price=Decimal('100'),
+        )
+        self.import_file('catalog.jsonl', ''.join(
+            '{"name": "Tee", "category": "Basics", "price": "100"}\n' for _ in range(3)
+        ))
+
+        self.assertEqual(
+            sorted(Product.objects.values_list('slug', flat=True)), ['tee', 'tee-2', 'tee-3', 'tee-4'],
+        )
+
+    def test_export_round_trips_through_import(self):
+        self.import_file('catalog.csv', (
+            'slug,name,category,price,discount_price,stock,is_featured,images\n'
+            'plain-tee,"Plain Tee, White",Basics,500,450,10,true,https://img.test/a.jpg|https://img.test/b.jpg\n'
+            'polo,Polo,Basics,800,,5,false,\n'
+        ))
+        for name in ('export.csv', 'export.jsonl.gz'):
+            path = self.directory / name
+            call_command('export_catalog', str(path), stdout=StringIO())
+            before = list(Product.objects.order_by('pk').values())
+            stdout = StringIO()
+            call_command('import_catalog', str(path), stdout=stdout, stderr=StringIO())
+
+            self.assertIn('0 created, 2 updated', stdout.getvalue())
+            after = list(Product.objects.order_by('pk').values())
+            for row in before + after:
+                row.pop('updated_at')
+            self.assertEqual(after, before)
+            self.assertEqual(ProductImage.objects.count(), 2)
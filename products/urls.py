@@ -1,12 +1,16 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
 
 app_name = 'products'
 
+# mystore.asgi serves the async variants of the catalog views
+catalog = async_views if settings.CATALOG_ASYNC_VIEWS else views
+
 urlpatterns = [
-    path('', views.ProductListView.as_view(), name='product_list'),
-    path('categories/', views.CategoryListView.as_view(), name='category_list'),
-    path('search/', views.ProductSearchView.as_view(), name='search'),
-    path('category/<slug:slug>/', views.CategoryProductsView.as_view(), name='category_products'),
-    path('<slug:slug>/', views.ProductDetailView.as_view(), name='product_detail'),
+    path('', catalog.ProductListView.as_view(), name='product_list'),
+    path('categories/', catalog.CategoryListView.as_view(), name='category_list'),
+    path('search/', catalog.ProductSearchView.as_view(), name='search'),
+    path('category/<slug:slug>/', catalog.CategoryProductsView.as_view(), name='category_products'),
+    path('<slug:slug>/', catalog.ProductDetailView.as_view(), name='product_detail'),
 ]
@@ -1,16 +1,25 @@
 from django.shortcuts import render, get_object_or_404
-from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Q
+from django.db.models import Count
+from django.utils.decorators import method_decorator
 from django.views import View
+from django.http import Http404
+from core.query_budget import query_budget
+from . import cache, facets
+from .conditional import category_list_state, category_products_state, conditional_page, product_detail_state
+from .facets import FacetSelection
 from .models import Category, Product
+from .pagination import CursorPaginator
+from .search import get_search_backend
 
 
+@method_decorator(query_budget(7), name='get')
+@method_decorator(conditional_page(category_list_state), name='get')
 class CategoryListView(View):
     """Display all active categories"""
     
     def get(self, request, *args, **kwargs):
 
-        categories = Category.objects.filter(is_active=True)
+        categories = Category.objects.filter(is_active=True).annotate(product_count=Count('products'))
         
         context = {
             'categories': categories,
@@ -36,28 +45,26 @@ class CategoryListView(View):
         pass
 
 
+@method_decorator(query_budget(8), name='get')
 class ProductListView(View):
     """Display all available products with pagination"""
     
     def get(self, request, *args, **kwargs):
-        products = Product.objects.filter(is_available=True)
-        # .select_related('category').prefetch_related('images')
-        # Pagination
-        paginator = Paginator(products, 2)
-        page_number = request.GET.get('page')
+        listing = Product.objects.filter(is_available=True)
+        selection = FacetSelection.from_query(request.GET)
+        products = selection.filter(listing).for_listing()
+        # Keyset pagination on (-created_at, -id)
+        page_obj = CursorPaginator(products, 12).page(request.GET.get('cursor'))
         
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
-        
-        categories = Category.objects.filter(is_active=True)
+        # Counts for every filter combination come from the same cached rows
+        rows = cache.facet_rows('all', listing)
+        categories = cache.active_categories()
         
         context = {
             'products': page_obj,
             'categories': categories,
+            'facets': facets.sidebar(rows, selection),
+            'facet_query': selection.querystring(),
             'page_title': 'All T-Shirts',
             'show_sidebar': True
         }
@@ -65,6 +72,8 @@ class ProductListView(View):
         return render(request, 'products/product_list.html', context)
 
 
+@method_decorator(query_budget(9), name='get')
+@method_decorator(conditional_page(category_products_state), name='get')
 class CategoryProductsView(View):
     """Display products filtered by category"""
     
@@ -74,20 +83,12 @@ class CategoryProductsView(View):
         products = Product.objects.filter(
             category=category,
             is_available=True
-        ).select_related('category').prefetch_related('images')
-        
-        # Pagination
-        paginator = Paginator(products, 12)
-        page_number = request.GET.get('page')
+        ).for_listing()
         
-        try:
-            page_obj = paginator.page(page_number)
-        except PageNotAnInteger:
-            page_obj = paginator.page(1)
-        except EmptyPage:
-            page_obj = paginator.page(paginator.num_pages)
+        # Keyset pagination on (-created_at, -id)
+        page_obj = CursorPaginator(products, 12).page(request.GET.get('cursor'))
         
-        categories = Category.objects.filter(is_active=True)
+        categories = cache.active_categories()
         
         context = {
             'products': page_obj,
@@ -100,23 +101,19 @@ class CategoryProductsView(View):
         return render(request, 'products/product_list.html', context)
 
 
+@method_decorator(conditional_page(product_detail_state), name='get')
 class ProductDetailView(View):
     """Display detailed product information"""
     
     def get(self, request, slug, *args, **kwargs):
-        product = get_object_or_404(
-            Product.objects.select_related('category').prefetch_related('images'),
-            slug=slug,
-            is_available=True
-        )
+        product = cache.product_detail(slug)
+        if product is None:
+            raise Http404('No Product matches the given query.')
         
         # Get related products from same category
-        related_products = Product.objects.filter(
-            category=product.category,
-            is_available=True
-        ).exclude(id=product.id).prefetch_related('images')[:4]
+        related_products = cache.related_products(product)
         
-        categories = Category.objects.filter(is_active=True)
+        categories = cache.active_categories()
         
         context = {
             'product': product,
@@ -129,40 +126,35 @@ class ProductDetailView(View):
         return render(request, 'products/product_detail.html', context)
 
 
+@method_decorator(query_budget(10), name='get')
 class ProductSearchView(View):
     """Search products by keywords"""
     
     def get(self, request, *args, **kwargs):
         query = request.GET.get('q', '').strip()
+        selection = FacetSelection.from_query(request.GET)
         
         if query:
-            # Search in name, description, and meta keywords
-            products = Product.objects.filter(
-                Q(name__icontains=query) |
-                Q(description__icontains=query) |
-                Q(meta_keywords__icontains=query) |
-                Q(category__name__icontains=query),
-                is_available=True
-            ).select_related('category').prefetch_related('images').distinct()
-            
-            # Pagination
-            paginator = Paginator(products, 12)
-            page_number = request.GET.get('page')
+            # Ranked search over name, description, meta keywords and category name
+            matches = get_search_backend().search(
+                query,
+                Product.objects.filter(is_available=True)
+            )
             
-            try:
-                page_obj = paginator.page(page_number)
-            except PageNotAnInteger:
-                page_obj = paginator.page(1)
-            except EmptyPage:
-                page_obj = paginator.page(paginator.num_pages)
+            # Keyset pagination on (-rank, -created_at, -id)
+            page_obj = CursorPaginator(selection.filter(matches).for_listing(), 12).page(request.GET.get('cursor'))
+            facet_list = facets.sidebar(cache.search_facet_rows(query, matches), selection, q=query)
         else:
-            page_obj = Paginator(Product.objects.none(), 12).page(1)
+            page_obj = CursorPaginator(Product.objects.none(), 12).page()
+            facet_list = []
         
-        categories = Category.objects.filter(is_active=True)
+        categories = cache.active_categories()
         
         context = {
             'products': page_obj,
             'categories': categories,
+            'facets': facet_list,
+            'facet_query': selection.querystring(),
             'query': query,
             'page_title': f'Search Results for "{query}"' if query else 'Search Products',
             'show_sidebar': True